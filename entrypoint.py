@@ -1,10 +1,12 @@
 #!/usr/bin/env python3
 import logging
 from logging.handlers import RotatingFileHandler
-import os, sys, yaml, signal, threading, subprocess
+import os, re, sys, gzip, math, mmap, ctypes, functools, yaml, json, time, queue, random, signal, socket, struct, hashlib, platform, threading, subprocess
+from array import array
+from collections import deque, OrderedDict
 from http import HTTPStatus
 from urllib.parse import urlparse
-from flask import Flask, request, Response, redirect, url_for, jsonify
+from flask import Flask, g, request, Response, redirect, url_for, jsonify
 
 CONFIG_PATH = os.getenv("CONFIG_PATH", "/data/config.yml")
 WEB_PORT = int(os.getenv("WEB_PORT", "8081"))
@@ -14,32 +16,300 @@ os.makedirs("/data/logs", exist_ok=True)
 
 logger = logging.getLogger("rist-bonding")
 logger.setLevel(logging.INFO)
-fh = RotatingFileHandler("/data/logs/entrypoint.log", maxBytes=5*1024*1024, backupCount=2, encoding="utf-8")
-fh.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(message)s"))
-logger.addHandler(fh)
+try:
+    fh = RotatingFileHandler("/data/logs/entrypoint.log", maxBytes=5*1024*1024, backupCount=2, encoding="utf-8")
+    fh.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(message)s"))
+    logger.addHandler(fh)
+except PermissionError:
+    pass  # вспомогательный запуск не от root (bw-probe-run с uid пути) — лог только в stdout
 sh = logging.StreamHandler(sys.stdout)
 sh.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(message)s"))
 logger.addHandler(sh)
 
-procs = {"mediamtx": None, "ffmpeg": None, "rist": []}
+procs = {"mediamtx": None}  # общий для всех потоков; ffmpeg/ristsender — в streams[sid].procs
 lock = threading.RLock()
+cfg_lock = threading.Lock()  # только чтение-изменение-запись config.yml из HTTP-обработчиков
 
-def popen_logged(cmd, name, preexec=None):
-    logfile = f"/data/logs/{name}.log"
-    lf = open(logfile, "ab", buffering=0)
+# -----------------------------
+# TRACE (спаны горячего пути и события готовности → /debug/timeline)
+# -----------------------------
+# Выключено — span() отдаёт общий пустой объект, @traced зовёт функцию напрямую: одна проверка словаря.
+_trace = {"on": os.getenv("RIST_TRACE", "") not in ("", "0"), "forced": os.getenv("RIST_TRACE", "") not in ("", "0"),
+          "buf": deque(maxlen=20000)}
+_trace_ctx = threading.local()  # что сейчас делает поток: "POST /toggle", "job <id>" — попадает в спаны
+
+class _Span:
+    __slots__ = ("name", "args", "t0", "p0")
+
+    def __init__(self, name, args):
+        self.name, self.args = name, args
+
+    def set(self, **kw):
+        self.args.update(kw)
+
+    def __enter__(self):
+        self.t0, self.p0 = time.time_ns(), time.perf_counter_ns()
+        return self
+
+    def __exit__(self, et, ev, tb):
+        if et is not None:
+            self.args["error"] = et.__name__
+        _trace["buf"].append((self.name, self.t0, time.perf_counter_ns() - self.p0,
+                              threading.current_thread().name, getattr(_trace_ctx, "v", None), self.args))
+        return False
+
+class _NoSpan:
+    __slots__ = ()
+    def set(self, **kw): pass
+    def __enter__(self): return self
+    def __exit__(self, *exc): return False
+
+_NO_SPAN = _NoSpan()
+
+def span(name, /, **args):
+    """with span("kill_proc", pid=...) as sp: ...; sp.set(killed=True) — добавить аргументы по ходу."""
+    return _Span(name, args) if _trace["on"] else _NO_SPAN
+
+def trace_event(name, /, **args):
+    """Мгновенное событие (готовность: первый TS, handshake пира)."""
+    if _trace["on"]:
+        _trace["buf"].append((name, time.time_ns(), None, threading.current_thread().name,
+                              getattr(_trace_ctx, "v", None), args))
+
+def traced(name=None):
+    def deco(fn):
+        nm = name or fn.__name__
+        @functools.wraps(fn)
+        def wrapper(*a, **kw):
+            if not _trace["on"]:
+                return fn(*a, **kw)
+            with _Span(nm, {}):
+                return fn(*a, **kw)
+        return wrapper
+    return deco
+
+def trace_configure(cfg):
+    """debug.trace / debug.trace_buffer из конфига; RIST_TRACE=1 в окружении включает всегда."""
+    dc = {"trace": False, "trace_buffer": 20000, **(cfg.get("debug", {}) or {})}
+    _trace["on"] = _trace["forced"] or bool(dc["trace"])
+    n = max(100, int(dc["trace_buffer"]))
+    if _trace["buf"].maxlen != n:
+        _trace["buf"] = deque(_trace["buf"], maxlen=n)
+
+# -----------------------------
+# CHILD LOGS (буфер, ротация, rate limit, подавление повторов)
+# -----------------------------
+def _log_cfg(cfg) -> dict:
+    d = {
+        "child_max_mb": 5, "child_backups": 3, "compress": True,
+        "flush_sec": 1.0, "buffer_kb": 64,
+        "max_lines_per_sec": 50, "burst_lines": 200,
+        "suppress_repeats": True, "echo_to_main": True,
+    }
+    return {**d, **(cfg.get("logging", {}) or {})}
+
+class ChildLog:
+    """
+    Лог дочернего процесса без write-amplification: строки копятся в памяти и пишутся
+    пачкой (по размеру буфера или раз в flush_sec), файл ротируется по размеру.
+    Лишние строки режутся token bucket'ом, подряд идущие одинаковые — схлопываются.
+    Под блокировкой ротация только переименовывает файл; сдвиг архивов и gzip — в фоновом
+    потоке, чтобы чтение stdout ребёнка (статистика, детектор зависаний) не вставало.
+    Один объект на имя: процессы с одним именем (старый и новый ristsender при make-before-break)
+    пишут в него вместе, см. open_child_log.
+    """
+    def __init__(self, name, lc):
+        self.name = name
+        self.path = f"/data/logs/{name}.log"
+        self.max_bytes = int(float(lc["child_max_mb"]) * 1024 * 1024)
+        self.backups = max(1, int(lc["child_backups"]))
+        self.compress = bool(lc["compress"])
+        self.buffer_bytes = int(lc["buffer_kb"]) * 1024
+        self.rate = float(lc["max_lines_per_sec"])
+        self.burst = float(lc["burst_lines"])
+        self.suppress_repeats = bool(lc["suppress_repeats"])
+        self.stats = {"lines": 0, "written": 0, "rate_limited": 0, "repeated": 0,
+                      "bytes_written": 0, "bytes_suppressed": 0, "rotations": 0}
+        self._lk = threading.Lock()
+        self._buf = bytearray()
+        self._tokens = self.burst
+        self._t = time.monotonic()
+        self._last = None
+        self._repeats = 0
+        self._dropped = 0
+        self._f = open(self.path, "ab")
+        self._size = self._f.tell()
+        self.users = 0
+        self._rot_q = deque()    # переименованные, но ещё не разложенные по архивам файлы
+        self._rot_worker = None
+
+    def write(self, line: bytes) -> bool:
+        """True — строка записана (её можно дублировать в entrypoint.log), False — подавлена."""
+        with self._lk:
+            self.stats["lines"] += 1
+            if self.suppress_repeats and line == self._last:
+                self._repeats += 1
+                self.stats["repeated"] += 1
+                self.stats["bytes_suppressed"] += len(line)
+                return False
+            if self.rate > 0:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._t) * self.rate)
+                self._t = now
+                if self._tokens < 1.0:
+                    self._dropped += 1
+                    self.stats["rate_limited"] += 1
+                    self.stats["bytes_suppressed"] += len(line)
+                    return False
+                self._tokens -= 1.0
+            self._notes()
+            self._last = line
+            self._emit(line)
+            self.stats["written"] += 1
+            return True
+
+    def _notes(self):
+        if self._repeats:
+            self._emit(f"[log] last line repeated {self._repeats} times\n".encode())
+            self._repeats = 0
+        if self._dropped:
+            self._emit(f"[log] {self._dropped} lines suppressed (rate limit {self.rate:g}/s)\n".encode())
+            self._dropped = 0
+
+    def _emit(self, data: bytes):
+        self._buf += data
+        if len(self._buf) >= self.buffer_bytes:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        if not self._buf or self._f is None:
+            return
+        self._f.write(self._buf)
+        self._f.flush()
+        self._size += len(self._buf)
+        self.stats["bytes_written"] += len(self._buf)
+        self._buf.clear()
+        if self._size >= self.max_bytes:
+            self._rotate()
+
+    def _rotate(self):
+        self._f.close()
+        pending = f"{self.path}.rot{time.time_ns()}"
+        os.replace(self.path, pending)
+        self._f = open(self.path, "ab")
+        self._size = 0
+        self.stats["rotations"] += 1
+        self._rot_q.append(pending)
+        if not (self._rot_worker and self._rot_worker.is_alive()):
+            self._rot_worker = threading.Thread(target=self._archive, daemon=True)
+            self._rot_worker.start()
+
+    def _archive(self):
+        """Фон: по порядку ротаций — сдвиг .1 → .2 → ..., затем файл ротации → .1[.gz]."""
+        ext = ".gz" if self.compress else ""
+        while True:
+            with self._lk:
+                if not self._rot_q:
+                    self._rot_worker = None
+                    return
+                pending = self._rot_q[0]
+            try:
+                try:
+                    os.remove(f"{self.path}.{self.backups}{ext}")
+                except FileNotFoundError:
+                    pass
+                for i in range(self.backups - 1, 0, -1):
+                    try: os.replace(f"{self.path}.{i}{ext}", f"{self.path}.{i+1}{ext}")
+                    except FileNotFoundError: pass
+                if self.compress:
+                    with open(pending, "rb") as src, gzip.open(f"{self.path}.1.gz.tmp", "wb", compresslevel=6) as dst:
+                        while True:
+                            chunk = src.read(1 << 20)
+                            if not chunk: break
+                            dst.write(chunk)
+                    os.replace(f"{self.path}.1.gz.tmp", f"{self.path}.1.gz")
+                    os.remove(pending)
+                else:
+                    os.replace(pending, f"{self.path}.1")
+            except Exception as e:
+                logger.info(f"[LOG] {self.name}: archive {pending} failed: {e}")
+            with self._lk:
+                self._rot_q.popleft()
+
+    def flush(self):
+        with self._lk:
+            try: self._flush_locked()
+            except Exception as e: logger.info(f"[LOG] {self.name}: flush failed: {e}")
+
+    def close(self):
+        """Отпускает одного пользователя; файл закрывается с последним."""
+        with _child_logs_lk:
+            self.users -= 1
+            if self.users > 0:
+                return
+        with self._lk:
+            self._notes()
+            try: self._flush_locked()
+            except Exception: pass
+            try: self._f.close()
+            except Exception: pass
+            self._f = None
+
+child_logs = {}  # name -> ChildLog последнего процесса (процессов) с этим именем
+_child_logs_lk = threading.Lock()
+
+def open_child_log(name, lc) -> ChildLog:
+    """ChildLog для нового процесса: общий с ещё живым тёзкой, иначе новый."""
+    with _child_logs_lk:
+        lf = child_logs.get(name)
+        if lf is None or lf.users <= 0:
+            lf = child_logs[name] = ChildLog(name, lc)
+        lf.users += 1
+        return lf
+
+def log_flusher():
+    while True:
+        time.sleep(float(_log_cfg(current_cfg)["flush_sec"]))
+        for clog in list(child_logs.values()):
+            clog.flush()
+
+def popen_logged(cmd, name, preexec=None, on_line=None, sched=None, attrs=None):
+    """
+    sched — scheduling.<kind>: применяется в preexec до preexec вызывающего (drop_priv);
+    attrs — атрибуты процесса, нужные on_line с первой же строки (ставятся до старта чтения).
+    """
+    lc = _log_cfg(current_cfg)
+    lf = open_child_log(name, lc)
+    echo = bool(lc["echo_to_main"])
     logger.info(f"[START] {name}: {cmd if isinstance(cmd, str) else ' '.join(cmd)}")
-    p = subprocess.Popen(
-        cmd if isinstance(cmd, list) else cmd,
-        shell=isinstance(cmd, str),
-        preexec_fn=preexec,
-        stdout=subprocess.PIPE, stderr=subprocess.STDOUT, bufsize=1
-    )
+    with span("popen", name=name) as sp:
+        p = subprocess.Popen(
+            cmd if isinstance(cmd, list) else cmd,
+            shell=isinstance(cmd, str),
+            preexec_fn=chain_preexec(sched_preexec(sched or {}), preexec),
+            start_new_session=True,  # своя группа: kill_procs гасит и shell, и запущенный им FFmpeg
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT, bufsize=1
+        )
+        sp.set(pid=p.pid)
+    # отметки для супервизора (monotonic): старт, последний вывод, EOF stdout
+    p.started_at = p.last_output = time.monotonic()
+    p.exited_at = None
+    p.sched_req = dict(sched or {})
+    p.sched = sched_state(p.pid)
+    for k, v in (attrs or {}).items():
+        setattr(p, k, v)
+    if sched:
+        logger.info(f"[SCHED] {name}: {p.sched}")
     def _pump():
         try:
             for line in iter(p.stdout.readline, b""):
-                lf.write(line)
+                p.last_output = time.monotonic()
+                passed = lf.write(line)
                 try:
-                    logger.info(f"[{name}] {line.decode(errors='replace').rstrip()}")
+                    text = line.decode(errors='replace').rstrip()
+                    if passed and echo:
+                        logger.info(f"[{name}] {text}")
+                    if on_line: on_line(p, text)
                 except Exception:
                     pass
         finally:
@@ -47,11 +317,13 @@ def popen_logged(cmd, name, preexec=None):
             except Exception: pass
             try: lf.close()
             except Exception: pass
+            p.exited_at = time.monotonic()
             rc = p.poll()
             logger.info(f"[EXIT] {name}: rc={rc}")
     threading.Thread(target=_pump, daemon=True).start()
     return p
 
+@traced()
 def read_cfg():
     if not os.path.exists(CONFIG_PATH):
         os.makedirs(os.path.dirname(CONFIG_PATH), exist_ok=True)
@@ -60,18 +332,111 @@ def read_cfg():
     with open(CONFIG_PATH, "r", encoding="utf-8") as f:
         return yaml.safe_load(f) or {}
 
+def write_cfg(cfg):
+    """config.yml целиком: tmp + rename — читатель не увидит полузаписанный файл. cfg — dict или текст YAML."""
+    os.makedirs(os.path.dirname(CONFIG_PATH), exist_ok=True)
+    with span("write_cfg"):
+        with open(CONFIG_PATH + ".tmp", "w", encoding="utf-8") as f:
+            if isinstance(cfg, str):
+                f.write(cfg)
+            else:
+                yaml.safe_dump(cfg, f, allow_unicode=True, sort_keys=False)
+        os.replace(CONFIG_PATH + ".tmp", CONFIG_PATH)
+
+def _shutdown_cfg(cfg) -> dict:
+    d = {"timeout_sec": 5.0, "port_wait_sec": 2.0}
+    return {**d, **(cfg.get("shutdown", {}) or {})}
+
+def _live_groups(pgids) -> set:
+    """Какие из групп ещё не пусты (зомби не в счёт). Осиротевших зомби этих групп пожинаем сами."""
+    alive, me = set(), os.getpid()
+    for d in os.listdir("/proc"):
+        if not d.isdigit():
+            continue
+        try:
+            with open(f"/proc/{d}/stat", "rb") as f:
+                raw = f.read()
+        except OSError:
+            continue
+        fields = raw[raw.rfind(b")") + 2:].split()
+        state, ppid, pgrp = fields[0], int(fields[1]), int(fields[2])
+        if pgrp not in pgids:
+            continue
+        if state != b"Z":
+            alive.add(pgrp)
+        elif ppid == me and int(d) != pgrp:
+            # ребёнок умершего shell перешёл к нам (в контейнере мы PID 1) — иначе так и висит зомби
+            try: os.waitpid(int(d), os.WNOHANG)
+            except ChildProcessError: pass
+    return alive
+
+def kill_procs(ps, timeout=None):
+    """
+    Гасит процессы вместе с их группами (у каждого ребёнка своя, см. popen_logged): SIGTERM
+    всем сразу, один общий дедлайн, оставшимся группам — SIGKILL.
+    -> pid лидеров групп, которые так и не опустели.
+    """
+    timeout = float(_shutdown_cfg(current_cfg)["timeout_sec"]) if timeout is None else timeout
+    def _left(ps):
+        groups = _live_groups({p.pid for p in ps})
+        return [p for p in ps if p.poll() is None or p.pid in groups]
+    live = _left([p for p in ps if p])
+    if not live:
+        return []
+    with span("kill_proc", pids=[p.pid for p in live]) as sp:
+        for sig, wait in ((signal.SIGTERM, timeout), (signal.SIGKILL, 1.0)):
+            for p in live:
+                logger.info(f"[{'STOP' if sig == signal.SIGTERM else 'KILL'}] pid={p.pid}")
+                try:
+                    os.killpg(p.pid, sig)
+                except ProcessLookupError:
+                    pass  # группа уже пуста, лидер ждёт wait()
+                except PermissionError:
+                    try: p.send_signal(sig)
+                    except Exception: pass
+            deadline = time.monotonic() + wait
+            while live and time.monotonic() < deadline:
+                time.sleep(0.02)
+                live = _left(live)
+            if not live:
+                break
+            sp.set(killed=len(live))
+        return [p.pid for p in live]
+
 def kill_proc(p):
-    if p and p.poll() is None:
+    kill_procs([p])
+
+def _busy_ports(ports) -> set:
+    """Порты из ports, занятые чужими сокетами (UDP — любой, TCP — LISTEN); свои (tap, shim, запись) не в счёт."""
+    if not ports:
+        return set()
+    mine = set()
+    for fd in os.listdir("/proc/self/fd"):
+        try: link = os.readlink(f"/proc/self/fd/{fd}")
+        except OSError: continue
+        if link.startswith("socket:["):
+            mine.add(link[8:-1])
+    busy = set()
+    for name, listen_only in (("udp", False), ("udp6", False), ("tcp", True), ("tcp6", True)):
         try:
-            logger.info(f"[STOP] pid={p.pid}")
-            p.terminate()
-            p.wait(timeout=5)
-        except Exception:
-            try:
-                logger.info(f"[KILL] pid={p.pid}")
-                p.kill()
-            except Exception:
-                pass
+            with open(f"/proc/net/{name}") as f:
+                rows = f.read().splitlines()[1:]
+        except OSError:
+            continue
+        for row in rows:
+            c = row.split()
+            port = int(c[1].rsplit(":", 1)[1], 16)
+            if port in ports and c[9] not in mine and not (listen_only and c[3] != "0A"):
+                busy.add(port)
+    return busy
+
+def _wait_ports_free(ports, timeout) -> set:
+    busy = _busy_ports(set(ports))
+    deadline = time.monotonic() + timeout
+    while busy and time.monotonic() < deadline:
+        time.sleep(0.05)
+        busy = _busy_ports(busy)
+    return busy
 
 def drop_priv(uid, gid):
     def _preexec():
@@ -81,6 +446,118 @@ def drop_priv(uid, gid):
         signal.signal(signal.SIGTERM, signal.SIG_DFL)
     return _preexec
 
+# -----------------------------
+# SCHEDULING (affinity / nice / ioprio / RT-класс для дочерних процессов)
+# -----------------------------
+_ALL_CPUS = frozenset(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else frozenset()
+_SCHED_POLICIES = {
+    "other": os.SCHED_OTHER, "batch": os.SCHED_BATCH, "idle": os.SCHED_IDLE,
+    "fifo": os.SCHED_FIFO, "rr": os.SCHED_RR,
+}
+_IOPRIO_CLASSES = {"none": 0, "rt": 1, "be": 2, "idle": 3}
+# (ioprio_set, ioprio_get): обёртки в libc нет, только syscall
+_IOPRIO_NR = {"x86_64": (251, 252), "aarch64": (30, 31), "armv7l": (314, 315), "i686": (289, 290)}.get(platform.machine())
+_libc = ctypes.CDLL(None, use_errno=True)
+_ui_sched = {}  # что применено к самому entrypoint (scheduling.ui) — дети без своих настроек это сбрасывают
+
+def _parse_cpus(v):
+    """[2, 3] | "2-3,6" | 2 -> set() ядер."""
+    if v is None or v == "":
+        return set()
+    if isinstance(v, int):
+        return {v}
+    if isinstance(v, (list, tuple)):
+        return {int(x) for x in v}
+    out = set()
+    for part in str(v).split(","):
+        a, _, b = part.strip().partition("-")
+        out.update(range(int(a), int(b or a) + 1))
+    return out
+
+def _fmt_cpus(cpus):
+    cpus, out = sorted(cpus), []
+    for c in cpus:
+        if out and out[-1][1] == c - 1:
+            out[-1][1] = c
+        else:
+            out.append([c, c])
+    return ",".join(f"{a}-{b}" if b > a else str(a) for a, b in out)
+
+def sched_cfg(cfg, kind) -> dict:
+    """scheduling.<kind> (mediamtx | ffmpeg | rist | snapshot | ui): cpus, nice, ioprio_class, ioprio, policy, rt_priority."""
+    return dict(((cfg.get("scheduling", {}) or {}).get(kind)) or {})
+
+def sched_preexec(sc):
+    """
+    preexec для Popen: выполняется в ребёнке между fork и exec, поэтому только системные
+    вызовы и без исключений наружу (иначе Popen не запустит процесс) — что реально
+    применилось, смотрим потом из родителя (sched_state).
+    """
+    cpus = _parse_cpus(sc.get("cpus")) & _ALL_CPUS if _ALL_CPUS else set()
+    if not cpus and _ui_sched.get("cpus"):
+        cpus = set(_ALL_CPUS)  # UI прибит к своим ядрам — дети его affinity не наследуют
+    nice = sc.get("nice", 0 if "nice" in _ui_sched else None)
+    io = None
+    if sc.get("ioprio_class") and _IOPRIO_NR:
+        io = (_IOPRIO_CLASSES.get(str(sc["ioprio_class"]), 2) << 13) | int(sc.get("ioprio", 4))
+    policy = _SCHED_POLICIES.get(str(sc.get("policy") or ""))
+    prio = int(sc.get("rt_priority", 10)) if policy in (os.SCHED_FIFO, os.SCHED_RR) else 0
+    if not (cpus or nice is not None or io is not None or policy is not None):
+        return None
+
+    def _apply():
+        if cpus:
+            try: os.sched_setaffinity(0, cpus)
+            except OSError: pass
+        if nice is not None:
+            try: os.setpriority(os.PRIO_PROCESS, 0, int(nice))
+            except OSError: pass
+        if io is not None:
+            _libc.syscall(_IOPRIO_NR[0], 1, 0, io)  # IOPRIO_WHO_PROCESS, себя
+        if policy is not None:
+            try: os.sched_setscheduler(0, policy, os.sched_param(prio))
+            except OSError: pass
+    return _apply
+
+def chain_preexec(*fns):
+    fns = [f for f in fns if f]
+    if len(fns) < 2:
+        return fns[0] if fns else None
+    def _preexec():
+        for f in fns:
+            f()
+    return _preexec
+
+def sched_state(pid) -> dict:
+    """Фактические affinity / nice / ioprio / политика процесса (или потока) pid."""
+    out = {}
+    try: out["cpus"] = _fmt_cpus(os.sched_getaffinity(pid))
+    except OSError: pass
+    try: out["nice"] = os.getpriority(os.PRIO_PROCESS, pid)
+    except OSError: pass
+    try:
+        pol = os.sched_getscheduler(pid)
+        out["policy"] = next((k for k, v in _SCHED_POLICIES.items() if v == pol), str(pol))
+        if pol in (os.SCHED_FIFO, os.SCHED_RR):
+            out["rt_priority"] = os.sched_getparam(pid).sched_priority
+    except OSError: pass
+    if _IOPRIO_NR:
+        v = _libc.syscall(_IOPRIO_NR[1], 1, pid)
+        if v >= 0:
+            cls = next((k for k, c in _IOPRIO_CLASSES.items() if c == v >> 13), str(v >> 13))
+            out["ioprio"] = f"{cls}/{v & 0x1fff}"
+    return out
+
+def apply_ui_sched(cfg):
+    """scheduling.ui — к самому entrypoint (Flask, супервизор, shim); вызывать до старта потоков."""
+    global _ui_sched
+    sc = sched_cfg(cfg, "ui")
+    fn = sched_preexec(sc)
+    if fn:
+        fn()
+        _ui_sched = {k: sc[k] for k in ("cpus", "nice") if k in sc}
+        logger.info(f"[SCHED] ui: {sched_state(0)}")
+
 # -----------------------------
 # Helper: HLS preview URL
 # -----------------------------
@@ -97,24 +574,252 @@ def resolve_preview_url(cfg, request_host: str) -> str:
         except Exception: host = "localhost"
     return f"http://{host}:{port}/{name}/index.m3u8"
 
+# -----------------------------
+# SNAPSHOT PREVIEW (JPEG из TS вместо RTMP-копии → MediaMTX → HLS)
+# -----------------------------
+PREVIEW_DIR = os.getenv("PREVIEW_DIR", "/dev/shm/rist-preview" if os.path.isdir("/dev/shm") else "/tmp/rist-preview")
+PREVIEW_COST_PATH = os.getenv("PREVIEW_COST", "/data/preview_cpu.json")
+
+def _preview_cfg(cfg) -> dict:
+    d = {"mode": "hls", "port": None, "fps": 1.0, "width": 640, "quality": 7}
+    return {**d, **(cfg.get("preview", {}) or {})}
+
+def _snapshot_mode(cfg) -> bool:
+    return str(_preview_cfg(cfg)["mode"]).lower() == "snapshot"
+
+def _snapshot_port(cfg):
+    """preview.port или третий порт tee (первый — вход ristsender, второй — tap супервизора)."""
+    if not _snapshot_mode(cfg):
+        return None
+    pc = _preview_cfg(cfg)
+    if pc.get("port"):
+        return int(pc["port"])
+    ports = (((cfg.get("ffmpeg", {}) or {}).get("tee", {}) or {}).get("udp_ports", [10000,10001,10002,10003,10010]))
+    return int(ports[2]) if len(ports) > 2 else None
+
+def snapshot_path(sid) -> str:
+    return os.path.join(PREVIEW_DIR, "".join(ch for ch in str(sid) if ch.isalnum() or ch in "-_") + ".jpg")
+
+def _snapshot_sched(cfg) -> dict:
+    """Превью не должно отнимать CPU у кодера и ristsender: по умолчанию nice 10."""
+    return {"nice": 10, **sched_cfg(cfg, "snapshot")}
+
+@traced()
+def build_snapshot_cmd(cfg, path):
+    """
+    Декодируем только ключевые кадры (-skip_frame nokey) с порта tee, fps + уменьшение,
+    JPEG перезаписывается атомарно (-atomic_writing: tmp + rename) — HTTP не отдаст половину кадра.
+    """
+    port = _snapshot_port(cfg)
+    if not port:
+        return None
+    pc = _preview_cfg(cfg)
+    return [
+        "ffmpeg", "-hide_banner", "-nostats", "-loglevel", "warning",
+        "-threads", "1", "-skip_frame", "nokey", "-fflags", "nobuffer",
+        "-i", f"udp://127.0.0.1:{port}?overrun_nonfatal=1&fifo_size=50000",
+        "-map", "0:v:0", "-an", "-sn", "-threads", "1",
+        "-vf", f"fps={float(pc['fps']):g},scale={int(pc['width'])}:-2",
+        "-q:v", str(int(pc["quality"])),
+        "-f", "image2", "-update", "1", "-atomic_writing", "1", path,
+    ]
+
+# -----------------------------
+# ENCODER PROBE (video.preset: auto)
+# -----------------------------
+PROBE_CACHE_PATH = os.getenv("ENCODER_PROBE_CACHE", "/data/encoder_probe.json")
+PROBE_PRESETS = ["ultrafast", "superfast", "veryfast", "faster", "fast", "medium"]
+
+def _cpu_model() -> str:
+    try:
+        with open("/proc/cpuinfo", "r", encoding="utf-8", errors="replace") as f:
+            for line in f:
+                key = line.split(":", 1)[0].strip().lower()
+                if key in ("model name", "hardware", "cpu model") and ":" in line:
+                    return line.split(":", 1)[1].strip()
+    except Exception:
+        pass
+    return platform.machine() or "unknown"
+
+def _cpu_count() -> int:
+    try: return len(os.sched_getaffinity(0))
+    except Exception: return os.cpu_count() or 1
+
+def _probe_settings(cfg):
+    """Параметры пробы + ключ кэша (CPU + всё, что влияет на стоимость кодирования)."""
+    size, fps, v = _video_cfg(cfg)
+    ap = v.get("auto_preset", {}) or {}
+    vbit = int(v.get("bitrate_kbps") or 4000)
+    settings = {
+        "cpu": _cpu_model(),
+        "ncpu": _cpu_count(),
+        "codec": v.get("codec", "libx264"),
+        "size": str(size),
+        "fps": int(v.get("fps") or fps),
+        "bitrate_kbps": vbit,
+        "maxrate_kbps": int(v.get("maxrate_kbps") or vbit),
+        "bufsize_kbps": int(v.get("bufsize_kbps") or 2*vbit),
+        "tune": v.get("tune") or "",
+        "pix_fmt": v.get("pix_fmt", "yuv420p"),
+        "x264_params": v.get("x264_params", "scenecut=0:open_gop=0:repeat-headers=1"),
+        "threads": int(v.get("threads") or 0),
+        "candidates": list(ap.get("candidates") or PROBE_PRESETS),
+        "margin": float(ap.get("margin", 0.25)),
+        "max_cpu": float(ap.get("max_cpu", 0.80)),
+        "seconds": int(ap.get("seconds", 6)),
+    }
+    key = hashlib.sha1(json.dumps(settings, sort_keys=True).encode()).hexdigest()[:16]
+    return key, settings
+
+def _load_probe_cache() -> dict:
+    try:
+        with open(PROBE_CACHE_PATH, "r", encoding="utf-8") as f:
+            return json.load(f) or {}
+    except Exception:
+        return {}
+
+def _probe_one(st, preset):
+    """Один замер: кодируем testsrc2 без -re (быстрее реального времени, насколько получится)."""
+    gop = st["fps"] * 2
+    argv = [
+        "ffmpeg", "-hide_banner", "-nostats", "-loglevel", "error",
+        "-f", "lavfi", "-i", f"testsrc2=size={st['size']}:rate={st['fps']},format={st['pix_fmt']}",
+        "-t", str(st["seconds"]),
+        "-c:v", st["codec"], "-preset", preset,
+    ]
+    if st["tune"]: argv += ["-tune", st["tune"]]
+    if st.get("threads"): argv += ["-threads", str(st["threads"])]
+    argv += [
+        "-g", str(gop), "-keyint_min", str(gop), "-x264-params", st["x264_params"],
+        "-b:v", f"{st['bitrate_kbps']}k", "-maxrate", f"{st['maxrate_kbps']}k", "-bufsize", f"{st['bufsize_kbps']}k",
+        "-pix_fmt", st["pix_fmt"], "-f", "null", "-",
+    ]
+    t0 = time.monotonic()
+    p = subprocess.Popen(argv, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    # stderr — до EOF, иначе болтливый ffmpeg встанет на полном пайпе
+    err = p.stderr.read().decode(errors="replace").strip()
+    p.stderr.close()
+    # wait4 вместо wait: нужен rusage именно этого ребёнка, а не всех сразу
+    _, wstatus, ru = os.wait4(p.pid, 0)
+    p.returncode = os.waitstatus_to_exitcode(wstatus)
+    wall = max(time.monotonic() - t0, 1e-6)
+    if p.returncode != 0:
+        return {"preset": preset, "ok": False, "error": err[-300:] or f"rc={p.returncode}"}
+    cpu_s = ru.ru_utime + ru.ru_stime
+    speed = st["seconds"] / wall
+    # доля всей машины, которую займёт кодер в реальном времени
+    load = cpu_s / st["seconds"] / max(1, st["ncpu"])
+    return {
+        "preset": preset, "ok": True,
+        "speed": round(speed, 3),
+        "cpu_load": round(load, 3),
+        "headroom": round(1.0 - load, 3),
+        "wall_s": round(wall, 2),
+    }
+
+def probe_encoder(cfg, force: bool = False) -> dict:
+    """
+    Прогоняет короткие кодирования testsrc2 на каждом кандидате preset и выбирает
+    самый медленный (лучший по качеству), который держит реальное время с запасом:
+      speed >= 1 + margin  и  cpu_load <= max_cpu.
+    Результат кэшируется в PROBE_CACHE_PATH по ключу (CPU, настройки).
+    """
+    key, st = _probe_settings(cfg)
+    cache = _load_probe_cache()
+    if not force and key in cache:
+        return cache[key]
+
+    logger.info(f"[PROBE] encoder probe: {st['cpu']} x{st['ncpu']}, {st['size']}@{st['fps']} {st['bitrate_kbps']}k, presets={st['candidates']}")
+    results, chosen = [], None
+    for preset in st["candidates"]:
+        r = _probe_one(st, preset)
+        results.append(r)
+        if not r["ok"]:
+            logger.info(f"[PROBE] {preset}: failed: {r['error']}")
+            continue
+        fits = r["speed"] >= 1.0 + st["margin"] and r["cpu_load"] <= st["max_cpu"]
+        logger.info(f"[PROBE] {preset}: speed={r['speed']}x cpu_load={r['cpu_load']} headroom={r['headroom']} {'OK' if fits else 'too slow'}")
+        if fits:
+            chosen = preset
+        elif chosen:
+            break  # пресеты упорядочены от быстрых к медленным — дальше будет только хуже
+    if not chosen:
+        ok = [r for r in results if r["ok"]]
+        chosen = max(ok, key=lambda r: r["speed"])["preset"] if ok else "veryfast"
+        logger.info(f"[PROBE] no preset sustains real time with margin {st['margin']}; falling back to {chosen}")
+
+    entry = {"chosen": chosen, "ts": int(time.time()), "settings": st, "results": results}
+    cache[key] = entry
+    try:
+        tmp = PROBE_CACHE_PATH + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(cache, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, PROBE_CACHE_PATH)
+    except Exception as e:
+        logger.info(f"[PROBE] cache write failed: {e}")
+    logger.info(f"[PROBE] chosen preset: {chosen}")
+    return entry
+
+_probe_tried = set()  # ключи, уже отданные фоновой пробе: без кэша на диске не пробуем по кругу
+
+def _unprobed(cfg) -> dict:
+    """{sid: cfg} потоков с preset: auto, для настроек которых ещё нет замера."""
+    cache = _load_probe_cache()
+    return {sid: d["cfg"] for sid, d in stream_cfgs(cfg)[0].items()
+            if str(_video_cfg(d["cfg"])[2].get("preset")) == "auto" and _probe_settings(d["cfg"])[0] not in cache}
+
+def _probe_job():
+    """Фоновая проба для потоков без замера, затем apply_cfg — FFmpeg перезапустится с выбранным пресетом."""
+    todo = _unprobed(current_cfg)
+    for sid, scfg in todo.items():
+        probe_encoder(scfg)
+    return apply_cfg() if todo else "nothing to probe"
+
+def ensure_encoder_probe(cfg):
+    """preset: auto после /save с новыми настройками видео: пока пробы нет — veryfast, проба — задачей."""
+    todo = {sid: c for sid, c in _unprobed(cfg).items() if _probe_settings(c)[0] not in _probe_tried}
+    for sid, scfg in todo.items():
+        _probe_tried.add(_probe_settings(scfg)[0])
+        logger.info(f"[PROBE] {sid}: no encoder probe for these video settings; preset veryfast until the probe job finishes")
+    if todo:
+        submit_job("probe_encoder", _probe_job)
+
+def resolve_preset(cfg) -> str:
+    """video.preset как есть, либо (preset: auto) — выбранный пробой из кэша; без кэша — veryfast."""
+    _, _, v = _video_cfg(cfg)
+    preset = str(v.get("preset") or "veryfast")
+    if preset != "auto":
+        return preset
+    key, _ = _probe_settings(cfg)
+    entry = _load_probe_cache().get(key)
+    return entry["chosen"] if entry else "veryfast"
+
 # -----------------------------
 # FFMPEG PIPELINE (tee)
 # -----------------------------
-def build_ffmpeg_cmd(cfg):
+def _video_cfg(cfg):
+    """(size, fps, v) — итоговые параметры видео: ingest/video/ffmpeg.video с дефолтами."""
     ff = cfg.get("ffmpeg", {}) or {}
     ingest_cfg = ff.get("ingest", {}) or cfg.get("ingest", {}) or {}
-    src = str(ingest_cfg.get("source", "test")).lower()
     size = ingest_cfg.get("size") or (cfg.get("video", {}) or {}).get("size") or "1280x720"
     fps  = int(ingest_cfg.get("fps") or (cfg.get("video", {}) or {}).get("fps", 30))
-    uvc_dev = ingest_cfg.get("uvc_device", "/dev/video0")
-    rtmp_pull_url = ingest_cfg.get("rtmp_pull_url", "rtmp://127.0.0.1/live/stream")
-
     vdef = {
         "codec":"libx264","preset":"veryfast","tune":"zerolatency","pix_fmt":"yuv420p",
         "bitrate_kbps":4000,"maxrate_kbps":None,"bufsize_kbps":None,
         "fps":fps,"gop":None,"x264_params":"scenecut=0:open_gop=0:repeat-headers=1","force_keyint_sec":1,"insert_aud":True,
     }
     v = {**vdef, **(cfg.get("video", {}) or {}), **(ff.get("video", {}) or {})}
+    return size, fps, v
+
+@traced()
+def build_ffmpeg_cmd(cfg):
+    ff = cfg.get("ffmpeg", {}) or {}
+    ingest_cfg = ff.get("ingest", {}) or cfg.get("ingest", {}) or {}
+    src = str(ingest_cfg.get("source", "test")).lower()
+    uvc_dev = ingest_cfg.get("uvc_device", "/dev/video0")
+    rtmp_pull_url = ingest_cfg.get("rtmp_pull_url", "rtmp://127.0.0.1/live/stream")
+
+    size, fps, v = _video_cfg(cfg)
     vbit = int(v.get("bitrate_kbps", 4000))
     vmax = int(v.get("maxrate_kbps", vbit))
     vbuf = int(v.get("bufsize_kbps", 2*vbit))
@@ -133,7 +838,8 @@ def build_ffmpeg_cmd(cfg):
         "publish_rtmp_url": (cfg.get("mediamtx", {}) or {}).get("publish_rtmp_url", "rtmp://127.0.0.1/live/stream"),
     }
     t = {**tdef, **(ff.get("tee", {}) or {})}
-    want_rtmp = bool(t.get("publish_rtmp_copy", True) and t.get("publish_rtmp_url"))
+    # в режиме превью snapshot RTMP-копия не нужна: нет FLV-ветки, +global_header и AUD остаются как есть
+    want_rtmp = bool(t.get("publish_rtmp_copy", True) and t.get("publish_rtmp_url")) and not _snapshot_mode(cfg)
     insert_aud = bool(v.get("insert_aud", True))
     if want_rtmp: insert_aud = False
     bsf_chain = []
@@ -149,6 +855,9 @@ def build_ffmpeg_cmd(cfg):
         return f"[f=mpegts:{flags}]{url}?pkt_size={pkt}"
 
     ts_ports = (((cfg.get("ffmpeg", {}) or {}).get("tee", {}) or {}).get("udp_ports", [10000,10001,10002,10003,10010]))
+    for extra in (_snapshot_port(cfg), _rec_port(cfg)):
+        if extra and extra not in [int(p) for p in ts_ports]:
+            ts_ports = list(ts_ports) + [extra]
     ts_outputs = [_ts_sink(f"udp://127.0.0.1:{p}", cfg) for p in ts_ports]
 
     outputs = list(ts_outputs)
@@ -177,8 +886,10 @@ def build_ffmpeg_cmd(cfg):
     tune = v.get("tune")
     tune_part = f"-tune {tune} " if tune else ""
     x264_params = v.get("x264_params", "scenecut=0:open_gop=0:repeat-headers=1")
+    preset = resolve_preset(cfg)
+    threads_part = f"-threads {int(v['threads'])} " if v.get("threads") else ""
     enc = (
-        f"-c:v {v.get('codec','libx264')} -preset {v.get('preset','veryfast')} {tune_part}"
+        f"-c:v {v.get('codec','libx264')} -preset {preset} {tune_part}{threads_part}"
         f"-g {gop} -keyint_min {gop} -x264-params '{x264_params}' "
         f"-force_key_frames \"expr:gte(t,n_forced*{force_keyint_sec})\" "
         f"-b:v {int(vbit)}k -maxrate {int(vmax)}k -bufsize {int(vbuf)}k -pix_fmt {v.get('pix_fmt','yuv420p')} "
@@ -199,26 +910,30 @@ def _primary_ts_port(cfg) -> int:
     ports = (((cfg.get("ffmpeg", {}) or {}).get("tee", {}) or {}).get("udp_ports", [10000,10001,10002,10003,10010]))
     return int(ports[0] if ports else 10000)
 
-def build_rist_cmd_single(cfg):
+@traced()
+def build_rist_cmd_single(cfg, in_port=None):
     """
     ОДИН процесс ristsender:
-      - один -i (первый порт tee из FFmpeg)
-      - несколько -o на ВИРТУАЛЬНЫЕ адреса (VIP), порт берём из конфига:
+      - один -i (первый порт tee из FFmpeg, либо внутренний порт shim'а в режиме make_before_break)
+      - несколько -o на ВИРТУАЛЬНЫЕ адреса (VIP), кроме путей в карантине; порт берём из конфига:
           senders[i].port  | senders[i].virt_port | rist.default_port | 8000
+      - на втором внутреннем порту shim (mbb.ports[1]) — на запасные VIP senders[i].mbb_virt_ip
+        (и mbb_port): свои udp_proxy со своим --source-port, чтобы старый и новый ristsender
+        во время перекрытия не делили один 5-tuple и одного last_local_peer у релея
     """
     r = cfg.get("rist", {}) or {}
 
     # вход — первый UDP порт tee
-    in_port = _primary_ts_port(cfg)
+    in_port = int(in_port or _primary_ts_port(cfg))
     inurl   = f"udp://127.0.0.1:{in_port}"
 
-    enabled = [(i, s) for i, s in enumerate(r.get("senders", []) or []) if s.get("enabled", True)]
+    enabled = [(i, s) for i, s in enumerate(r.get("senders", []) or [])
+               if s.get("enabled", True) and s.get("cname", f"m{i}") not in quarantine]
     if not enabled:
         return None, 0, 0, "rist", False
 
     # общие параметры RIST
     buf_ms   = int(r.get("buffer_ms", 800))
-    bw_kbps  = int(r.get("bandwidth_kbps", 12000))
     reorder  = int(r.get("reorder_buffer_ms", 120))
     rtt_min  = int(r.get("rtt_min_ms", 80))
     rtt_max  = int(r.get("rtt_max_ms", rtt_min))
@@ -229,6 +944,7 @@ def build_rist_cmd_single(cfg):
 
     # глобальный дефолт порта для всех -o (можно переопределить в sender)
     default_port = int(r.get("default_port", 8000))
+    alt = _mbb_alt(cfg, in_port)
 
     argv = ["ristsender", "-i", inurl]
 
@@ -236,13 +952,15 @@ def build_rist_cmd_single(cfg):
         vip     = s.get("virt_ip", f"10.255.0.{idx+1}")
         # приоритет: per-sender "port" → "virt_port" → rist.default_port → 8000
         dport   = int(s.get("port", s.get("virt_port", default_port)))
+        if alt and s.get("mbb_virt_ip"):
+            vip, dport = s["mbb_virt_ip"], int(s.get("mbb_port", dport))
         cname   = s.get("cname", f"m{idx}")
         weight  = int(s.get("weight", 5))
 
         params = [
             f"cname={cname}",
             f"buffer={buf_ms}",
-            f"bandwidth={bw_kbps}",
+            f"bandwidth={path_bandwidth(cfg, idx, s)}",
             f"weight={weight}",
             f"reorder-buffer={reorder}",
             f"rtt-min={rtt_min}",
@@ -257,55 +975,1873 @@ def build_rist_cmd_single(cfg):
     run_gid = int(r.get("run_gid", 0))
     return argv, run_uid, run_gid, "rist", True
 
+# -----------------------------
+# PATH BANDWIDTH PROBE (ёмкость аплинка каждого пути → bandwidth= у его -o)
+# -----------------------------
+BW_PROBE_CACHE_PATH = os.getenv("BW_PROBE_CACHE", "/data/bw_probe.json")
+# формат как в host/relay_proto.py: отвечают relay_rx.py на сервере или host/udp_echo.py
+T_PROBE = 0xFA
+PROBE_HDR = struct.Struct("!BBIIQ")  # type, kind (0 — проба, 1 — ответ), id, seq, t_ns
+_bw_cache = {}   # cname -> {"target", "kbps", "capacity_kbps", "loss_pct", "rtt_ms", "at", "tried_at", ...}
+_bw_lk = threading.Lock()
+_bw_running = set()
+
+def _bw_cfg(cfg) -> dict:
+    d = {
+        "enable": False,
+        "min_kbps": 500, "max_kbps": 20000,  # диапазон разгона
+        "steps": 8, "step_sec": 1.0, "pkt_size": 1316,
+        "loss_pct": 2.0,            # ступень не прошла: потерь больше
+        "rtt_inflation_ms": 150,    # ... или RTT вырос относительно первой ступени (буфер модема)
+        "factor": 0.8,              # bandwidth= = ёмкость × factor
+        "cache_ttl_sec": 86400,     # до старта перемериваем только то, что старше
+        "interval_sec": 3600,       # в работе — не чаще, и только простаивающие пути
+        "check_interval_sec": 30,
+    }
+    return {**d, **(((cfg.get("rist", {}) or {}).get("bw_probe")) or {})}
+
+def _bw_target(cfg, idx, s) -> str:
+    """Куда шлём пробы: senders[i].probe_target или тот же VIP:порт, что у -o (udp_proxy → модем → сервер)."""
+    if s.get("probe_target"):
+        return str(s["probe_target"])
+    r = cfg.get("rist", {}) or {}
+    return f"{s.get('virt_ip', f'10.255.0.{idx+1}')}:{int(s.get('port', s.get('virt_port', r.get('default_port', 8000))))}"
+
+def _load_bw_cache():
+    try:
+        with open(BW_PROBE_CACHE_PATH, "r", encoding="utf-8") as f:
+            _bw_cache.update(json.load(f) or {})
+    except Exception:
+        pass
+
+def _save_bw_cache():
+    try:
+        with open(BW_PROBE_CACHE_PATH + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(_bw_cache, f, ensure_ascii=False, indent=1)
+        os.replace(BW_PROBE_CACHE_PATH + ".tmp", BW_PROBE_CACHE_PATH)
+    except OSError as e:
+        logger.info(f"[BWPROBE] cache write failed: {e}")
+
+def path_bandwidth(cfg, idx, s) -> int:
+    """bandwidth= для -o: senders[i].bandwidth_kbps → замер пути (rist.bw_probe) → rist.bandwidth_kbps."""
+    r = cfg.get("rist", {}) or {}
+    if s.get("bandwidth_kbps"):
+        return int(s["bandwidth_kbps"])
+    bc = _bw_cfg(cfg)
+    e = _bw_cache.get(s.get("cname", f"m{idx}")) if bc["enable"] else None
+    if e and e.get("kbps") and e.get("target") == _bw_target(cfg, idx, s):
+        return int(e["kbps"])
+    return int(r.get("bandwidth_kbps", 12000))
+
+def bw_probe_run(p) -> dict:
+    """
+    Ступенчатый разгон до max_kbps (геометрически от min_kbps). На ступени шлём пробы
+    pkt_size байт с заданной скоростью, ответчик возвращает на каждую короткий ответ.
+    Ступень прошла, если потерь не больше loss_pct и медианный RTT вырос не больше чем
+    на rtt_inflation_ms; после первой непрошедшей — ещё одна ступень посередине (геометрически).
+    Ёмкость — доставленная скорость лучшей прошедшей ступени.
+    Выполняется в отдельном процессе (uid пути, не мешает GIL основного).
+    """
+    host, _, port = p["target"].rpartition(":")
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.connect((host, int(port)))
+    sock.settimeout(0.1)
+    pid = random.getrandbits(32)
+    acks, done = {}, threading.Event()
+
+    def _rx():
+        while not done.is_set():
+            try:
+                data = sock.recv(2048)
+            except socket.timeout:
+                continue
+            except OSError:
+                time.sleep(0.01)  # ICMP unreachable на connected-сокете
+                continue
+            now = time.monotonic_ns()
+            if len(data) >= PROBE_HDR.size and data[0] == T_PROBE:
+                _, kind, rid, seq, t_ns = PROBE_HDR.unpack_from(data)
+                if kind == 1 and rid == pid:
+                    acks[seq] = (now - t_ns) / 1e6
+    threading.Thread(target=_rx, daemon=True).start()
+
+    pkt, step_sec = int(p["pkt_size"]), float(p["step_sec"])
+    lo, hi, n_steps = float(p["min_kbps"]), float(p["max_kbps"]), max(1, int(p["steps"]))
+    rates = [lo * (hi / lo) ** (i / max(1, n_steps - 1)) for i in range(n_steps)]
+    pad = b"\0" * max(0, pkt - PROBE_HDR.size)
+    seq, base_rtt, capacity, steps, refined = 0, None, None, [], False
+    try:
+        while rates:
+            rate = rates.pop(0)
+            n = max(1, int(rate * 1000 / 8 * step_sec / pkt))
+            first, interval, t0 = seq, step_sec / n, time.monotonic()
+            for i in range(n):
+                delay = t0 + i * interval - time.monotonic()
+                if delay > 0.0005:
+                    time.sleep(delay)
+                try:
+                    sock.send(PROBE_HDR.pack(T_PROBE, 0, pid, seq, time.monotonic_ns()) + pad)
+                except OSError:
+                    pass
+                seq += 1
+            time.sleep(max(0.3, 2 * (base_rtt or 0) / 1000))  # ждём запоздавшие ответы
+            rtts = sorted(acks[x] for x in range(first, seq) if x in acks)
+            if not rtts and first == 0:
+                return {"ok": False, "error": f"no reply from {p['target']}"}
+            loss = 100.0 * (1 - len(rtts) / n)
+            rtt = rtts[len(rtts) // 2] if rtts else None
+            if base_rtt is None and rtt is not None:
+                base_rtt = rtt
+            st = {"offered_kbps": round(rate), "delivered_kbps": round(len(rtts) * pkt * 8 / step_sec / 1000),
+                  "loss_pct": round(loss, 2), "rtt_ms": round(rtt, 1) if rtt is not None else None}
+            steps.append(st)
+            if loss > float(p["loss_pct"]) or rtt is None or rtt - base_rtt > float(p["rtt_inflation_ms"]):
+                if capacity and not refined:
+                    refined, rates = True, [math.sqrt(capacity["offered_kbps"] * rate)]
+                    continue
+                break
+            if not capacity or st["delivered_kbps"] > capacity["delivered_kbps"]:
+                capacity = st
+            if refined:
+                break
+    finally:
+        done.set()
+    if not capacity:
+        return {"ok": False, "error": "even the lowest step failed", "steps": steps}
+    return {"ok": True, "capacity_kbps": capacity["delivered_kbps"], "loss_pct": capacity["loss_pct"],
+            "rtt_ms": capacity["rtt_ms"], "base_rtt_ms": round(base_rtt, 1), "steps": steps,
+            "limited_by": "max_kbps" if capacity["offered_kbps"] >= round(hi) else "path"}
+
+def _probe_path(cfg, idx, s):
+    """Один путь: дочерний python (с uid/gid отправителя — так пробы идут той же политикой маршрутизации)."""
+    bc = _bw_cfg(cfg)
+    cname = s.get("cname", f"m{idx}")
+    params = {k: bc[k] for k in ("min_kbps", "max_kbps", "steps", "step_sec", "pkt_size", "loss_pct", "rtt_inflation_ms")}
+    params["target"] = _bw_target(cfg, idx, s)
+    uid, gid = int(s.get("uid", 0) or 0), int(s.get("gid", 0) or 0)
+    tmo = float(bc["steps"]) * (float(bc["step_sec"]) + 1.0) + 10
+    t0 = time.time()
+    try:
+        out = subprocess.run([sys.executable, os.path.abspath(__file__), "bw-probe-run", json.dumps(params)],
+                             capture_output=True, text=True, timeout=tmo,
+                             preexec_fn=drop_priv(uid, gid) if (uid or gid) and os.geteuid() == 0 else None)
+        res = json.loads(out.stdout.strip().splitlines()[-1]) if out.stdout.strip() else \
+            {"ok": False, "error": (out.stderr.strip().splitlines() or [f"rc={out.returncode}"])[-1]}
+    except Exception as e:
+        res = {"ok": False, "error": f"{e.__class__.__name__}: {e}"}
+    with _bw_lk:
+        e = _bw_cache.setdefault(cname, {})
+        e.update(tried_at=round(t0), last_error=None if res["ok"] else res.get("error"), last_steps=res.get("steps"))
+        if res["ok"]:
+            kbps = int(min(float(bc["max_kbps"]), max(float(bc["min_kbps"]), res["capacity_kbps"] * float(bc["factor"]))))
+            e.update(target=params["target"], kbps=kbps, capacity_kbps=res["capacity_kbps"], loss_pct=res["loss_pct"],
+                     rtt_ms=res["rtt_ms"], base_rtt_ms=res["base_rtt_ms"], limited_by=res["limited_by"], at=round(t0))
+            logger.info(f"[BWPROBE] {cname} ({params['target']}): capacity {res['capacity_kbps']} kbps "
+                        f"({res['limited_by']}), loss {res['loss_pct']}%, rtt {res['rtt_ms']} ms -> bandwidth={kbps}")
+        else:
+            logger.info(f"[BWPROBE] {cname} ({params['target']}): failed: {res.get('error')}")
+        _save_bw_cache()
+    return res
+
+def _bw_paths(cfg):
+    """(cfg потока, idx, sender) всех путей всех потоков, где включён rist.bw_probe."""
+    out = []
+    for d in stream_cfgs(cfg)[0].values():
+        if _bw_cfg(d["cfg"])["enable"]:
+            for i, s in enumerate((d["cfg"].get("rist", {}) or {}).get("senders", []) or []):
+                out.append((d["cfg"], i, s))
+    return out
+
+def probe_paths(cfg, max_age=None, force=False, skip=()):
+    """Параллельно меряет пути, у которых замер старше max_age (или его нет); skip — cname, которые не трогать."""
+    todo = []
+    now = time.time()
+    for scfg, i, s in _bw_paths(cfg):
+        cname = s.get("cname", f"m{i}")
+        e = _bw_cache.get(cname) or {}
+        age = float(max_age if max_age is not None else _bw_cfg(scfg)["cache_ttl_sec"])
+        fresh = e.get("target") == _bw_target(scfg, i, s) and now - e.get("at", 0) < age
+        # неудачную попытку не повторяем чаще check_interval_sec × 10: путь, скорее всего, мёртв
+        retried = now - e.get("tried_at", 0) < 10 * float(_bw_cfg(scfg)["check_interval_sec"])
+        if force or not (fresh or retried or cname in skip or cname in _bw_running):
+            todo.append((scfg, i, s))
+    if not todo:
+        return {}
+    names = [s.get("cname", f"m{i}") for _, i, s in todo]
+    _bw_running.update(names)
+    logger.info(f"[BWPROBE] probing {', '.join(names)}")
+    res = {}
+    try:
+        ts = [threading.Thread(target=lambda a=a: res.__setitem__(a[2].get("cname", f"m{a[1]}"), _probe_path(*a)), daemon=True)
+              for a in todo]
+        for t in ts: t.start()
+        for t in ts: t.join()
+    finally:
+        _bw_running.difference_update(names)
+    return res
+
+def _active_cnames():
+    """cname путей, по которым сейчас идёт поток (есть в argv живого ristsender)."""
+    out = set()
+    for st in list(streams.values()):
+        p = _managed("rist", st)
+        if p is not None and p.poll() is None:
+            out.update(re.findall(r"[?&]cname=([^&]+)", " ".join(getattr(p, "spec", ((),))[0])))
+    return out
+
+def bw_probe_loop():
+    """В работе меряем только простаивающие пути: выключенные, в карантине, у остановленного потока."""
+    while True:
+        bc = _bw_cfg(current_cfg)
+        time.sleep(float(bc["check_interval_sec"]))
+        if not _bw_paths(current_cfg):
+            continue
+        try:
+            probe_paths(current_cfg, max_age=float(bc["interval_sec"]), skip=_active_cnames())
+        except Exception as e:
+            logger.info(f"[BWPROBE] error: {e}")
+
+def bw_probe_status() -> dict:
+    return {"running": sorted(_bw_running), "paths": {k: {kk: vv for kk, vv in v.items() if kk != "last_steps"}
+                                                     for k, v in list(_bw_cache.items())}}
+
+
+# -----------------------------
+# RIST STATS (per-path метрики из вывода ristsender)
+# -----------------------------
+path_stats = {}  # cname -> последняя статистика пира
+RIST_STATS_STALE_SEC = 3.0
+
+def _pick(d, *keys, default=0):
+    for k in keys:
+        if d.get(k) is not None:
+            return d[k]
+    return default
+
+def parse_rist_stats(text):
+    """
+    Строка периодической статистики ristsender → (cname, stats) или None.
+    librist печатает JSON вида {"sender-stats":{"peer":{"cname":..,"stats":{..}}}}
+    (иногда с префиксом уровня лога); счётчики — за интервал статистики.
+    """
+    if '"sender-stats"' not in text:
+        return None
+    try:
+        obj = json.loads(text[text.index("{"):])
+        peer = (obj.get("sender-stats") or {}).get("peer") or {}
+        st = peer.get("stats") or {}
+    except Exception:
+        return None
+    cname = str(peer.get("cname") or peer.get("id", "?"))
+    sent = int(_pick(st, "sent"))
+    retr = int(_pick(st, "retransmitted"))
+    quality = float(_pick(st, "quality", default=100.0))
+    return cname, {
+        "rate_kbps": round(float(_pick(st, "bandwidth")) / 1000.0, 1),
+        "retry_kbps": round(float(_pick(st, "retry_bandwidth", "retry-bandwidth")) / 1000.0, 1),
+        "sent": sent,
+        "retransmitted": retr,
+        "retransmit_pct": round(100.0 * retr / sent, 2) if sent else 0.0,
+        "loss_pct": round(max(0.0, 100.0 - quality), 2),
+        "rtt_ms": float(_pick(st, "rtt")),
+        "quality": quality,
+    }
+
+def update_path_stats(text) -> bool:
+    parsed = parse_rist_stats(text)
+    if not parsed:
+        return False
+    cname, st = parsed
+    st["ts"] = round(time.time(), 3)
+    st["_mono"] = time.monotonic()
+    path_stats[cname] = st
+    return True
+
+def path_stats_view(cname):
+    """Статистика пути для /status: без служебных полей, с возрастом; None — ещё не было."""
+    st = path_stats.get(cname)
+    if not st:
+        return None
+    view = {k: v for k, v in st.items() if not k.startswith("_")}
+    view["age_s"] = round(time.monotonic() - st["_mono"], 1)
+    return view
+
+# -----------------------------
+# STREAMS (несколько независимых потоков в одном контейнере)
+# -----------------------------
+MAIN_STREAM = "main"
+_STREAM_KEYS = ("id", "cpu_budget")  # поля описания потока, не накладываемые на конфиг
+
+def _deep_merge(base, over):
+    out = dict(base)
+    for k, v in (over or {}).items():
+        out[k] = _deep_merge(out[k], v) if isinstance(v, dict) and isinstance(out.get(k), dict) else v
+    return out
+
+def _stream_ports(cfg):
+    """Локальные UDP-порты потока: tee, tap супервизора, внутренние порты shim."""
+    ports = list(((cfg.get("ffmpeg", {}) or {}).get("tee", {}) or {}).get("udp_ports", [10000,10001,10002,10003,10010]))
+    tp = _tap_port(cfg)
+    if tp and _sup_cfg(cfg)["enable"]:
+        ports.append(tp)
+    mc = _mbb_cfg(cfg)
+    if mc["enable"]:
+        ports += list(mc["ports"])
+    ports += [p for p in (_snapshot_port(cfg), _rec_port(cfg)) if p]
+    return {int(p) for p in ports}
+
+def stream_cfgs(cfg):
+    """
+    -> (OrderedDict sid -> {"cfg", "cpu_budget"}, [проблемы]).
+    Без секции streams — один поток "main" из верхнего уровня конфига. Элемент streams
+    накладывается на верхний уровень (словари — рекурсивно, списки заменяются целиком),
+    поэтому у потока свои обычно ingest, video, ffmpeg.tee, rist.senders, rist.mbb.ports.
+    Поток, чьи локальные порты или cname путей уже заняты другим, пропускается: статистика,
+    история и карантин путей ведутся по cname.
+    cpu_budget (ядра): потолок потоков кодера и доля машины для пробы preset: auto.
+    """
+    base = {k: v for k, v in cfg.items() if k != "streams"}
+    out, owner, cowner, problems = OrderedDict(), {}, {}, []
+    for i, sd in enumerate(cfg.get("streams") or [{"id": MAIN_STREAM}]):
+        sid = str(sd.get("id") or f"s{i}")
+        if sid in out:
+            problems.append(f"{sid}: duplicate stream id; skipped")
+            continue
+        scfg = _deep_merge(base, {k: v for k, v in sd.items() if k not in _STREAM_KEYS})
+        budget = float(sd["cpu_budget"]) if sd.get("cpu_budget") else None
+        if budget:
+            v = scfg.get("video", {}) or {}
+            extra = {"threads": v.get("threads") or max(1, math.ceil(budget))}
+            if "max_cpu" not in (v.get("auto_preset") or {}):
+                extra["auto_preset"] = {"max_cpu": round(min(0.95, budget / _cpu_count()), 3)}
+            scfg = _deep_merge(scfg, {"video": extra})
+        clash = sorted(p for p in _stream_ports(scfg) if p in owner)
+        if clash:
+            problems.append(f"{sid}: udp ports {clash} already used by stream {owner[clash[0]]}; skipped")
+            continue
+        cnames = [s.get("cname", f"m{j}") for j, s in enumerate((scfg.get("rist", {}) or {}).get("senders", []) or [])]
+        dup = sorted({c for c in cnames if c in cowner})
+        if dup:
+            problems.append(f"{sid}: path cnames {dup} already used by stream {cowner[dup[0]]}; skipped")
+            continue
+        owner.update({p: sid for p in _stream_ports(scfg)})
+        cowner.update({c: sid for c in cnames})
+        out[sid] = {"cfg": scfg, "cpu_budget": budget}
+    return out, problems
+
+class Stream:
+    """Один поток: свой FFmpeg, свой ristsender, свои shim/tap; MediaMTX общий."""
+    def __init__(self, sid):
+        self.sid = sid
+        self.cfg = {}
+        self.cpu_budget = None
+        self.procs = {"ffmpeg": None, "rist": [], "snapshot": None}
+        self.shim = None
+        self.tap = None
+        self.rec = None
+        self.tap_prev = (0, time.monotonic())
+        self.tap_rate_bps = None
+        self.cpu_pct = None
+        self.over_budget_at = 0.0
+        self.startup = {}
+
+    def name(self, base):
+        """Имя процесса/лога/метрики; у потока main — без суффикса, как до появления streams."""
+        return base if self.sid == MAIN_STREAM else f"{base}-{self.sid}"
+
+streams = OrderedDict()  # sid -> Stream
+
+@traced()
+def sync_streams(cfg):
+    """Приводит набор потоков к cfg: лишние останавливаются, новые создаются (не запускаются)."""
+    want, problems = stream_cfgs(cfg)
+    for msg in problems:
+        logger.info(f"[STREAMS] {msg}")
+    removed = [sid for sid in streams if sid not in want]
+    for sid in removed:
+        st = streams.pop(sid)
+        stop_stream(st)
+        for x in (st.shim, st.tap, st.rec):
+            if x: x.close()
+        logger.info(f"[STREAMS] {sid}: removed")
+    added = []
+    for sid, d in want.items():
+        st = streams.get(sid)
+        if st is None:
+            st = streams[sid] = Stream(sid)
+            added.append(st)
+        st.cfg, st.cpu_budget = d["cfg"], d["cpu_budget"]
+        ensure_tap(st)
+        ensure_shim(st)
+        ensure_recorder(st)
+    return added, removed
 
 # -----------------------------
 # LIFECYCLE
 # -----------------------------
+current_cfg = {}
+
+MEDIAMTX_CMD = ("/usr/local/bin/mediamtx", "/app/mediamtx.yml")
+
+@traced()
+def _start_mediamtx(cfg):
+    if procs["mediamtx"]:
+        kill_proc(procs["mediamtx"])
+        procs["mediamtx"] = None
+    if cfg.get("mediamtx", {}).get("enable", True):
+        procs["mediamtx"] = popen_logged(list(MEDIAMTX_CMD), name="mediamtx", sched=sched_cfg(cfg, "mediamtx"))
+
+@traced()
+def _start_ffmpeg(st):
+    if st.procs["ffmpeg"]:
+        kill_proc(st.procs["ffmpeg"])
+    ff_cmd = build_ffmpeg_cmd(st.cfg)
+    logger.info(f"[FFMPEG CMD] {ff_cmd}")
+    st.procs["ffmpeg"] = popen_logged(ff_cmd, name=st.name("ffmpeg"), sched=sched_cfg(st.cfg, "ffmpeg"))
+
+def _spawn_rist(st, in_port=None, standby=False):
+    cfg = st.cfg
+    cmd_tuple = build_rist_cmd_single(cfg, in_port)  # argv, uid, gid, name, enabled
+    if not (cmd_tuple and cmd_tuple[-1]):
+        return None
+    argv, uid, gid, name, _ = cmd_tuple
+    logger.info(f"[RIST/CMD] {' '.join(argv)} (uid={uid}, gid={gid})")
+    hs_re = re.compile((cfg.get("rist", {}) or {}).get("handshake_pattern") or RIST_HANDSHAKE_RE)
+    def _on_line(p, text):
+        parsed = parse_rist_stats(text)
+        if parsed:
+            cname, ps = parsed
+            if ps["sent"] > 0 and p.first_sent is None:
+                p.first_sent = time.monotonic()  # ristsender отчитался об отправленных пакетах
+                trace_event("ready.first_sent", name=st.name(name), cname=cname)
+            if ps["rtt_ms"] > 0 and cname not in p.peers_up:
+                # RTT посчитан — от приёмника пришёл RTCP: сессия есть, даже если строки handshake нет
+                p.peers_up.add(cname)
+                trace_event("ready.peer", name=st.name(name), cname=cname)
+            if not getattr(p, "standby", False):  # новый при перекрытии не затирает статистику старого
+                update_path_stats(text)
+            return
+        if hs_re.search(text):
+            p.handshakes = getattr(p, "handshakes", 0) + 1
+            trace_event("ready.handshake", name=st.name(name), n=p.handshakes)
+    p = popen_logged(argv, name=st.name(name), preexec=drop_priv(int(uid), int(gid)) if (uid or gid) else None,
+                     on_line=_on_line, sched=sched_cfg(cfg, "rist"), attrs={"peers_up": set(), "first_sent": None, "standby": standby})
+    p.spec = (tuple(argv), int(uid), int(gid), p.sched_req)
+    p.name = st.name(name)
+    return p
+
+def rist_peers_ready(p) -> int:
+    """Сколько пиров ristsender на связи: по строкам handshake (rist.handshake_pattern) или по RTT в статистике."""
+    return max(getattr(p, "handshakes", 0), len(getattr(p, "peers_up", ())))
+
+@traced()
+def _start_snapshot(st):
+    kill_proc(st.procs.get("snapshot"))
+    st.procs["snapshot"] = None
+    path = snapshot_path(st.sid)
+    cmd = build_snapshot_cmd(st.cfg, path)
+    if not cmd:
+        try: os.remove(path)  # старый кадр не выдаём за живой
+        except OSError: pass
+        if _snapshot_mode(st.cfg):
+            logger.info(f"[PREVIEW] {st.sid}: no spare tee port for snapshots (set preview.port)")
+        return
+    os.makedirs(PREVIEW_DIR, exist_ok=True)
+    logger.info(f"[SNAPSHOT CMD] {' '.join(cmd)}")
+    st.procs["snapshot"] = popen_logged(cmd, name=st.name("snapshot"), sched=_snapshot_sched(st.cfg))
+
+# строки лога ristsender, означающие установленную сессию с пиром
+RIST_HANDSHAKE_RE = r"(?i)(peer.*(connected|authenticated)|handshake (done|complete))"
+
+@traced()
+def _start_rist(st):
+    for p in st.procs["rist"]:
+        kill_proc(p)
+    st.procs["rist"] = []
+
+    p = _spawn_rist(st, st.shim.target_port if st.shim else None)
+    if p:
+        st.procs["rist"] = [p]
+    else:
+        logger.info(f"[RIST] {st.sid}: no enabled senders; ristsender not started.")
+
 def start_all():
+    global current_cfg
     with lock:
         cfg = read_cfg()
+        current_cfg = cfg
+        trace_configure(cfg)
+        sync_streams(cfg)
+        # не стартуем поверх выживших: ristsender/MediaMTX не смогут занять порты
+        busy = _wait_ports_free(_child_ports(cfg), float(_shutdown_cfg(cfg)["port_wait_sec"]))
+        if busy:
+            logger.info(f"[START] ports {sorted(busy)} are held by other processes; starting anyway")
+        _run_startup(cfg, list(streams.values()))
 
-        # MediaMTX
-        if cfg.get("mediamtx", {}).get("enable", True):
-            if procs["mediamtx"]:
-                kill_proc(procs["mediamtx"])
-            procs["mediamtx"] = popen_logged(
-                ["/usr/local/bin/mediamtx", "/app/mediamtx.yml"],
-                name="mediamtx"
-            )
-
-        # FFmpeg
-        if procs["ffmpeg"]:
-            kill_proc(procs["ffmpeg"])
-        ff_cmd = build_ffmpeg_cmd(cfg)
-        logger.info(f"[FFMPEG CMD] {ff_cmd}")
-        procs["ffmpeg"] = popen_logged(ff_cmd, name="ffmpeg")
-
-        # RIST (один процесс)
-        for p in procs["rist"]:
-            kill_proc(p)
-        procs["rist"].clear()
-
-        cmd_tuple = build_rist_cmd_single(cfg)  # argv, uid, gid, name, enabled
-        if cmd_tuple and cmd_tuple[-1]:
-            argv, uid, gid, name, _ = cmd_tuple
-            logger.info(f"[RIST/CMD] {' '.join(argv)} (uid={uid}, gid={gid})")
-            p = popen_logged(argv, name=name, preexec=drop_priv(int(uid), int(gid)) if (uid or gid) else None)
-            procs["rist"] = [p]
-        else:
-            logger.info("[RIST] No enabled senders; ristsender not started.")
-            procs["rist"] = []
+def _stream_procs(st):
+    return [st.procs.get("ffmpeg"), st.procs.get("snapshot")] + list(st.procs.get("rist", []))
+
+@traced()
+def stop_stream(st):
+    kill_procs(_stream_procs(st))
+    st.procs["ffmpeg"] = st.procs["snapshot"] = None
+    st.procs["rist"] = []
+
+def _child_ports(cfg) -> set:
+    """Порты, которые держат дети: UDP потоков (вход ristsender, снимки, ...) и адреса из mediamtx.yml."""
+    ports = set()
+    for d in stream_cfgs(cfg)[0].values():
+        ports |= _stream_ports(d["cfg"])
+    if cfg.get("mediamtx", {}).get("enable", True):
+        try:
+            with open(MEDIAMTX_CMD[1], encoding="utf-8") as f:
+                m = yaml.safe_load(f) or {}
+            ports |= {int(str(v).rpartition(":")[2]) for k, v in m.items()
+                      if k.endswith("Address") and str(v).rpartition(":")[2].isdigit()}
+        except (OSError, yaml.YAMLError):
+            pass
+    return ports
 
-def stop_all():
+@traced()
+def stop_all() -> bool:
+    """
+    Все дети разом (группами, см. kill_procs) с одним дедлайном shutdown.timeout_sec — останов
+    занимает столько, сколько самый медленный, а не сумму; затем ждём, пока порты освободятся.
+    """
     with lock:
-        kill_proc(procs.get("ffmpeg"))
-        if procs.get("mediamtx"):
-            kill_proc(procs["mediamtx"])
-        for p in procs.get("rist", []):
-            kill_proc(p)
-        procs["ffmpeg"] = None
+        t0 = time.monotonic()
+        ps = [procs.get("mediamtx")]
+        for st in list(streams.values()):
+            ps += _stream_procs(st)
+        sc = _shutdown_cfg(current_cfg)
+        left = kill_procs(ps, float(sc["timeout_sec"]))
+        for st in list(streams.values()):
+            st.procs["ffmpeg"] = st.procs["snapshot"] = None
+            st.procs["rist"] = []
         procs["mediamtx"] = None
-        procs["rist"] = []
+        busy = _wait_ports_free(_child_ports(current_cfg), float(sc["port_wait_sec"])) if current_cfg else set()
+        logger.info(f"[STOP] all children stopped in {time.monotonic() - t0:.2f}s"
+                    + (f"; groups left: {left}" if left else "") + (f"; ports still busy: {sorted(busy)}" if busy else ""))
+        return not left and not busy
+
+def restart_all():
+    stop_all()
+    start_all()
+    return "restarted"
+
+def desired_specs(st) -> dict:
+    """
+    Что должно быть запущено у потока: kind -> сравнимое описание процесса (None — не запущен).
+    Секции, не попадающие в командные строки (ui, preview_url, supervisor, ...), сюда не влияют.
+    """
+    argv, uid, gid, _, on = build_rist_cmd_single(st.cfg, st.shim.target_port if st.shim else None)
+    snap = build_snapshot_cmd(st.cfg, snapshot_path(st.sid))
+    return {
+        "ffmpeg": (build_ffmpeg_cmd(st.cfg), sched_cfg(st.cfg, "ffmpeg")),
+        "rist": (tuple(argv), int(uid), int(gid), sched_cfg(st.cfg, "rist")) if on else None,
+        "snapshot": (tuple(snap), _snapshot_sched(st.cfg)) if snap else None,
+    }
+
+def running_specs(st) -> dict:
+    f, r, s = _managed("ffmpeg", st), _managed("rist", st), _managed("snapshot", st)
+    return {
+        "ffmpeg": (f.args, f.sched_req) if (f and f.poll() is None) else None,
+        "rist": getattr(r, "spec", None) if (r and r.poll() is None) else None,
+        "snapshot": (tuple(s.args), s.sched_req) if (s and s.poll() is None) else None,
+    }
+
+def _mediamtx_specs(cfg):
+    """(нужная, текущая) команда MediaMTX (с настройками планировщика)."""
+    m = procs.get("mediamtx")
+    return ((MEDIAMTX_CMD, sched_cfg(cfg, "mediamtx")) if cfg.get("mediamtx", {}).get("enable", True) else None,
+            (tuple(m.args), m.sched_req) if (m and m.poll() is None) else None)
+
+# -----------------------------
+# MAKE-BEFORE-BREAK (замена ristsender без разрыва)
+# -----------------------------
+class UdpShim:
+    """
+    Локальный UDP-shim: держит основной порт tee вместо ristsender и пересылает
+    датаграммы на внутренний порт текущего ristsender. switch() переключает
+    назначение атомарно — новый ristsender поднимается заранее, старый гасится после.
+    Новый шлёт на запасные VIP (senders[i].mbb_virt_ip), см. build_rist_cmd_single.
+    """
+    def __init__(self, listen_port: int, target_port: int):
+        self.listen_port = listen_port
+        self.target_port = target_port
+        self.packets = 0
+        self.bytes = 0
+        self.first_tx = None
+        self.last_tx = None
+        self.last_gap_ms = None
+        self._switch_from = None
+        self._in = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._in.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._in.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4*1024*1024)
+        self._in.bind(("127.0.0.1", listen_port))
+        self._in.settimeout(0.5)
+        self._out = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._closed = False
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _run(self):
+        while not self._closed:
+            try:
+                data = self._in.recv(65535)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            try:
+                self._out.sendto(data, ("127.0.0.1", self.target_port))
+            except OSError:
+                continue
+            now = time.monotonic()
+            if self._switch_from is not None:
+                # первая датаграмма новому ristsender: разрыв = от последней старому
+                self.last_gap_ms = round((now - self._switch_from) * 1000, 1)
+                self._switch_from = None
+            if self.first_tx is None:
+                self.first_tx = now
+            self.last_tx = now
+            self.packets += 1
+            self.bytes += len(data)
+
+    def switch(self, port: int):
+        self.last_gap_ms = None
+        self._switch_from = self.last_tx or time.monotonic()
+        self.target_port = port
+
+    def close(self):
+        self._closed = True
+        for s in (self._in, self._out):
+            try: s.close()
+            except Exception: pass
+
+def _mbb_cfg(cfg) -> dict:
+    r = cfg.get("rist", {}) or {}
+    d = {
+        "ports": [10100, 10101],
+        "handshake_timeout_sec": 3.0,
+    }
+    return {**d, **(r.get("mbb", {}) or {}), "enable": str(r.get("swap_mode", "restart")) == "make_before_break"}
+
+def _mbb_alt(cfg, in_port) -> bool:
+    """ristsender на втором внутреннем порту shim — шлёт на запасные VIP."""
+    mc = _mbb_cfg(cfg)
+    return bool(in_port) and mc["enable"] and int(in_port) == int(mc["ports"][1])
+
+def _mbb_missing(cfg) -> list:
+    """Включённые пути без своего запасного VIP: для них перекрытие невозможно."""
+    return [s.get("cname", f"m{i}") for i, s in enumerate((cfg.get("rist", {}) or {}).get("senders", []) or [])
+            if s.get("enabled", True) and s.get("virt_ip", f"10.255.0.{i+1}") == s.get("mbb_virt_ip", s.get("virt_ip", f"10.255.0.{i+1}"))]
+
+def ensure_shim(st):
+    mc = _mbb_cfg(st.cfg)
+    port = _primary_ts_port(st.cfg)
+    if mc["enable"] and st.shim and st.shim.listen_port == port:
+        return st.shim
+    if st.shim:
+        st.shim.close()
+        st.shim = None
+    if mc["enable"]:
+        try:
+            st.shim = UdpShim(port, int(mc["ports"][0]))
+            logger.info(f"[RIST/MBB] {st.sid}: shim udp://127.0.0.1:{port} -> :{st.shim.target_port}")
+        except OSError as e:
+            logger.info(f"[RIST/MBB] {st.sid}: shim bind {port} failed: {e}; falling back to restart mode")
+    return st.shim
+
+@traced()
+def restart_rist(st):
+    """Перезапуск только ristsender потока: make-before-break через shim, иначе kill + spawn."""
+    cfg, shim = st.cfg, st.shim
+    old = st.procs["rist"][0] if st.procs["rist"] else None
+    if not shim or not old or old.poll() is not None:
+        _start_rist(st)
+        return
+    missing = _mbb_missing(cfg)
+    if missing:
+        logger.info(f"[RIST/MBB] {st.sid}: no mbb_virt_ip for {missing}: old and new ristsender would share "
+                    f"the relays' 5-tuple; restarting instead")
+        _start_rist(st)
+        return
+
+    mc = _mbb_cfg(cfg)
+    ports = [int(x) for x in mc["ports"]]
+    new_port = ports[1] if shim.target_port == ports[0] else ports[0]
+    peers = (build_rist_cmd_single(cfg)[0] or []).count("-o")
+    t0 = time.monotonic()
+    p = _spawn_rist(st, new_port, standby=True)
+    if not p:
+        _start_rist(st)  # все пути выключены — просто гасим старый
+        return
+    deadline = t0 + float(mc["handshake_timeout_sec"])
+    with span("wait.handshake", name=p.name, peers=peers):
+        while time.monotonic() < deadline and rist_peers_ready(p) < peers and p.poll() is None:
+            time.sleep(0.02)
+    if p.poll() is not None:
+        logger.info(f"[RIST/MBB] {st.sid}: new ristsender exited rc={p.returncode}; keeping the old one")
+        return
+    hs_s, ready = time.monotonic() - t0, rist_peers_ready(p)
+    if ready < peers:
+        logger.info(f"[RIST/MBB] {st.sid}: only {ready}/{peers} peers up after {hs_s:.1f}s; switching anyway")
+    shim.switch(new_port)
+    for _ in range(50):
+        if shim.last_gap_ms is not None: break
+        time.sleep(0.02)
+    p.standby = False
+    st.procs["rist"] = [p]
+    kill_proc(old)
+    logger.info(f"[RIST/MBB] {st.sid}: swapped to :{new_port}: peers up {ready}/{peers} "
+                f"in {hs_s:.2f}s, input gap {shim.last_gap_ms} ms")
+
+def reload_rist():
+    """Пересборка ristsender'ов по конфигу: перезапускаются только потоки с изменившейся командой."""
+    global current_cfg
+    with lock:
+        cfg = read_cfg()
+        current_cfg = cfg
+        trace_configure(cfg)
+        added, _ = sync_streams(cfg)
+        out = []
+        for st in list(streams.values()):
+            if st not in added and desired_specs(st)["rist"] != running_specs(st)["rist"]:
+                restart_rist(st)
+                out.append(st.name("rist"))
+        if added:
+            _run_startup(cfg, added, start_mediamtx=False)
+            out += [f"stream {st.sid} started" for st in added]
+        return ("restarted: " + ", ".join(out)) if out else "no restart needed"
+
+# -----------------------------
+# TS RING (последние N минут потока на диске, выгрузка отрезка без перекодирования)
+# -----------------------------
+RING_MAGIC = b"TSRING1\0"
+RING_HDR = struct.Struct("<8sQQQQ")  # magic, размер кольца, ёмкость индекса, записано байт всего, записей индекса всего
+RING_IDX = struct.Struct("<QQQI4x")  # абсолютное смещение, unix_ns, PCR (27 МГц), флаги
+RING_IDX_AT = 64
+RF_KEY, RF_PCR, RF_GAP = 1, 2, 4     # ключевой кадр (с PAT/PMT перед ним) | PCR | первый пакет после паузы
+NO_PCR = (1 << 64) - 1
+RING_GAP_NS = 2 * 10**9
+
+def _rec_cfg(cfg) -> dict:
+    d = {"enable": False, "port": None, "dir": "/data/ring", "minutes": 10, "size_mb": None,
+         "index_entries": 16384, "flush_sec": 1.0}
+    return {**d, **(cfg.get("recorder", {}) or {})}
+
+def _rec_port(cfg):
+    """recorder.port или четвёртый порт tee (ristsender, tap, снимки — первые три)."""
+    rc = _rec_cfg(cfg)
+    if not rc["enable"]:
+        return None
+    if rc.get("port"):
+        return int(rc["port"])
+    ports = (((cfg.get("ffmpeg", {}) or {}).get("tee", {}) or {}).get("udp_ports", [10000,10001,10002,10003,10010]))
+    return int(ports[3]) if len(ports) > 3 else None
+
+def _rec_size(cfg) -> int:
+    """size_mb или minutes × (maxrate видео + звук) с запасом 25% на TS и всплески; кратно 188 × 4096."""
+    rc = _rec_cfg(cfg)
+    if rc.get("size_mb"):
+        b = float(rc["size_mb"]) * 1024 * 1024
+    else:
+        v = _video_cfg(cfg)[2]
+        kbps = int(v.get("maxrate_kbps", v.get("bitrate_kbps", 4000))) + int((cfg.get("audio", {}) or {}).get("bitrate_kbps", 128))
+        b = kbps * 1000 / 8 * float(rc["minutes"]) * 60 * 1.25
+    unit = 188 * 4096
+    return max(1, math.ceil(b / unit)) * unit
+
+def ring_base(cfg, sid) -> str:
+    return os.path.join(_rec_cfg(cfg)["dir"], "".join(ch for ch in str(sid) if ch.isalnum() or ch in "-_"))
+
+class TsRing:
+    """
+    Кольцо TS на диске: <base>.ts — данные фиксированного размера, пишутся по кругу строго
+    последовательно; <base>.idx — заголовок (сколько записано) и кольцо записей индекса.
+    Оба файла отображены в память; смещения в индексе абсолютные (байт с начала записи),
+    место в файле — смещение % размер. Без size открывается только на чтение (выгрузка).
+    """
+    def __init__(self, base, size=None, idx_cap=None):
+        self.writable = size is not None
+        mode = (os.O_RDWR | os.O_CREAT) if self.writable else os.O_RDONLY
+        ifd = os.open(base + ".idx", mode, 0o644)
+        try:
+            dfd = os.open(base + ".ts", mode, 0o644)
+        except OSError:
+            os.close(ifd)
+            raise
+        try:
+            hdr = os.pread(ifd, RING_HDR.size, 0)
+            ok = len(hdr) == RING_HDR.size and hdr[:8] == RING_MAGIC
+            _, dsize, cap, _, _ = RING_HDR.unpack(hdr) if ok else (b"", 0, 0, 0, 0)
+            self.resumed = self.writable and ok and (dsize, cap) == (size, idx_cap)
+            if self.writable and not self.resumed:
+                # новое кольцо или другой размер: старое содержимое не переносим
+                dsize, cap = size, idx_cap
+                for fd, n in ((dfd, dsize), (ifd, RING_IDX_AT + cap * RING_IDX.size)):
+                    os.ftruncate(fd, 0)
+                    os.ftruncate(fd, n)
+                    try: os.posix_fallocate(fd, 0, n)  # место сразу и без дыр — запись потом только по порядку
+                    except (AttributeError, OSError): pass
+                os.pwrite(ifd, RING_HDR.pack(RING_MAGIC, dsize, cap, 0, 0), 0)
+            elif not ok:
+                raise ValueError(f"{base}.idx: not a TS ring")
+            acc = mmap.ACCESS_WRITE if self.writable else mmap.ACCESS_READ
+            self.size, self.cap = dsize, cap
+            self.idx = mmap.mmap(ifd, RING_IDX_AT + cap * RING_IDX.size, access=acc)
+            self.data = mmap.mmap(dfd, dsize, access=acc)
+        finally:
+            os.close(ifd); os.close(dfd)  # отображения держат файлы сами
+        self.written, self.count = self.head()
+        self.flushed = self.written
+
+    def head(self):
+        """(записано байт всего, записей индекса всего) — из заголовка, видно и другим процессам."""
+        return struct.unpack_from("<QQ", self.idx, 24)
+
+    def append(self, buf):
+        pos, n = self.written % self.size, len(buf)
+        k = min(n, self.size - pos)
+        self.data[pos:pos + k] = buf[:k]
+        if k < n:
+            self.data[0:n - k] = buf[k:]
+        self.written += n
+        struct.pack_into("<Q", self.idx, 24, self.written)
+
+    def add(self, off, t_ns, pcr, flags):
+        RING_IDX.pack_into(self.idx, RING_IDX_AT + (self.count % self.cap) * RING_IDX.size, off, t_ns, pcr, flags)
+        self.count += 1
+        struct.pack_into("<Q", self.idx, 32, self.count)
+
+    def flush(self):
+        """msync записанного с прошлого раза (по порядку кольца), затем страницы отпускаем — RSS не растёт."""
+        lo, hi = max(self.flushed, self.written - self.size), self.written
+        g = mmap.ALLOCATIONGRANULARITY
+        while lo < hi:
+            pos = lo % self.size
+            end = min(self.size, pos + (hi - lo))
+            start = pos - pos % g
+            self.data.flush(start, end - start)
+            if hasattr(self.data, "madvise"):
+                self.data.madvise(mmap.MADV_DONTNEED, start, end - start)
+            lo += end - pos
+        self.idx.flush()
+        self.flushed = hi
+
+    def _entry(self, i):
+        return RING_IDX.unpack_from(self.idx, RING_IDX_AT + (i % self.cap) * RING_IDX.size)
+
+    def entries(self):
+        """Действующие записи индекса по порядку: (смещение, unix_ns, pcr, флаги); затёртое кольцом отброшено."""
+        written, count = self.head()
+        out, last = [], written - self.size
+        for i in range(max(0, count - self.cap), count):
+            e = self._entry(i)
+            if e[0] >= last:  # заодно отсекает слот, который писатель как раз перезаписывает
+                out.append(e)
+                last = e[0]
+        return out
+
+    def oldest(self):
+        """Первая действующая запись (двоичный поиск: смещения в индексе растут) или None."""
+        written, count = self.head()
+        lo, hi = max(0, count - self.cap), count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._entry(mid)[0] < written - self.size:
+                lo = mid + 1
+            else:
+                hi = mid
+        return self._entry(lo) if lo < count else None
+
+    def clip(self, t_from_ns, t_to_ns):
+        """-> (начало, конец, unix_ns начала) отрезка: от ключевого кадра не позже t_from до первой записи после t_to."""
+        written, _ = self.head()
+        es = self.entries()
+        keys = [e for e in es if e[3] & RF_KEY and e[1] <= t_to_ns]
+        if not keys:
+            return None
+        before = [e for e in keys if e[1] <= t_from_ns]
+        start = before[-1] if before else keys[0]  # раньше начала кольца — с самого старого кадра
+        end = next((e[0] for e in es if e[1] >= t_to_ns and e[0] > start[0]), written)
+        return start[0], end, start[1]
+
+    def read(self, start, end, chunk=1 << 20):
+        """Байты [start, end) кусками; если кольцо успело затереть ещё не прочитанное — обрываем."""
+        while start < end:
+            pos = start % self.size
+            n = min(chunk, end - start, self.size - pos)
+            buf = self.data[pos:pos + n]
+            if self.head()[0] > start + self.size:
+                logger.info(f"[RING] export overrun at {start}: ring wrapped during read, clip truncated")
+                return
+            yield buf
+            start += n
+
+    def close(self):
+        for m in (self.data, self.idx):
+            try: m.close()
+            except Exception: pass
+
+class TsRecorder:
+    """
+    Запасной порт tee -> TsRing. Пишутся только целые TS-пакеты (188 байт). В индекс —
+    ключевые кадры видео (RAI + начало PES 0xE0..0xEF; смещение — PAT перед ним, если есть:
+    mpegts_flags pat_pmt_at_frames), PCR не реже раза в секунду и разрывы потока.
+    """
+    def __init__(self, port, base, size, idx_cap, flush_sec):
+        self.port, self.base = port, base
+        self.spec = (port, base, size, idx_cap, flush_sec)
+        os.makedirs(os.path.dirname(base), exist_ok=True)
+        self.ring = TsRing(base, size, idx_cap)
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 21)
+            self._sock.bind(("127.0.0.1", port))
+        except OSError:
+            self._sock.close(); self.ring.close()
+            raise
+        self._sock.settimeout(0.5)
+        self.flush_sec = float(flush_sec)
+        self.last_rx_ns = None
+        self.entry_ns = 0
+        self.pat_at = None
+        self.datagrams = self.keyframes = self.resyncs = 0
+        self._closed = False
+        self._t = threading.Thread(target=self._run, daemon=True)
+        self._t.start()
+
+    def _run(self):
+        next_flush = time.monotonic() + self.flush_sec
+        while not self._closed:
+            try:
+                self._feed(self._sock.recv(65535))
+            except socket.timeout:
+                pass
+            except OSError:
+                break
+            if time.monotonic() >= next_flush:
+                self.ring.flush()
+                next_flush = time.monotonic() + self.flush_sec
+        self.ring.flush()
+        self.ring.close()
+
+    def _feed(self, data):
+        now = time.time_ns()
+        off = 0
+        if data[:1] != b"\x47" or len(data) % 188:
+            self.resyncs += 1
+            off = next((i for i in range(min(188, len(data)))
+                        if data[i] == 0x47 and (i + 188 >= len(data) or data[i + 188] == 0x47)), None)
+            if off is None:
+                return
+        n = (len(data) - off) // 188 * 188
+        if not n:
+            return
+        base, ents = self.ring.written - off, []
+        if self.last_rx_ns is None or now - self.last_rx_ns > RING_GAP_NS:
+            ents.append((base + off, now, NO_PCR, RF_GAP))
+        self.last_rx_ns = now
+        for i in range(off, off + n, 188):
+            b1, b3 = data[i + 1], data[i + 3]
+            if b1 & 0x5F == 0x40 and data[i + 2] == 0:  # PID 0 (PAT), начало секции
+                self.pat_at = base + i
+            if not (b3 & 0x20) or data[i + 4] == 0:
+                continue
+            fl, pcr = data[i + 5], NO_PCR
+            if fl & 0x10 and data[i + 4] >= 7:
+                p = int.from_bytes(data[i + 6:i + 12], "big")
+                pcr = (p >> 15) * 300 + (p & 0x1FF)
+            ps = i + 5 + data[i + 4]
+            if fl & 0x40 and b1 & 0x40 and ps + 4 <= i + 188 \
+                    and data[ps:ps + 3] == b"\0\0\1" and 0xE0 <= data[ps + 3] <= 0xEF:
+                pat = self.pat_at if self.pat_at is not None and 0 <= base + i - self.pat_at <= 188 * 16 else None
+                ents.append((base + i if pat is None else pat, now, pcr, RF_KEY | (RF_PCR if pcr != NO_PCR else 0)))
+                self.pat_at, self.entry_ns = None, now
+                self.keyframes += 1
+            elif pcr != NO_PCR and now - self.entry_ns >= 10**9:
+                ents.append((base + i, now, pcr, RF_PCR))
+                self.entry_ns = now
+        self.ring.append(memoryview(data)[off:off + n])
+        for e in ents:
+            self.ring.add(*e)  # после данных: читатель не увидит запись раньше её байтов
+        self.datagrams += 1
+
+    def status(self) -> dict:
+        written, _ = self.ring.head()
+        first = self.ring.oldest()
+        newest = self.last_rx_ns
+        return {
+            "port": self.port, "file": self.base + ".ts",
+            "size_mb": round(self.ring.size / 1048576, 1),
+            "used_mb": round(min(written, self.ring.size) / 1048576, 1),
+            "oldest_at": round(first[1] / 1e9, 3) if first else None,
+            "newest_at": round(newest / 1e9, 3) if newest else None,
+            "span_sec": round((newest - first[1]) / 1e9, 1) if (first and newest) else None,
+            "datagrams": self.datagrams, "keyframes": self.keyframes, "resyncs": self.resyncs,
+        }
+
+    def close(self):
+        self._closed = True
+        try: self._sock.close()
+        except Exception: pass
+        self._t.join(timeout=2)  # кольцо сброшено и закрыто до того, как его откроет новый писатель
+
+def ensure_recorder(st):
+    port = _rec_port(st.cfg)
+    rc = _rec_cfg(st.cfg)
+    spec = (port, ring_base(st.cfg, st.sid), _rec_size(st.cfg), int(rc["index_entries"]), float(rc["flush_sec"])) if port else None
+    if st.rec and st.rec.spec == spec:
+        return st.rec
+    if st.rec:
+        st.rec.close()
+        st.rec = None
+    if spec:
+        try:
+            st.rec = TsRecorder(*spec)
+            logger.info(f"[RING] {st.sid}: udp://127.0.0.1:{port} -> {spec[1]}.ts, {spec[2] / 1048576:.1f} MiB"
+                        + (" (resumed)" if st.rec.ring.resumed else ""))
+        except (OSError, ValueError) as e:
+            logger.info(f"[RING] {st.sid}: recorder on {port} failed: {e}")
+    return st.rec
+
+def _ring_time(v, now_ns, default):
+    """'-90' — секунд назад, '0' — сейчас, 1760880000 — unix, '2026-10-19T14:02:00' — местное время."""
+    if v is None or v == "":
+        v = default
+    try:
+        x = float(v)
+        return int(now_ns + x * 1e9) if x <= 0 else int(x * 1e9)
+    except (TypeError, ValueError):
+        from datetime import datetime
+        return int(datetime.fromisoformat(str(v)).timestamp() * 1e9)
+
+# -----------------------------
+# SUPERVISOR (рестарт упавших/зависших процессов)
+# -----------------------------
+class TeeTap:
+    """
+    Слушает запасной UDP-порт tee (127.0.0.1). Основной порт занят ristsender'ом,
+    а этот — копия того же TS: по нему видно, что FFmpeg реально выдаёт поток.
+    """
+    def __init__(self, port: int):
+        self.port = port
+        self.bytes = 0
+        self.packets = 0
+        self.first_rx = None
+        self.last_rx = None
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._sock.bind(("127.0.0.1", port))
+        self._sock.settimeout(0.5)
+        self._closed = False
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _run(self):
+        while not self._closed:
+            try:
+                data = self._sock.recv(65535)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            now = time.monotonic()
+            if self.first_rx is None:
+                self.first_rx = now
+            self.last_rx = now
+            self.bytes += len(data)
+            self.packets += 1
+
+    def close(self):
+        self._closed = True
+        try: self._sock.close()
+        except Exception: pass
+
+incidents = deque(maxlen=100)
+_sup = {}  # name -> {"attempts", "next_at", "incident", "rate_bps", ...}
+
+def _sup_cfg(cfg) -> dict:
+    d = {
+        "enable": True, "check_interval_sec": 0.5,
+        "stall_sec": 3.0, "rist_stall_sec": 5.0, "startup_grace_sec": 10.0,
+        "backoff_min_sec": 0.5, "backoff_max_sec": 15.0, "stable_sec": 30.0,
+        "tap_port": None,
+    }
+    return {**d, **(cfg.get("supervisor", {}) or {})}
+
+def _tap_port(cfg):
+    """supervisor.tap_port или второй порт tee (первый — вход ristsender)."""
+    sc = _sup_cfg(cfg)
+    if sc.get("tap_port"):
+        return int(sc["tap_port"])
+    ports = (((cfg.get("ffmpeg", {}) or {}).get("tee", {}) or {}).get("udp_ports", [10000,10001,10002,10003,10010]))
+    return int(ports[1]) if len(ports) > 1 else None
+
+def ensure_tap(st):
+    port = _tap_port(st.cfg) if _sup_cfg(st.cfg)["enable"] else None
+    if st.tap and st.tap.port == port:
+        return st.tap
+    if st.tap:
+        st.tap.close()
+        st.tap = None
+    if port:
+        try:
+            st.tap = TeeTap(port)
+            logger.info(f"[SUP] {st.sid}: tee tap on udp://127.0.0.1:{port}")
+        except OSError as e:
+            logger.info(f"[SUP] {st.sid}: tee tap bind {port} failed: {e}; ffmpeg stall detection off")
+    return st.tap
+
+def _units():
+    """(имя, поток, вид) всех управляемых процессов; MediaMTX — общий, без потока."""
+    out = [("mediamtx", None, "mediamtx")]
+    for st in list(streams.values()):
+        out += [(st.name("ffmpeg"), st, "ffmpeg"), (st.name("rist"), st, "rist"), (st.name("snapshot"), st, "snapshot")]
+    return out
+
+def _managed(kind, st=None):
+    if kind == "mediamtx":
+        return procs.get("mediamtx")
+    return (st.procs["rist"] or [None])[0] if kind == "rist" else st.procs.get(kind)
+
+def _start_unit(kind, st):
+    if kind == "mediamtx":
+        _start_mediamtx(current_cfg)
+    elif kind == "ffmpeg":
+        _start_ffmpeg(st)
+    elif kind == "snapshot":
+        _start_snapshot(st)
+    else:
+        _start_rist(st)
+
+def _progress_at(kind, st, p):
+    """Последний признак жизни после старта p: байты на tap (ffmpeg) или строка вывода (ristsender)."""
+    if kind == "ffmpeg" and st.tap:
+        t = st.tap.last_rx
+    elif kind == "rist":
+        t = p.last_output
+    else:
+        return None
+    return t if t and t > p.started_at else None
+
+def _open_incident(name, kind, p, detect_s, now):
+    inc = {
+        "proc": name, "kind": kind, "rc": p.poll(),
+        "at": round(time.time(), 3),
+        "detect_s": round(detect_s, 3),
+        "recover_s": None, "restarts": 0,
+    }
+    incidents.append(inc)
+    logger.info(f"[SUP] {name}: {kind} detected in {inc['detect_s']}s (rc={inc['rc']})")
+    st = _sup[name]
+    if st.get("incident") is None:
+        # повторные падения до восстановления считаем одним инцидентом
+        st["incident"] = inc
+        st["detected_at"] = now
+    return st
+
+def _supervise_one(name, stream, kind, sc, now):
+    p = _managed(kind, stream)
+    st = _sup.setdefault(name, {"attempts": 0, "incident": None, "next_at": None})
+    if p is None:
+        st.update(incident=None, next_at=None)
+        return
+
+    if st["next_at"] and st.get("proc") is not p:
+        st["next_at"] = None  # процесс уже перезапущен извне (start_all и т.п.)
+
+    # ждём рестарта по backoff
+    if st["next_at"]:
+        if now < st["next_at"]:
+            return
+        st["next_at"] = None
+        st["attempts"] += 1
+        if st["incident"]:
+            st["incident"]["restarts"] += 1
+        logger.info(f"[SUP] {name}: restart #{st['attempts']}")
+        _start_unit(kind, stream)
+        return
+
+    watched = kind == "rist" or (kind == "ffmpeg" and stream.tap is not None)
+    age = now - p.started_at
+    progress = _progress_at(kind, stream, p)
+    if p.poll() is not None:
+        _open_incident(name, "crash", p, now - (p.exited_at or now), now)
+    else:
+        if progress is not None:
+            silent, limit = now - progress, float(sc["stall_sec"])
+        else:
+            silent, limit = age, float(sc["startup_grace_sec"])  # ещё ни одного признака жизни
+        if kind == "rist" and progress is not None:
+            limit = float(sc["rist_stall_sec"])
+        if not watched or silent <= limit:
+            inc = st["incident"]
+            if inc and (progress is not None or (not watched and age >= 1.0)):
+                inc["recover_s"] = round(now - st["detected_at"], 3)
+                logger.info(f"[SUP] {name}: recovered in {inc['recover_s']}s after {inc['restarts']} restart(s)")
+                st["incident"] = None
+            if st["attempts"] and age > float(sc["stable_sec"]):
+                st["attempts"] = 0
+            return
+        _open_incident(name, "stall", p, silent, now)
+        kill_proc(p)
+
+    delay = min(float(sc["backoff_max_sec"]), float(sc["backoff_min_sec"]) * (2 ** st["attempts"]))
+    st["next_at"] = now + delay
+    st["proc"] = p
+    logger.info(f"[SUP] {name}: restart in {delay:.1f}s")
+
+def supervisor_loop():
+    while True:
+        sc = _sup_cfg(current_cfg)
+        time.sleep(float(sc["check_interval_sec"]))
+        if not sc["enable"]:
+            continue
+        now = time.monotonic()
+        with lock:
+            for name, stream, kind in _units():
+                try:
+                    # пороги — из конфига потока (его секция supervisor может переопределять общую)
+                    _supervise_one(name, stream, kind, _sup_cfg(stream.cfg) if stream else sc, now)
+                except Exception as e:
+                    logger.info(f"[SUP] {name}: supervise error: {e}")
+        for stream in list(streams.values()):
+            if stream.tap:
+                b0, t0 = stream.tap_prev
+                stream.tap_rate_bps = int(max(0, stream.tap.bytes - b0) * 8 / max(now - t0, 1e-3))
+                stream.tap_prev = (stream.tap.bytes, now)
+
+def sched_status() -> dict:
+    """name -> {requested, applied}; applied — прочитано у процесса сразу после старта."""
+    out = {"ui": {"requested": sched_cfg(current_cfg, "ui"), "applied": sched_state(0)}}
+    for name, stream, kind in _units():
+        p = _managed(kind, stream)
+        if p is not None and p.poll() is None:
+            out[name] = {"requested": p.sched_req, "applied": p.sched}
+    return out
+
+def supervisor_status() -> dict:
+    names = {n for n, _, _ in _units()}
+    first = next(iter(streams.values()), None)  # tap_* — первого потока, как до появления streams
+    return {
+        "tap_port": first.tap.port if (first and first.tap) else None,
+        "tap_rate_bps": first.tap_rate_bps if first else None,
+        "restarts": {n: st["attempts"] for n, st in list(_sup.items()) if n in names},
+        "incidents": list(incidents)[-20:],
+    }
+
+# -----------------------------
+# QUARANTINE (авто-вывод путей с мёртвым модемом)
+# -----------------------------
+quarantine = {}   # cname -> {"iface", "reason", "since", "lost_at"}; такие пути не попадают в argv ristsender
+_qstate = {}      # cname -> {"penalty", "penalty_at", "dead_since", "healthy_since", "held"}
+_quar_events = deque()  # ещё не применённые изменения (для лога латентности)
+_feeds = {}       # path -> (mtime, data)
+_quar_skipped = set()  # потоки, о которых уже предупредили: карантин у них не применяется
+
+def _quar_cfg(cfg) -> dict:
+    d = {
+        "enable": False, "check_interval_sec": 0.5,
+        "health_file": "/host/run/rist-modems/rist-modems.json",     # modem-health (status, changed_at)
+        "ui_file": "/host/run/rist-modems/rist-modems-ui.json",      # modem-ui-watch (conn)
+        "restore_stable_sec": 15.0,   # сколько путь должен быть здоров до возврата (× штраф)
+        "half_life_sec": 120.0,       # полураспад штрафа за флап
+        "max_hold_sec": 300.0,
+        "min_active": 1,              # последний путь не выводим, даже если он мёртв
+        "allow_restart": False,       # и в swap_mode: restart (вывод пути = перезапуск всех путей)
+    }
+    return {**d, **(cfg.get("quarantine", {}) or {})}
+
+def _read_feed(path):
+    try:
+        mt = os.stat(path).st_mtime
+    except OSError:
+        return None
+    c = _feeds.get(path)
+    if c and c[0] == mt:
+        return c[1]
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except Exception:
+        return c[1] if c else None  # modem-ui-watch пишет не атомарно — берём прошлый снимок
+    _feeds[path] = (mt, data)
+    return data
+
+def modem_health(qc) -> dict:
+    """iface -> (healthy, lost_at, reason). Интерфейсов, о которых фиды молчат, в ответе нет."""
+    out = {}
+    for r in _read_feed(qc["health_file"]) or []:
+        if r.get("status") == "up_internet":
+            out[r.get("iface")] = (True, None, None)
+        else:
+            out[r.get("iface")] = (False, r.get("changed_at"), f"health={r.get('status')}")
+    for r in _read_feed(qc["ui_file"]) or []:
+        iface = r.get("iface")
+        if not r.get("ok"):
+            continue  # веб-морда модема не ответила — это не значит, что нет интернета
+        if r.get("conn") != "connected":
+            if out.get(iface, (True,))[0]:
+                out[iface] = (False, None, f"conn={r.get('conn')}")
+        else:
+            out.setdefault(iface, (True, None, None))
+    return out
+
+def _quar_capable(stream, qc) -> bool:
+    """
+    Вывод пути пересобирает ristsender: без make-before-break (и запасных VIP) это перезапуск,
+    рвущий все пути ради одного мёртвого — такие потоки карантин не трогает, если не allow_restart.
+    """
+    if qc["allow_restart"] or (_mbb_cfg(stream.cfg)["enable"] and not _mbb_missing(stream.cfg)):
+        _quar_skipped.discard(stream.sid)
+        return True
+    if stream.sid not in _quar_skipped:
+        _quar_skipped.add(stream.sid)
+        logger.info(f"[QUAR] {stream.sid}: WARNING: quarantine needs swap_mode: make_before_break with "
+                    f"senders[].mbb_virt_ip, otherwise removing one path restarts ristsender and drops "
+                    f"every path; not applied to this stream (quarantine.allow_restart: true to force)")
+    return False
+
+def _quarantine_tick(qc, now):
+    # здоровье модемов общее: все потоки, чьи senders висят на одном interface, реагируют вместе
+    senders = [(stream.sid, s.get("cname", f"m{i}"), s)
+               for stream in list(streams.values()) if _quar_capable(stream, qc)
+               for i, s in enumerate((stream.cfg.get("rist", {}) or {}).get("senders", []) or [])
+               if s.get("enabled", True)]
+    names = {c for _, c, _ in senders}
+    changed = False
+    for c in list(quarantine):
+        if c not in names:
+            # путь выключен/удалён в конфиге (в argv его и так нет) или поток вышел из-под карантина
+            del quarantine[c]
+            _quar_events.append(("restore", c, now))
+            changed = True
+    health = modem_health(qc)
+    active = {}  # sid -> число путей вне карантина; min_active — на поток
+    for sid, c, _ in senders:
+        active[sid] = active.get(sid, 0) + (c not in quarantine)
+    for sid, cname, s in senders:
+        st = _qstate.setdefault(cname, {"penalty": 0.0, "penalty_at": now, "dead_since": None,
+                                        "healthy_since": None, "held": False})
+        st["penalty"] *= 0.5 ** ((now - st["penalty_at"]) / float(qc["half_life_sec"]))
+        st["penalty_at"] = now
+        h = health.get(s.get("interface"))
+        if h is None:
+            continue
+        healthy, lost_at, reason = h
+        if not healthy:
+            st["healthy_since"] = None
+            if st["dead_since"] is None:
+                # changed_at от modem-health точнее, иначе — момент, когда заметили мы
+                st["dead_since"] = float(lost_at) if lost_at else now
+            if cname in quarantine:
+                continue
+            if active[sid] - 1 < int(qc["min_active"]):
+                if not st["held"]:
+                    logger.info(f"[QUAR] {cname}: {reason}, but it is the last active path; keeping it")
+                    st["held"] = True
+                continue
+            st["held"] = False
+            st["penalty"] += 1.0
+            quarantine[cname] = {"iface": s.get("interface"), "reason": reason,
+                                 "since": round(now, 3), "lost_at": round(st["dead_since"], 3)}
+            _quar_events.append(("quarantine", cname, st["dead_since"]))
+            active[sid] -= 1
+            changed = True
+        else:
+            st["dead_since"] = None
+            st["held"] = False
+            if st["healthy_since"] is None:
+                st["healthy_since"] = now
+            if cname not in quarantine:
+                continue
+            # флап-демпфинг: чем чаще путь падал, тем дольше он должен продержаться здоровым
+            hold = min(float(qc["max_hold_sec"]), float(qc["restore_stable_sec"]) * max(1.0, st["penalty"]))
+            if now - st["healthy_since"] >= hold:
+                del quarantine[cname]
+                _quar_events.append(("restore", cname, st["healthy_since"]))
+                active[sid] += 1
+                changed = True
+    if changed:
+        submit_job("quarantine", _apply_quarantine)
+
+def _apply_quarantine():
+    reload_rist()
+    done = time.time()
+    out = []
+    while _quar_events:
+        kind, cname, t = _quar_events.popleft()
+        if kind == "quarantine":
+            logger.info(f"[QUAR] {cname} quarantined ({quarantine.get(cname, {}).get('reason')}): "
+                        f"link loss -> path removed in {done - t:.2f}s")
+        else:
+            logger.info(f"[QUAR] {cname} restored after {done - t:.1f}s healthy (penalty {_qstate[cname]['penalty']:.2f})")
+        out.append(f"{kind} {cname}")
+    return ", ".join(out) or "ok"
+
+def quarantine_loop():
+    while True:
+        qc = _quar_cfg(current_cfg)
+        time.sleep(float(qc["check_interval_sec"]))
+        if not qc["enable"]:
+            if quarantine:
+                for c in list(quarantine):
+                    _quar_events.append(("restore", c, time.time()))
+                quarantine.clear()
+                submit_job("quarantine", _apply_quarantine)
+            continue
+        try:
+            _quarantine_tick(qc, time.time())
+        except Exception as e:
+            logger.info(f"[QUAR] error: {e}")
+
+def quarantine_status() -> dict:
+    return {
+        "paths": dict(quarantine),
+        "penalty": {c: round(st["penalty"], 2) for c, st in list(_qstate.items())},
+    }
+
+# -----------------------------
+# METRICS HISTORY (кольцевые буферы с прореживанием)
+# -----------------------------
+class SeriesStore:
+    """
+    Фиксированная память: на каждый ключ по кольцу на уровень (шаг, число слотов).
+    Слот хранит id бакета, сумму, число и максимум — точка пишется сразу во все уровни,
+    так что прореживание «автоматическое» и запись стоит O(уровней).
+    """
+    TIERS = ((1, 600), (10, 720), (60, 1440))  # 1 с × 10 мин, 10 с × 2 ч, 1 мин × 24 ч
+
+    def __init__(self, tiers=TIERS):
+        self.tiers = tuple(tiers)
+        self._series = {}
+        self._lk = threading.Lock()
+
+    def _new(self):
+        return [(array("q", [-1]) * n, array("d", [0.0]) * n, array("l", [0]) * n, array("d", [0.0]) * n)
+                for _, n in self.tiers]
+
+    def add(self, key, value, t=None):
+        if value is None:
+            return
+        t = time.time() if t is None else t
+        v = float(value)
+        with self._lk:
+            rings = self._series.get(key)
+            if rings is None:
+                rings = self._series[key] = self._new()
+            for (step, n), (ids, sums, cnts, maxs) in zip(self.tiers, rings):
+                b = int(t // step)
+                k = b % n
+                if ids[k] != b:
+                    ids[k], sums[k], cnts[k], maxs[k] = b, v, 1, v
+                else:
+                    sums[k] += v
+                    cnts[k] += 1
+                    if v > maxs[k]: maxs[k] = v
+
+    def keys(self):
+        with self._lk:
+            return sorted(self._series)
+
+    def query(self, key, window_s, now=None):
+        """Окно последних window_s секунд на самом мелком уровне, который его покрывает."""
+        now = time.time() if now is None else now
+        ti = next((i for i, (step, n) in enumerate(self.tiers) if step * n >= window_s), len(self.tiers) - 1)
+        step, n = self.tiers[ti]
+        with self._lk:
+            rings = self._series.get(key)
+            if rings is None:
+                return step, []
+            ids, sums, cnts, maxs = rings[ti]
+            last = int(now // step)
+            first = max(last - n + 1, int((now - window_s) // step))
+            pts = []
+            for b in range(first, last + 1):
+                k = b % n
+                if ids[k] == b and cnts[k]:
+                    pts.append([b * step, round(sums[k] / cnts[k], 3), round(maxs[k], 3)])
+        return step, pts
+
+history = SeriesStore()
+_CLK_TCK = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+_cpu_prev = {}  # name -> (ticks, monotonic)
+
+def _tree_pids(pid):
+    """pid и все его потомки (FFmpeg идёт через shell=True — считаем и детей)."""
+    out, todo = [], [pid]
+    while todo:
+        p = todo.pop()
+        out.append(p)
+        try:
+            with open(f"/proc/{p}/task/{p}/children") as f:
+                todo.extend(int(x) for x in f.read().split())
+        except Exception:
+            pass
+    return out
+
+def proc_usage(name, p):
+    """(cpu_pct одного ядра, rss_mb) по дереву процесса; cpu — между соседними вызовами."""
+    ticks, rss = 0, 0
+    for pid in _tree_pids(p.pid):
+        try:
+            with open(f"/proc/{pid}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+            ticks += int(fields[11]) + int(fields[12])  # utime + stime
+            rss += int(fields[21])
+        except Exception:
+            pass
+    now = time.monotonic()
+    prev = _cpu_prev.get(name)
+    _cpu_prev[name] = (ticks, now)
+    cpu = None
+    if prev and now > prev[1] and ticks >= prev[0]:
+        cpu = round(100.0 * (ticks - prev[0]) / _CLK_TCK / (now - prev[1]), 1)
+    return cpu, round(rss * os.sysconf("SC_PAGE_SIZE") / 1048576, 1)
+
+def _sample_metrics():
+    now = time.time()
+    for cname, st in list(path_stats.items()):
+        if time.monotonic() - st["_mono"] > RIST_STATS_STALE_SEC:
+            continue
+        for k in ("rate_kbps", "retry_kbps", "loss_pct", "rtt_ms"):
+            history.add(f"path.{cname}.{k}", st[k], now)
+    usage = {}
+    for name, stream, kind in _units():
+        p = _managed(kind, stream)
+        if p is None or p.poll() is not None:
+            _cpu_prev.pop(name, None)
+            continue
+        cpu, rss = proc_usage(name, p)
+        history.add(f"proc.{name}.cpu_pct", cpu, now)
+        history.add(f"proc.{name}.rss_mb", rss, now)
+        if stream and cpu is not None:
+            usage[stream.sid] = usage.get(stream.sid, 0.0) + cpu
+    for stream in list(streams.values()):
+        stream.cpu_pct = round(usage[stream.sid], 1) if stream.sid in usage else None
+        history.add(f"{stream.name('stream')}.cpu_pct", stream.cpu_pct, now)
+        if stream.tap_rate_bps is not None:
+            history.add(f"{stream.name('tee')}.rate_kbps", stream.tap_rate_bps / 1000.0, now)
+        budget = stream.cpu_budget
+        if budget and stream.cpu_pct and stream.cpu_pct > 100.0 * budget and now - stream.over_budget_at > 60:
+            stream.over_budget_at = now
+            logger.info(f"[STREAMS] {stream.sid}: cpu {stream.cpu_pct:.0f}% over budget {budget:g} core(s)")
+    if int(now) % 60 == 0:
+        _preview_cost_tick(now)
+
+_preview_cost = {}  # mode -> {"cpu_pct", "procs", "video", "at"}; см. preview_status
+
+def _load_preview_cost():
+    try:
+        with open(PREVIEW_COST_PATH, "r", encoding="utf-8") as f:
+            _preview_cost.update(json.load(f))
+    except Exception:
+        pass
+
+def _preview_cost_tick(now, window=300):
+    """
+    Средняя загрузка всего, что зависит от режима превью (FFmpeg всех потоков, снимки, MediaMTX),
+    за последние window секунд — запоминается по режиму, чтобы сравнить hls и snapshot
+    на одних и тех же настройках видео. Считаем, только если все потоки в одном режиме.
+    """
+    sts = list(streams.values())
+    modes = {str(_preview_cfg(st.cfg)["mode"]).lower() for st in sts}
+    if len(modes) != 1:
+        return
+    total, per = 0.0, {}
+    for name, stream, kind in _units():
+        if kind == "rist" or _managed(kind, stream) is None:
+            continue
+        pts = history.query(f"proc.{name}.cpu_pct", window, now)[1]
+        if len(pts) < window * 0.8:
+            return  # процесс перезапускался или ещё не набрал окно
+        per[name] = round(sum(x[1] for x in pts) / len(pts), 1)
+    video = hashlib.sha1(json.dumps([_video_cfg(st.cfg) for st in sts], sort_keys=True, default=str).encode()).hexdigest()[:12]
+    _preview_cost[modes.pop()] = {"cpu_pct": round(sum(per.values()), 1), "procs": per, "video": video, "at": round(now)}
+    try:
+        with open(PREVIEW_COST_PATH + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(_preview_cost, f)
+        os.replace(PREVIEW_COST_PATH + ".tmp", PREVIEW_COST_PATH)
+    except OSError:
+        pass
+
+def preview_status() -> dict:
+    """Режим превью и сколько CPU (% одного ядра) стоит конвейер в каждом режиме; saved — hls минус snapshot."""
+    h, s = _preview_cost.get("hls"), _preview_cost.get("snapshot")
+    saved = round(h["cpu_pct"] - s["cpu_pct"], 1) if (h and s and h["video"] == s["video"]) else None
+    return {
+        "modes": {st.sid: str(_preview_cfg(st.cfg)["mode"]).lower() for st in list(streams.values())},
+        "cpu_by_mode": dict(_preview_cost),
+        "saved_cpu_pct": saved,
+    }
+
+def metrics_loop():
+    while True:
+        time.sleep(1.0 - time.time() % 1.0)  # по границе секунды, чтобы бакеты не «плыли»
+        try:
+            _sample_metrics()
+        except Exception as e:
+            logger.info(f"[METRICS] sample error: {e}")
+
+# -----------------------------
+# STARTUP GRAPH (readiness-gated, параллельно где можно)
+# -----------------------------
+startup_stats = {}
+
+def _wait_until(cond, timeout, step=0.02) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if cond(): return True
+        time.sleep(step)
+    return bool(cond())
+
+def _tcp_open(host, port) -> bool:
+    try:
+        with socket.create_connection((host, port), timeout=0.2):
+            return True
+    except OSError:
+        return False
+
+def _ts_seen_since(st, t) -> bool:
+    """Есть ли TS потока после момента t: по shim (основной порт) или tap (запасной порт tee)."""
+    last = st.shim.last_tx if st.shim else (st.tap.last_rx if st.tap else None)
+    return bool(last and last > t)
+
+def _rtmp_target(cfg):
+    """(host, port) RTMP, куда FFmpeg публикует копию, или None, если копии нет."""
+    t = ((cfg.get("ffmpeg", {}) or {}).get("tee", {}) or {})
+    med = cfg.get("mediamtx", {}) or {}
+    if _snapshot_mode(cfg) or not t.get("publish_rtmp_copy", med.get("publish_rtmp_copy", True)):
+        return None
+    u = urlparse(t.get("publish_rtmp_url") or med.get("publish_rtmp_url") or "")
+    return (u.hostname, u.port or 1935) if u.hostname else None
+
+def _startup_cfg(cfg) -> dict:
+    return {"ready_timeout_sec": 10.0, "handshake_timeout_sec": 5.0, **(cfg.get("startup", {}) or {})}
+
+def _stream_steps(st, mtx_on):
+    """
+    Шаги одного потока (имена — с суффиксом потока): ffmpeg и rist — параллельно (ristsender
+    поднимает сессии с пирами, не дожидаясь входа), first_packet — после обоих.
+    first_packet готов, когда ristsender отдаёт TS пиру: его статистика показала sent > 0,
+    либо хотя бы один пир на связи (handshake / RTT) и TS идёт на вход уже после его старта.
+    Его ready_s — ttfp_s потока: от начала запуска до первой доставки, а не до старта процессов.
+    """
+    sc = _startup_cfg(st.cfg)
+    tmo = float(sc["ready_timeout_sec"])
+    rtmp = _rtmp_target(st.cfg)
+    observable = bool(st.shim or st.tap)
+
+    def ffmpeg():
+        t = time.monotonic()
+        _start_ffmpeg(st)
+        with span("wait.first_ts", stream=st.sid):
+            return _wait_until(lambda: _ts_seen_since(st, t), tmo) if observable else True
+
+    def rist():
+        _start_rist(st)
+        p = st.procs["rist"][0] if st.procs["rist"] else None
+        if not p: return True
+        peers = (build_rist_cmd_single(st.cfg)[0] or []).count("-o")
+        with span("wait.handshake", name=p.name, peers=peers):
+            return _wait_until(lambda: rist_peers_ready(p) >= peers or p.poll() is not None,
+                               float(sc["handshake_timeout_sec"])) and p.poll() is None
+
+    def first_packet():
+        p = st.procs["rist"][0] if st.procs["rist"] else None
+        if not p: return False
+        def delivered():
+            if p.first_sent is not None:
+                return True
+            return rist_peers_ready(p) > 0 and (not observable or _ts_seen_since(st, p.started_at))
+        return _wait_until(lambda: delivered() or p.poll() is not None, tmo) and p.poll() is None
+
+    def snapshot():
+        _start_snapshot(st)
+        return True
+
+    return {
+        # FFmpeg ждёт MediaMTX, только если публикует в него RTMP-копию
+        st.name("ffmpeg"): (["mediamtx"] if (mtx_on and rtmp) else [], ffmpeg),
+        # слушатель снимков ни от кого не зависит: поднят раньше FFmpeg — поймает первый же ключевой кадр
+        st.name("snapshot"): ([], snapshot),
+        st.name("rist"): ([], rist),
+        st.name("first_packet"): ([st.name("ffmpeg"), st.name("rist")], first_packet),
+    }
+
+def _startup_steps(cfg, sts, start_mediamtx=True):
+    """{name: (deps, fn)}; fn запускает шаг и ждёт его готовности, возвращает ready: bool."""
+    tmo = float(_startup_cfg(cfg)["ready_timeout_sec"])
+    mtx_on = bool(cfg.get("mediamtx", {}).get("enable", True))
+    rtmps = {r for r in (_rtmp_target(st.cfg) for st in sts) if r}
+
+    def mediamtx():
+        if start_mediamtx:
+            _start_mediamtx(cfg)
+        if not mtx_on or not rtmps: return True
+        return all(_wait_until(lambda r=r: _tcp_open(*r), tmo, 0.05) for r in rtmps)
+
+    steps = {"mediamtx": ([], mediamtx)}
+    for st in sts:
+        steps.update(_stream_steps(st, mtx_on))
+    return steps
+
+def _run_startup(cfg, sts, start_mediamtx=True):
+    """
+    Запускает шаги графа по готовности зависимостей, независимые — параллельно
+    (потоки между собой не зависят, общий у них только MediaMTX).
+    Зависимость, не ставшая готовой за таймаут, не блокирует остальных (пишем в лог).
+    """
+    t0 = time.monotonic()
+    steps = _startup_steps(cfg, sts, start_mediamtx)
+    done = {n: threading.Event() for n in steps}
+    res = {}
+    ctx = getattr(_trace_ctx, "v", None)
+
+    def _run(name):
+        _trace_ctx.v = ctx
+        deps, fn = steps[name]
+        for d in deps:
+            done[d].wait()
+        started = time.monotonic()
+        with span("startup", step=name) as sp:
+            try:
+                ready = bool(fn())
+            except Exception as e:
+                logger.info(f"[STARTUP] {name}: failed: {e}")
+                ready = False
+            sp.set(ready=ready)
+        res[name] = {"start_s": round(started - t0, 3), "ready_s": round(time.monotonic() - t0, 3), "ready": ready}
+        if not ready:
+            logger.info(f"[STARTUP] {name}: not ready after {res[name]['ready_s']}s")
+        done[name].set()
+
+    threads = [threading.Thread(target=_run, args=(n,), daemon=True) for n in steps]
+    for t in threads: t.start()
+    for t in threads: t.join()
+
+    now = round(time.time(), 3)
+    ttfps = []
+    for st in sts:
+        fp = res.get(st.name("first_packet"), {})
+        st.startup = {"at": now, "ttfp_s": fp["ready_s"] if fp.get("ready") else None}
+        ttfps.append(st.startup["ttfp_s"])
+    # общий ttfp — до первого пакета последнего из потоков
+    ttfp = max(ttfps) if ttfps and None not in ttfps else None
+    if start_mediamtx:
+        startup_stats.clear()
+        startup_stats.update({"at": now, "ttfp_s": ttfp, "steps": res})
+    logger.info(f"[STARTUP] {', '.join(st.sid for st in sts)}: cold start to first packet: {ttfp}s; " +
+                ", ".join(f"{n} ready@{r['ready_s']}s" for n, r in res.items() if r["ready"]))
+
+# -----------------------------
+# JOBS (управляющие действия в фоне, по одному за раз)
+# -----------------------------
+jobs = OrderedDict()  # id -> job; храним последние JOBS_KEEP
+JOBS_KEEP = 50
+_job_q = queue.Queue()
+_job_seq = 0
+_job_lk = threading.Lock()
+
+def submit_job(kind, fn):
+    """
+    Ставит действие в очередь фонового воркера и сразу возвращает job.
+    Ещё не начатая задача того же вида переиспользуется: она всё равно прочитает
+    конфиг на момент запуска, второй рестарт подряд ничего не добавит.
+    """
+    global _job_seq
+    with _job_lk:
+        for job in jobs.values():
+            if job["kind"] == kind and job["state"] == "queued":
+                job["coalesced"] += 1
+                return job
+        _job_seq += 1
+        job = {
+            "id": f"{int(time.time()):x}-{_job_seq}", "kind": kind, "state": "queued",
+            "created": round(time.time(), 3), "started": None, "finished": None,
+            "duration_s": None, "result": None, "error": None, "coalesced": 0,
+        }
+        jobs[job["id"]] = job
+        while len(jobs) > JOBS_KEEP:
+            jobs.popitem(last=False)
+    _job_q.put((job, fn))
+    return job
+
+def job_worker():
+    while True:
+        job, fn = _job_q.get()
+        job["state"] = "running"
+        job["started"] = round(time.time(), 3)
+        t0 = time.monotonic()
+        _trace_ctx.v = f"job {job['id']}"
+        try:
+            with span(f"job.{job['kind']}", id=job["id"], queued_ms=round(1000 * (job["started"] - job["created"]), 1)):
+                job["result"] = fn() or "ok"
+            job["state"] = "done"
+        except Exception as e:
+            job["error"] = f"{e.__class__.__name__}: {e}"
+            job["state"] = "failed"
+            logger.info(f"[JOB] {job['kind']} {job['id']} failed: {job['error']}")
+        _trace_ctx.v = None
+        job["duration_s"] = round(time.monotonic() - t0, 3)
+        job["finished"] = round(time.time(), 3)
+        logger.info(f"[JOB] {job['kind']} {job['id']}: {job['state']} in {job['duration_s']}s")
+
+def apply_cfg():
+    """
+    Применение сохранённого конфига: перезапускаются только процессы, чья командная
+    строка (или uid/gid, scheduling) изменилась; новые потоки запускаются, удалённые — гасятся;
+    остальное подхватывается из current_cfg на лету.
+    """
+    global current_cfg
+    with lock:
+        cfg = read_cfg()
+        current_cfg = cfg
+        trace_configure(cfg)
+        ensure_encoder_probe(cfg)
+        added, removed = sync_streams(cfg)
+        changed = []
+        want, have = _mediamtx_specs(cfg)
+        if want != have:
+            changed.append("mediamtx")
+            _start_mediamtx(cfg)
+        for st in list(streams.values()):
+            if st in added:
+                continue
+            want, have = desired_specs(st), running_specs(st)
+            kinds = [k for k in ("ffmpeg", "rist", "snapshot") if want[k] != have[k]]
+            if "mediamtx" in changed and "ffmpeg" not in kinds and _rtmp_target(st.cfg):
+                kinds.insert(0, "ffmpeg")  # RTMP-копия FFmpeg оборвётся вместе с MediaMTX
+            for k in kinds:
+                if k == "rist":
+                    restart_rist(st)  # в режиме make_before_break — без разрыва
+                elif k == "snapshot":
+                    _start_snapshot(st)
+                else:
+                    _start_ffmpeg(st)
+            changed += [st.name(k) for k in kinds]
+        if added:
+            _run_startup(cfg, added, start_mediamtx=False)
+        out = []
+        if changed:
+            out.append("restarted: " + ", ".join(changed))
+        if added:
+            out.append("started streams: " + ", ".join(st.sid for st in added))
+        if removed:
+            out.append("stopped streams: " + ", ".join(removed))
+        if not out:
+            logger.info("[APPLY] config saved, command lines unchanged: no restart needed")
+            return "no restart needed"
+        logger.info(f"[APPLY] {'; '.join(out)}")
+        return "; ".join(out)
+
+def _job_response(job):
+    """202 + JSON для API-клиентов, редирект на UI с номером задачи для браузера."""
+    if request.accept_mimetypes.best == "application/json" or request.args.get("format") == "json":
+        return jsonify(job), HTTPStatus.ACCEPTED
+    return redirect(url_for("index", job=job["id"]))
 
 # -----------------------------
 # HTTP UI
@@ -321,41 +2857,71 @@ def index():
     cfg = yaml.safe_load(cfg_text) if cfg_text else {}
 
     hls_url = resolve_preview_url(cfg, request.host)
+    job = jobs.get(request.args.get("job", ""))
+    job_banner = ""
+    if job:
+        job_banner = (f'<p class="pill" id="jobBanner" data-job="{job["id"]}">Задача {job["kind"]} {job["id"]}: '
+                      f'<b>{job["state"]}</b>{" — " + str(job["result"] or job["error"] or "") if job["finished"] else ""}</p>')
     mode = ((cfg.get("ingest") or {}).get("source") or (cfg.get("input") or {}).get("mode") or "").strip()
     stream_name = ((cfg.get("stream") or {}).get("name") or "obs").strip()
 
-    senders = cfg.get("rist", {}).get("senders", []) or []
-    rows = ""
-    running = ("running" if (procs["rist"] and procs["rist"][0] and procs["rist"][0].poll() is None) else "stopped")
-    for i, s in enumerate(senders):
-        enabled = bool(s.get("enabled", True))
-        weight = int(s.get("weight", 5))
-        virt_ip = s.get("virt_ip", f"10.255.0.{i+1}")
-        virt_pt = int(s.get("virt_port", 8000))
-        btn_label = "Выключить" if enabled else "Включить"
-        rows += f"""
-        <tr>
-          <td>{i}</td>
-          <td>{s.get('cname', f"m{i}")}</td>
-          <td>{virt_ip}:{virt_pt}</td>
-          <td>{'on' if enabled else 'off'}</td>
-          <td>{running if enabled else '—'}</td>
-          <td>
-            <form method="POST" action="/toggle" style="display:inline">
-              <input type="hidden" name="sender" value="{i}">
-              <input type="hidden" name="action" value="{'disable' if enabled else 'enable'}">
-              <button type="submit">{btn_label}</button>
-            </form>
-          </td>
-          <td>
-            <form method="POST" action="/set_weight" style="display:inline">
-              <input type="hidden" name="sender" value="{i}">
-              <input type="number" min="0" max="1000" name="weight" value="{weight}">
-              <button type="submit">Применить</button>
-            </form>
-          </td>
-        </tr>
-        """
+    scfgs = stream_cfgs(cfg)[0]
+    multi = len(scfgs) > 1
+    # превью: JPEG-снимки тех потоков, где preview.mode: snapshot; иначе HLS из MediaMTX
+    snaps = [(sid, _preview_cfg(d["cfg"])) for sid, d in scfgs.items() if _snapshot_mode(d["cfg"])]
+    if snaps:
+        hls_url = "/preview.jpg"
+        player = "".join(
+            f'<figure style="margin:0 0 8px 0">{f"<figcaption>{sid}</figcaption>" if multi else ""}'
+            f'<img class="snap" alt="нет снимка" data-src="/preview.jpg?stream={sid}" '
+            f'data-ms="{int(1000 / max(0.01, float(pc["fps"])))}"></figure>'
+            for sid, pc in snaps)
+    else:
+        player = '<video id="previewVideo" controls autoplay playsinline muted></video>'
+    rows, log_links = "", ""
+    for sid, d in scfgs.items():
+        strm = streams.get(sid)
+        rp = _managed("rist", strm) if strm else None
+        running = "running" if (rp and rp.poll() is None) else "stopped"
+        sfx = "" if sid == MAIN_STREAM else f"-{sid}"
+        log_links += f'<li><a href="/logs/ffmpeg{sfx}">ffmpeg{sfx}.log</a></li><li><a href="/logs/rist{sfx}">ristsender{sfx}.log</a></li>'
+        if _snapshot_mode(d["cfg"]):
+            log_links += f'<li><a href="/logs/snapshot{sfx}">snapshot{sfx}.log</a></li>'
+        senders = (d["cfg"].get("rist", {}) or {}).get("senders", []) or []
+        for i, s in enumerate(senders):
+            enabled = bool(s.get("enabled", True))
+            weight = int(s.get("weight", 5))
+            virt_ip = s.get("virt_ip", f"10.255.0.{i+1}")
+            virt_pt = int(s.get("virt_port", 8000))
+            btn_label = "Выключить" if enabled else "Включить"
+            st = path_stats_view(s.get('cname', f"m{i}")) if enabled else None
+            metrics = f"{st['rate_kbps']:.0f} kbps · loss {st['loss_pct']:.1f}% · rtt {st['rtt_ms']:.0f} ms" if st else "—"
+            rows += f"""
+            <tr>
+              {f'<td>{sid}</td>' if multi else ''}<td>{i}</td>
+              <td>{s.get('cname', f"m{i}")}</td>
+              <td>{virt_ip}:{virt_pt}</td>
+              <td>{'on' if enabled else 'off'}</td>
+              <td>{('quarantined' if s.get('cname', f"m{i}") in quarantine else running) if enabled else '—'}</td>
+              <td>{metrics}</td>
+              <td>
+                <form method="POST" action="/toggle" style="display:inline">
+                  <input type="hidden" name="stream" value="{sid}">
+                  <input type="hidden" name="sender" value="{i}">
+                  <input type="hidden" name="action" value="{'disable' if enabled else 'enable'}">
+                  <button type="submit">{btn_label}</button>
+                </form>
+              </td>
+              <td>
+                <form method="POST" action="/set_weight" style="display:inline">
+                  <input type="hidden" name="stream" value="{sid}">
+                  <input type="hidden" name="sender" value="{i}">
+                  <input type="number" min="0" max="1000" name="weight" value="{weight}">
+                  <button type="submit">Применить</button>
+                </form>
+              </td>
+            </tr>
+            """
     html = f"""
     <html><head><meta charset="utf-8"><title>RIST Bonding</title>
     <style>
@@ -369,9 +2935,9 @@ def index():
       .hint {{ color:#666; font-size:0.9em; }}
       .pill {{ display:inline-block; padding:4px 10px; border-radius:999px; background:#efefef; margin-right:8px; }}
       .player {{ max-width:1100px; margin:0 auto 16px; padding:12px 16px; background:#0f0f10; color:#eaeaea; border-radius:12px; }}
-      .player video {{ width:100%; max-height:70vh; background:#000; border-radius:12px; }}
+      .player video, .player img {{ width:100%; max-height:70vh; background:#000; border-radius:12px; }}
     </style>
-    <script src="https://cdn.jsdelivr.net/npm/hls.js@1"></script>
+    {'' if snaps else '<script src="https://cdn.jsdelivr.net/npm/hls.js@1"></script>'}
     </head><body>
 
     <section class="player"> 
@@ -381,21 +2947,21 @@ def index():
         <span class="pill">Поток: {stream_name}</span>
         <span style="opacity:.9;word-break:break-all">URL: {hls_url}</span>
       </div>
-      <video id="previewVideo" controls autoplay playsinline muted></video>
+      {player}
     </section>
 
+    {job_banner}
     <h2>Processes</h2>
     <ul>
       <li><a href="/logs/entrypoint">entrypoint.log</a></li>
-      <li><a href="/logs/ffmpeg">ffmpeg.log</a></li>
-      <li><a href="/logs/rist">ristsender.log</a></li>
+      {log_links}
       <li><a href="/logs/mediamtx">mediamtx.log</a></li>
     </ul>
 
-    <h2>RIST paths (один процесс ristsender)</h2>
+    <h2>RIST paths (один процесс ristsender на поток)</h2>
     <table>
       <thead><tr>
-        <th>#</th><th>CNAME</th><th>Virt dst</th><th>Enabled</th><th>Status</th><th>Toggle</th><th>Weight</th>
+        {'<th>Stream</th>' if multi else ''}<th>#</th><th>CNAME</th><th>Virt dst</th><th>Enabled</th><th>Status</th><th>Metrics</th><th>Toggle</th><th>Weight</th>
       </tr></thead>
       <tbody>
         {rows}
@@ -406,15 +2972,42 @@ def index():
     <form method="POST" action="/save">
       <textarea name="cfg">{cfg_text}</textarea>
       <div class="row">
-        <button type="submit">Сохранить и перезапустить всё</button>
+        <button type="submit">Сохранить и применить</button>
         <a href="/status">Статус (JSON)</a>
       </div>
     </form>
     <p class="hint">Файл: {CONFIG_PATH}</p>
 
     <script>
+    (function(){{
+      var b = document.getElementById('jobBanner');
+      if (!b) return;
+      var t = setInterval(function(){{
+        fetch('/jobs/' + b.dataset.job).then(function(r){{ return r.json(); }}).then(function(j){{
+          var tail = j.finished ? ' — ' + (j.result || j.error || '') : '';
+          b.innerHTML = 'Задача ' + j.kind + ' ' + j.id + ': <b>' + j.state + '</b>' + tail;
+          if (j.finished) clearInterval(t);
+        }}).catch(function(){{}});
+      }}, 1000);
+    }})();
+    document.querySelectorAll('img.snap').forEach(function(img){{
+      // no-cache: каждый раз перепроверка по ETag — пока кадр не сменился, сервер отвечает 304
+      var etag = null;
+      (function tick(){{
+        fetch(img.dataset.src, {{cache: 'no-cache'}}).then(function(r){{
+          if (!r.ok || r.headers.get('ETag') === etag) return;
+          etag = r.headers.get('ETag');
+          return r.blob().then(function(b){{
+            var old = img.src;
+            img.src = URL.createObjectURL(b);
+            if (old) URL.revokeObjectURL(old);
+          }});
+        }}).catch(function(){{}}).then(function(){{ setTimeout(tick, +img.dataset.ms); }});
+      }})();
+    }});
     (function(){{
       var video = document.getElementById('previewVideo');
+      if (!video) return;
       var src = {hls_url!r};
       if (window.Hls && Hls.isSupported()) {{
         var hls = new Hls();
@@ -441,36 +3034,236 @@ def save():
         _ = yaml.safe_load(text)
     except Exception as e:
         return Response(f"YAML error: {e}", status=HTTPStatus.BAD_REQUEST)
-    os.makedirs(os.path.dirname(CONFIG_PATH), exist_ok=True)
-    with open(CONFIG_PATH, "w", encoding="utf-8") as f:
-        f.write(text)
-    stop_all()
-    start_all()
-    return redirect(url_for("index"))
+    with cfg_lock:
+        write_cfg(text)
+    return _job_response(submit_job("apply_cfg", apply_cfg))
+
+@app.before_request
+def _trace_request():
+    # управляющие действия (не GET-опрос) — отдельным спаном, вложенные спаны несут его ctx
+    _trace_ctx.v = f"{request.method} {request.path}"
+    if request.method != "GET":
+        g.trace_span = span("http", method=request.method, path=request.path).__enter__()
+
+@app.teardown_request
+def _trace_request_end(exc):
+    sp = g.pop("trace_span", None)
+    if sp is not None:
+        sp.__exit__(type(exc) if exc else None, exc, None)
+    _trace_ctx.v = None
+
+def _chrome_trace(spans):
+    """Формат Trace Event (chrome://tracing, ui.perfetto.dev): X — спаны, i — события, M — имена потоков."""
+    pid, tids, ev = os.getpid(), {}, []
+    for name, t0, dur, thr, ctx, args in spans:
+        e = {"name": name, "cat": name.split(".")[0], "ts": t0 / 1000, "pid": pid,
+             "tid": tids.setdefault(thr, len(tids) + 1), "args": {**args, "ctx": ctx} if ctx else args}
+        e.update({"ph": "i", "s": "t"} if dur is None else {"ph": "X", "dur": dur / 1000})
+        ev.append(e)
+    ev += [{"name": "thread_name", "ph": "M", "pid": pid, "tid": t, "args": {"name": n}} for n, t in tids.items()]
+    return {"traceEvents": ev, "displayTimeUnit": "ms"}
+
+@app.route("/debug/timeline", methods=["GET", "POST"])
+def debug_timeline():
+    """
+    GET ?since=300 (сек назад) &ctx=job (подстрока) &format=json|chrome — спаны из буфера;
+    json — списком и сводкой по именам (count / total / max), chrome — файл для trace viewer.
+    POST enable=1|0 (до следующего применения конфига), clear=1.
+    """
+    if request.method == "POST":
+        if request.form.get("enable") is not None:
+            _trace["on"] = request.form.get("enable") not in ("0", "false", "")
+        if request.form.get("clear"):
+            _trace["buf"].clear()
+        return jsonify({"enabled": _trace["on"], "spans": len(_trace["buf"])})
+    try: since = float(request.args.get("since", "0"))
+    except ValueError: since = 0
+    ctx = request.args.get("ctx")
+    t_min = time.time_ns() - int(since * 1e9) if since > 0 else 0
+    spans = [s for s in list(_trace["buf"]) if s[1] >= t_min and (not ctx or ctx in (s[4] or ""))]
+    if request.args.get("format") == "chrome":
+        resp = jsonify(_chrome_trace(spans))
+        resp.headers["Content-Disposition"] = f'attachment; filename="timeline-{time.strftime("%Y%m%d-%H%M%S")}.json"'
+        return resp
+    summary = {}
+    for name, _, dur, _, _, _ in spans:
+        if dur is None: continue
+        d = summary.setdefault(name, {"count": 0, "total_ms": 0.0, "max_ms": 0.0})
+        d["count"] += 1
+        d["total_ms"] += dur / 1e6
+        d["max_ms"] = max(d["max_ms"], dur / 1e6)
+    for d in summary.values():
+        d["total_ms"], d["max_ms"] = round(d["total_ms"], 3), round(d["max_ms"], 3)
+    return jsonify({
+        "enabled": _trace["on"], "capacity": _trace["buf"].maxlen,
+        "summary": dict(sorted(summary.items(), key=lambda kv: -kv[1]["total_ms"])),
+        "spans": [{"name": n, "at": round(t0 / 1e9, 6), "dur_ms": None if dur is None else round(dur / 1e6, 3),
+                   "thread": thr, "ctx": c, "args": a} for n, t0, dur, thr, c, a in spans],
+    })
+
+@app.route("/restart", methods=["POST"])
+def restart():
+    """Полный перезапуск всех потоков и MediaMTX (фоновой задачей)."""
+    return _job_response(submit_job("restart", restart_all))
+
+@app.route("/jobs", methods=["GET"])
+def jobs_list():
+    return jsonify(list(jobs.values()))
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+def job_status(job_id):
+    job = jobs.get(job_id)
+    if not job: return Response("not found", status=404)
+    return jsonify(job)
+
+def _alive(p) -> bool:
+    return bool(p and p.poll() is None)
 
 @app.route("/status", methods=["GET"])
 def status():
-    with lock:
-        cfg = read_cfg()
-        senders = cfg.get("rist", {}).get("senders", []) or []
-        running = ("running" if (procs["rist"] and procs["rist"][0] and procs["rist"][0].poll() is None) else "stopped")
-        items = []
-        for i, s in enumerate(senders):
+    # без lock и без чтения файла: применённый конфиг (current_cfg заменяется целиком) и ссылки
+    # на процессы — ни рестарт в фоне, ни запись config.yml не блокируют и не ломают наблюдение
+    scfgs = stream_cfgs(current_cfg)[0]
+    items, per_stream = [], {}
+    for sid, d in scfgs.items():
+        strm = streams.get(sid)
+        ff, rp = (_managed("ffmpeg", strm), _managed("rist", strm)) if strm else (None, None)
+        running = "running" if _alive(rp) else "stopped"
+        per_stream[sid] = {
+            "ffmpeg": "running" if _alive(ff) else "stopped",
+            "rist_proc": running,
+            "cpu_pct": strm.cpu_pct if strm else None,
+            "cpu_budget": d["cpu_budget"],
+            "tap_port": strm.tap.port if (strm and strm.tap) else None,
+            "tap_rate_bps": strm.tap_rate_bps if strm else None,
+            "snapshot": "running" if (strm and _alive(_managed("snapshot", strm))) else "stopped",
+            "recorder": strm.rec.status() if (strm and strm.rec) else None,
+            "startup": strm.startup if strm else {},
+        }
+        for i, s in enumerate((d["cfg"].get("rist", {}) or {}).get("senders", []) or []):
+            cname = s.get("cname", f"m{i}")
+            stats = path_stats_view(cname)
+            st = running if s.get("enabled", True) else "disabled"
+            if st == "running" and cname in quarantine:
+                st = "quarantined"
+            elif st == "running" and stats and stats["age_s"] > RIST_STATS_STALE_SEC:
+                st = "stale"  # процесс жив, но по этому пиру статистика не приходит
             items.append({
+                "stream": sid,
                 "id": i,
+                "cname": cname,
                 "enabled": bool(s.get("enabled", True)),
                 "weight": int(s.get("weight", 5)),
                 "virt_ip": s.get("virt_ip", f"10.255.0.{i+1}"),
                 "virt_port": int(s.get("virt_port", 8000)),
-                "status": running if s.get("enabled", True) else "disabled"
+                "bandwidth_kbps": path_bandwidth(d["cfg"], i, s),
+                "status": st,
+                "stats": stats,
             })
-        data = {
-            "mediamtx": ("running" if (procs.get("mediamtx") and procs["mediamtx"].poll() is None) else "stopped"),
-            "ffmpeg":  ("running" if (procs.get("ffmpeg") and procs["ffmpeg"].poll() is None) else "stopped"),
-            "rist_proc": running,
-            "paths": items
-        }
-        return jsonify(data)
+    first = next(iter(per_stream.values()), {})
+    data = {
+        "mediamtx": "running" if _alive(procs.get("mediamtx")) else "stopped",
+        # ffmpeg/rist_proc верхнего уровня — первого потока, как до появления streams
+        "ffmpeg": first.get("ffmpeg", "stopped"),
+        "rist_proc": first.get("rist_proc", "stopped"),
+        "streams": per_stream,
+        "paths": items,
+        "supervisor": supervisor_status(),
+        "quarantine": quarantine_status(),
+        "scheduling": sched_status(),
+        "preview": preview_status(),
+        "bw_probe": bw_probe_status(),
+        "startup": startup_stats,
+        "jobs": [j for j in list(jobs.values()) if j["state"] in ("queued", "running")],
+        "logs": {n: dict(c.stats) for n, c in list(child_logs.items())},
+    }
+    return jsonify(data)
+
+@app.route("/preview.jpg", methods=["GET"])
+def preview_jpg():
+    """
+    Последний снимок потока (?stream=sid, по умолчанию первый). ETag/Last-Modified + max-age
+    на период снимка: браузер перепроверяет раз в период и получает 304, пока кадр тот же.
+    """
+    sid = request.args.get("stream") or next(iter(streams), MAIN_STREAM)
+    strm = streams.get(sid)
+    if strm is None or not _snapshot_mode(strm.cfg):
+        return Response("snapshot preview is off for this stream", status=404)
+    try:
+        with open(snapshot_path(sid), "rb") as f:
+            st = os.fstat(f.fileno())
+            data = f.read()
+    except FileNotFoundError:
+        return Response("no snapshot yet", status=404)
+    period = 1.0 / max(0.01, float(_preview_cfg(strm.cfg)["fps"]))
+    resp = Response(data, mimetype="image/jpeg")
+    resp.set_etag(f"{st.st_mtime_ns:x}-{st.st_size:x}")
+    resp.last_modified = st.st_mtime
+    resp.cache_control.max_age = max(1, int(period))
+    resp.cache_control.private = True
+    resp.headers["X-Snapshot-Age"] = f"{max(0.0, time.time() - st.st_mtime):.1f}"
+    return resp.make_conditional(request)
+
+@app.route("/recorder/export", methods=["GET"])
+def recorder_export():
+    """
+    Отрезок из кольца как есть (TS, без перекодирования): ?stream=sid&from=-120&to=-60.
+    from/to — секунды назад (0 — сейчас), unix-время или ISO; начало — ближайший ключевой кадр не позже from.
+    """
+    sid = request.args.get("stream") or next(iter(streams), MAIN_STREAM)
+    strm = streams.get(sid)
+    if strm is None or not _rec_port(strm.cfg):
+        return Response("recorder is off for this stream", status=404)
+    now = time.time_ns()
+    try:
+        t_from = _ring_time(request.args.get("from"), now, -60)
+        t_to = _ring_time(request.args.get("to"), now, 0)
+        ring = TsRing(ring_base(strm.cfg, sid))
+    except (OSError, ValueError) as e:
+        return Response(f"bad request: {e}", status=400)
+    rng = ring.clip(t_from, t_to)
+    if not rng:
+        ring.close()
+        return Response("no keyframe recorded before 'to'", status=404)
+    start, end, t0 = rng
+    def gen():
+        try:
+            yield from ring.read(start, end)
+        finally:
+            ring.close()
+    resp = Response(gen(), mimetype="video/mp2t")
+    resp.headers["Content-Length"] = str(end - start)
+    resp.headers["Content-Disposition"] = f'attachment; filename="{sid}-{time.strftime("%Y%m%d-%H%M%S", time.localtime(t0 / 1e9))}.ts"'
+    resp.headers["X-Clip-Start"] = f"{t0 / 1e9:.3f}"
+    return resp
+
+@app.route("/metrics/history", methods=["GET"])
+def metrics_history():
+    """
+    ?key=path.m2.rtt_ms (можно несколько key, либо prefix=path.m2) &window=300 (сек).
+    Разрешение выбирается по окну: 1 с до 10 мин, 10 с до 2 ч, 1 мин до 24 ч.
+    """
+    try: window = max(1, min(86400, int(request.args.get("window", "600"))))
+    except Exception: window = 600
+    keys = request.args.getlist("key")
+    prefix = request.args.get("prefix")
+    if prefix:
+        keys += [k for k in history.keys() if k.startswith(prefix)]
+    if not keys:
+        return jsonify({"keys": history.keys()})
+    series = {}
+    step = None
+    for k in keys:
+        step, pts = history.query(k, window)
+        series[k] = pts
+    return jsonify({"window": window, "step": step, "fields": ["ts", "mean", "max"], "series": series})
+
+def _ui_senders(cfg, sid):
+    """Список senders, который правит UI: собственный у потока sid, если он его задаёт, иначе общий."""
+    for i, sd in enumerate(cfg.get("streams") or []):
+        if sid and str(sd.get("id") or f"s{i}") == sid and ((sd.get("rist") or {}).get("senders") is not None):
+            return sd["rist"]["senders"]
+    return cfg.get("rist", {}).get("senders", []) or []
 
 @app.route("/toggle", methods=["POST"])
 def toggle_sender():
@@ -480,19 +3273,18 @@ def toggle_sender():
     except Exception:
         return Response("bad params", status=400)
 
-    cfg = read_cfg()
-    senders = cfg.get("rist", {}).get("senders", []) or []
-    if idx < 0 or idx >= len(senders): return Response("bad index", status=400)
+    with cfg_lock:
+        cfg = read_cfg()
+        senders = _ui_senders(cfg, request.form.get("stream"))
+        if idx < 0 or idx >= len(senders): return Response("bad index", status=400)
 
-    cur = bool(senders[idx].get("enabled", True))
-    newval = (not cur) if action == "toggle" else (action == "enable")
-    senders[idx]["enabled"] = newval
-    with open(CONFIG_PATH, "w", encoding="utf-8") as f:
-        yaml.safe_dump(cfg, f, allow_unicode=True, sort_keys=False)
+        cur = bool(senders[idx].get("enabled", True))
+        newval = (not cur) if action == "toggle" else (action == "enable")
+        senders[idx]["enabled"] = newval
+        write_cfg(cfg)
 
-    # Пересобираем весь ristsender
-    stop_all(); start_all()
-    return redirect(url_for("index"))
+    # Пересобираем весь ristsender (в режиме make_before_break — без разрыва) — в фоне
+    return _job_response(submit_job("reload_rist", reload_rist))
 
 @app.route("/set_weight", methods=["POST"])
 def set_weight():
@@ -504,17 +3296,15 @@ def set_weight():
     if weight < 0 or weight > 1000:
         return Response("weight out of range (0..1000)", status=400)
 
-    cfg = read_cfg()
-    senders = cfg.get("rist", {}).get("senders", []) or []
-    if idx < 0 or idx >= len(senders): return Response("bad index", status=400)
-    senders[idx]["weight"] = weight
-
-    with open(CONFIG_PATH, "w", encoding="utf-8") as f:
-        yaml.safe_dump(cfg, f, allow_unicode=True, sort_keys=False)
+    with cfg_lock:
+        cfg = read_cfg()
+        senders = _ui_senders(cfg, request.form.get("stream"))
+        if idx < 0 or idx >= len(senders): return Response("bad index", status=400)
+        senders[idx]["weight"] = weight
+        write_cfg(cfg)
 
-    # Пересобираем весь ristsender
-    stop_all(); start_all()
-    return redirect(url_for("index"))
+    # Пересобираем весь ristsender (в режиме make_before_break — без разрыва) — в фоне
+    return _job_response(submit_job("reload_rist", reload_rist))
 
 @app.route("/logs/<name>", methods=["GET"])
 def logs(name):
@@ -523,6 +3313,8 @@ def logs(name):
     try: n = max(1, min(10000, int(n)))
     except Exception: n = 200
     path = f"/data/logs/{safe}.log"
+    if safe in child_logs:
+        child_logs[safe].flush()  # отдать и то, что ещё в буфере
     if not os.path.exists(path): return Response("not found", status=404)
     try:
         with open(path, "rb") as f:
@@ -542,15 +3334,60 @@ def sigterm(_sig, _frm):
     sys.exit(0)
 
 def main():
+    if sys.argv[1:2] == ["bw-probe-run"]:
+        # внутренний: один путь, вызывается из _probe_path (в отдельном процессе, с uid пути)
+        print(json.dumps(bw_probe_run(json.loads(sys.argv[2]))))
+        return
+    if sys.argv[1:2] == ["probe-paths"]:
+        # ручной прогон: python3 entrypoint.py probe-paths [--force]
+        _load_bw_cache()
+        print(json.dumps(probe_paths(read_cfg(), force="--force" in sys.argv[2:]), ensure_ascii=False, indent=2))
+        return
+    if sys.argv[1:2] == ["ring-export"]:
+        # python3 entrypoint.py ring-export [--stream main] [--from -60] [--to 0] [--out clip.ts] (без --out — в stdout)
+        opts = dict(zip(sys.argv[2::2], sys.argv[3::2]))
+        sid = opts.get("--stream", MAIN_STREAM)
+        scfg = stream_cfgs(read_cfg())[0][sid]["cfg"]
+        now = time.time_ns()
+        ring = TsRing(ring_base(scfg, sid))
+        rng = ring.clip(_ring_time(opts.get("--from"), now, -60), _ring_time(opts.get("--to"), now, 0))
+        if not rng:
+            sys.exit("no keyframe recorded before --to")
+        with (open(opts["--out"], "wb") if "--out" in opts else os.fdopen(sys.stdout.fileno(), "wb", closefd=False)) as f:
+            for buf in ring.read(rng[0], rng[1]):
+                f.write(buf)
+        print(f"{rng[1] - rng[0]} bytes from {time.strftime('%H:%M:%S', time.localtime(rng[2] / 1e9))}", file=sys.stderr)
+        return
+    if sys.argv[1:2] == ["probe-encoder"]:
+        # ручной прогон: python3 entrypoint.py probe-encoder [--force]
+        force = "--force" in sys.argv[2:]
+        res = {sid: probe_encoder(d["cfg"], force=force) for sid, d in stream_cfgs(read_cfg())[0].items()}
+        print(json.dumps(res[MAIN_STREAM] if list(res) == [MAIN_STREAM] else res, ensure_ascii=False, indent=2))
+        return
     signal.signal(signal.SIGTERM, sigterm)
     signal.signal(signal.SIGINT, sigterm)
+    cfg = read_cfg()
+    for d in stream_cfgs(cfg)[0].values():
+        if str(_video_cfg(d["cfg"])[2].get("preset")) == "auto":
+            # первый запуск на этом железе/настройках — мерим до старта кодера, чтобы он не мешал замеру
+            probe_encoder(d["cfg"])
+    _load_preview_cost()
+    _load_bw_cache()
+    probe_paths(cfg)  # до старта ristsender: пути свободны; свежие (cache_ttl_sec) замеры не повторяем
+    apply_ui_sched(cfg)  # после пробы (мерить на всех ядрах), до старта потоков — они наследуют
     start_all()
+    threading.Thread(target=supervisor_loop, daemon=True).start()
+    threading.Thread(target=quarantine_loop, daemon=True).start()
+    threading.Thread(target=bw_probe_loop, daemon=True).start()
+    threading.Thread(target=metrics_loop, daemon=True).start()
+    threading.Thread(target=job_worker, daemon=True).start()
+    threading.Thread(target=log_flusher, daemon=True).start()
     host_port = str(read_cfg().get("ui", {}).get("listen", f"0.0.0.0:{WEB_PORT}"))
     if ":" in host_port:
         host, port = host_port.split(":", 1)
     else:
         host, port = "0.0.0.0", host_port
-    app.run(host=host, port=int(port), debug=False, use_reloader=False)
+    app.run(host=host, port=int(port), debug=False, use_reloader=False, threaded=True)
 
 if __name__ == "__main__":
     main()
@@ -32,6 +32,31 @@ apply_one() {
   sysctl -w "net.ipv4.conf.${IF}.rp_filter=0" >/dev/null || true
 }
 
+# ---- batch-режим: diff с живым состоянием и один ip -batch / iptables-restore ----
+if [ "${1:-}" = "--batch" ]; then
+  . "$(dirname "$(readlink -f "$0")")/rist_batch.sh"
+  rb_begin
+  ip route show default | grep -q "via $MAIN_GW dev $MAIN_DEV .*metric $MAIN_METRIC" \
+    || echo "route replace default via $MAIN_GW dev $MAIN_DEV src $MAIN_IP metric $MAIN_METRIC" >>"$RB_ADD"
+  rb_rules '^10[1-4]0 |fwmark 0x10[1-4] ' \
+    "$P1_PRIO fwmark $P1_M lookup $P1_T" "$P2_PRIO fwmark $P2_M lookup $P2_T" \
+    "$P3_PRIO fwmark $P3_M lookup $P3_T" "$P4_PRIO fwmark $P4_M lookup $P4_T"
+  rb_routes "$P1_T" "default via $P1_GW dev $P1_IF src $P1_IP"
+  rb_routes "$P2_T" "default via $P2_GW dev $P2_IF src $P2_IP"
+  rb_routes "$P3_T" "default via $P3_GW dev $P3_IF src $P3_IP"
+  rb_routes "$P4_T" "default via $P4_GW dev $P4_IF src $P4_IP"
+  rb_chain mangle RIST_MARK_OUT OUTPUT \
+    "-A RIST_MARK_OUT -m owner --uid-owner $(id -u "$P1_UID") -j MARK --set-xmark $P1_M/0xffffffff" \
+    "-A RIST_MARK_OUT -m owner --uid-owner $(id -u "$P2_UID") -j MARK --set-xmark $P2_M/0xffffffff" \
+    "-A RIST_MARK_OUT -m owner --uid-owner $(id -u "$P3_UID") -j MARK --set-xmark $P3_M/0xffffffff" \
+    "-A RIST_MARK_OUT -m owner --uid-owner $(id -u "$P4_UID") -j MARK --set-xmark $P4_M/0xffffffff"
+  for IF in "$P1_IF" "$P2_IF" "$P3_IF" "$P4_IF"; do
+    [ "$(sysctl -n "net.ipv4.conf.${IF}.rp_filter" 2>/dev/null)" = "0" ] || sysctl -w "net.ipv4.conf.${IF}.rp_filter=0" >/dev/null || true
+  done
+  rb_commit
+  exit 0
+fi
+
 # ---- main default (оставляем Wifi) ----
 ip route replace default via "$MAIN_GW" dev "$MAIN_DEV" src "$MAIN_IP" metric "$MAIN_METRIC"
 
@@ -1,6 +1,6 @@
 #!/usr/bin/env bash
 # NM dispatcher: $1 = interface, $2 = action
-# Срабатывает, когда поднимается любой modem* и есть IPv4 — запускаем политику.
+# Срабатывает, когда поднимается любой modem* и есть IPv4 — обновляем политику только этого модема.
 
 IFACE="$1"
 ACTION="$2"
@@ -24,27 +24,55 @@ case "$ACTION" in
     ;;
 esac
 
-# Ждём максимум 10 секунд появления IPv4 на интерфейсе
-for _ in {1..10}; do
-  if ip -4 addr show dev "$IFACE" | grep -q "inet "; then
-    break
+QDIR=/run/rist-policy.queue
+WAIT_SEC=10
+
+has_ipv4(){ ip -4 addr show dev "$IFACE" 2>/dev/null | grep -q "inet "; }
+
+# Ждём IPv4 по событию netlink (ip monitor), а не опросом раз в секунду:
+# монитор запускаем ДО проверки, чтобы не пропустить адрес между ними.
+wait_ipv4(){
+  local line deadline
+  coproc MON { exec ip -4 monitor address dev "$IFACE" 2>/dev/null; }
+  if ! has_ipv4; then
+    deadline=$((SECONDS + WAIT_SEC))
+    while [ $SECONDS -lt $deadline ] && IFS= read -r -t $((deadline - SECONDS)) -u "${MON[0]}" line; do
+      [[ "$line" == *"inet "* ]] && break
+    done
   fi
-  sleep 1
-done
+  kill "$MON_PID" 2>/dev/null; wait "$MON_PID" 2>/dev/null
+  has_ipv4
+}
 
 # Если IP так и не появился — выходим тихо
-ip -4 addr show dev "$IFACE" | grep -q "inet " || exit 0
-
-# Чтобы не запускать несколько копий одновременно — берём lock
-exec 9>/run/rist-policy.lock
-if ! flock -n 9; then
-  log "lock busy; another policy run in progress"
-  exit 0
-fi
+wait_ipv4 || exit 0
 
-log "Trigger policy due to $IFACE $ACTION"
-# Запускаем политику
-/usr/local/bin/rist_policy.sh && log "policy applied" || log "policy FAILED ($?)"
-EOF
+# Событие кладём в очередь (один файл на интерфейс: повторы схлопываются).
+# Кто держит lock — тот и разбирает очередь, поэтому занятый lock больше не теряет события.
+mkdir -p "$QDIR"
+: >"$QDIR/$IFACE"
+log "queued $IFACE $ACTION"
 
-sudo chmod +x /etc/NetworkManager/dispatcher.d/90-rist-policy.sh
+while :; do
+  exec 9>/run/rist-policy.lock
+  if ! flock -n 9; then
+    log "lock busy; $IFACE will be handled by the running refresh"
+    exit 0
+  fi
+  while next=$(ls -1 "$QDIR" 2>/dev/null | head -n1); [ -n "$next" ]; do
+    rm -f "$QDIR/$next"
+    log "refresh $next"
+    # только таблица/правило/mark этого модема; остальные пути не трогаем.
+    # IP4_GATEWAY (и DEVICE_IP_IFACE) от NM — только про $IFACE: чужому модему их не передаём,
+    # его шлюз rist_policy.sh возьмёт из живого `ip route show default dev`
+    if [ "$next" = "$IFACE" ]; then
+      /usr/local/bin/rist_policy.sh --only "$next"
+    else
+      env -u IP4_GATEWAY -u DEVICE_IP_IFACE /usr/local/bin/rist_policy.sh --only "$next"
+    fi && log "$next applied" || log "$next FAILED ($?)"
+  done
+  flock -u 9
+  exec 9>&-
+  # событие могло прийти между последней проверкой очереди и снятием lock
+  [ -z "$(ls -A "$QDIR" 2>/dev/null)" ] && break
+done
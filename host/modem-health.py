@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Демон здоровья модемов (замена циклу modem-health.sh):
+- подписка на rtnetlink (link / IPv4 addr / IPv4 route) для modem* — падение линка
+  и пропажа адреса видны сразу, без опроса sysfs
+- пинги шлюза и WAN по всем модемам идут параллельно (раз в PROBE_INTERVAL_SEC
+  и сразу после события по интерфейсу)
+- /run/rist-modems/rist-modems.json пишется атомарно (tmp + fsync + rename) и только когда
+  состояние действительно изменилось; формат совместим с modem-health.sh,
+  плюс changed_at — когда поменялся status
+
+Зависимости: только stdlib, ping (CAP_NET_RAW).
+"""
+
+import json, logging, os, select, socket, struct, subprocess, threading, time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+# =========================
+# НАСТРОЙКИ ПОД СЕБЯ
+# =========================
+
+MODEMS: List[Tuple[str, str, str]] = [   # iface, ip, gw
+    ("modem1", "192.168.8.199", "192.168.8.1"),
+    ("modem2", "192.168.14.100", "192.168.14.1"),
+    ("modem3", "192.168.38.100", "192.168.38.1"),
+    ("modem4", "192.168.11.100", "192.168.11.1"),
+]
+DST = "1.1.1.1"                  # WAN-проверка
+OUT = "/run/rist-modems/rist-modems.json"  # каталог целиком монтируется в контейнер
+PROBE_INTERVAL_SEC = 2.0         # плановая проверка достижимости
+PING_TIMEOUT_SEC = 1
+LOG_LEVEL = "INFO"
+
+# =========================
+
+# rtnetlink
+RTMGRP_LINK, RTMGRP_IPV4_IFADDR, RTMGRP_IPV4_ROUTE = 0x1, 0x10, 0x40
+RTM_NEWLINK, RTM_DELLINK, RTM_NEWADDR, RTM_DELADDR, RTM_NEWROUTE, RTM_DELROUTE = 16, 17, 20, 21, 24, 25
+NLMSG_HDR = struct.Struct("=LHHLL")      # len, type, flags, seq, pid
+IFINFOMSG = struct.Struct("=BxHiII")     # family, type, index, flags, change
+IFADDRMSG = struct.Struct("=BBBBI")      # family, prefixlen, flags, scope, index
+RTMSG_LEN = 12
+IFLA_IFNAME, IFLA_OPERSTATE = 3, 16
+RTA_OIF = 4
+OPERSTATES = {0: "unknown", 1: "notpresent", 2: "down", 3: "lowerlayerdown", 4: "testing", 5: "dormant", 6: "up"}
+
+logging.basicConfig(level=getattr(logging, LOG_LEVEL.upper(), logging.INFO),
+                    format="%(asctime)s %(levelname)s %(message)s")
+log = logging.getLogger("modem-health")
+
+
+def _attrs(buf: bytes, off: int):
+    """Итератор (type, payload) по rtattr начиная с off."""
+    while off + 4 <= len(buf):
+        alen, atype = struct.unpack_from("=HH", buf, off)
+        if alen < 4:
+            break
+        yield atype & 0x7fff, buf[off + 4:off + alen]
+        off += (alen + 3) & ~3
+
+
+def _ifname(index: int) -> Optional[str]:
+    try:
+        return socket.if_indextoname(index)
+    except OSError:
+        return None
+
+
+class Health:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.state: Dict[str, dict] = {}
+        self._last_json = None
+        for iface, ip, gw in MODEMS:
+            self.state[iface] = {
+                "iface": iface, "ip": ip, "gw": gw,
+                "oper": self._sysfs_oper(iface), "has_ip": "yes" if self._has_ipv4(iface) else "no",
+                "gw_ok": "no", "wan_ok": "no", "status": "down", "changed_at": time.time(),
+            }
+        self.pool = ThreadPoolExecutor(max_workers=2 * len(MODEMS))
+        self._probing = threading.Lock()   # плановые проверки не накладываются друг на друга
+
+    @staticmethod
+    def _sysfs_oper(iface: str) -> str:
+        try:
+            with open(f"/sys/class/net/{iface}/operstate") as f:
+                return f.read().strip() or "down"
+        except OSError:
+            return "down"
+
+    @staticmethod
+    def _has_ipv4(iface: str) -> bool:
+        try:
+            out = subprocess.run(["ip", "-4", "-o", "addr", "show", "dev", iface],
+                                 capture_output=True, text=True, timeout=2).stdout
+            return " inet " in out
+        except Exception:
+            return False
+
+    @staticmethod
+    def _ping(source: str, dst: str) -> bool:
+        try:
+            return subprocess.run(["ping", "-I", source, "-n", "-W", str(PING_TIMEOUT_SEC), "-c", "1", dst],
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                                  timeout=PING_TIMEOUT_SEC + 1).returncode == 0
+        except Exception:
+            return False
+
+    # --- состояние ---
+
+    def _recompute(self, st: dict) -> None:
+        status = "down"
+        if st["oper"] == "up" and st["has_ip"] == "yes" and st["gw_ok"] == "yes":
+            status = "up_internet" if st["wan_ok"] == "yes" else "up_local"
+        if status != st["status"]:
+            log.info("[%s] %s -> %s", st["iface"], st["status"], status)
+            st["status"] = status
+            st["changed_at"] = time.time()
+
+    def publish(self) -> None:
+        """Пишем файл только при изменении: tmp в том же каталоге + fsync + rename."""
+        with self.lock:
+            data = json.dumps([self.state[i] for i, _, _ in MODEMS], ensure_ascii=False)
+            if data == self._last_json:
+                return
+            tmp = f"{OUT}.tmp"
+            try:
+                with open(tmp, "w", encoding="utf-8") as f:
+                    f.write(data)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp, OUT)
+                self._last_json = data
+            except OSError as e:
+                log.warning("write %s: %s", OUT, e)
+
+    def set_link(self, iface: str, oper: Optional[str] = None, has_ip: Optional[bool] = None) -> None:
+        with self.lock:
+            st = self.state[iface]
+            if oper is not None:
+                st["oper"] = oper
+            if has_ip is not None:
+                st["has_ip"] = "yes" if has_ip else "no"
+            if st["oper"] != "up" or st["has_ip"] != "yes":
+                # линк/адрес пропал — пинги заведомо не пройдут, не ждём их таймаута
+                st["gw_ok"] = st["wan_ok"] = "no"
+            self._recompute(st)
+        self.publish()
+
+    def probe(self, iface: str) -> None:
+        with self.lock:
+            st = dict(self.state[iface])
+        if st["has_ip"] != "yes":
+            gw_ok = wan_ok = False
+        else:
+            # ВАЖНО: WAN с source = IP модема → пойдёт по его таблице (ip rule from ...)
+            f_gw = self.pool.submit(self._ping, iface, st["gw"])
+            f_wan = self.pool.submit(self._ping, st["ip"], DST)
+            gw_ok, wan_ok = f_gw.result(), f_wan.result()
+        with self.lock:
+            cur = self.state[iface]
+            cur["gw_ok"] = "yes" if gw_ok else "no"
+            cur["wan_ok"] = "yes" if wan_ok else "no"
+            self._recompute(cur)
+        self.publish()
+
+    def probe_all(self) -> None:
+        if not self._probing.acquire(blocking=False):
+            return
+        try:
+            ts = [threading.Thread(target=self.probe, args=(i,), daemon=True) for i, _, _ in MODEMS]
+            for t in ts: t.start()
+            for t in ts: t.join()
+        finally:
+            self._probing.release()
+
+    def probe_async(self, iface: str) -> None:
+        threading.Thread(target=self.probe, args=(iface,), daemon=True).start()
+
+
+def handle_netlink(h: Health, buf: bytes) -> None:
+    off = 0
+    while off + NLMSG_HDR.size <= len(buf):
+        mlen, mtype, _, _, _ = NLMSG_HDR.unpack_from(buf, off)
+        if mlen < NLMSG_HDR.size:
+            break
+        body = off + NLMSG_HDR.size
+        if mtype in (RTM_NEWLINK, RTM_DELLINK):
+            _, _, index, _, _ = IFINFOMSG.unpack_from(buf, body)
+            name, oper = _ifname(index), None
+            for atype, val in _attrs(buf[:off + mlen], body + IFINFOMSG.size):
+                if atype == IFLA_IFNAME:
+                    name = val.rstrip(b"\0").decode(errors="replace")
+                elif atype == IFLA_OPERSTATE:
+                    oper = OPERSTATES.get(val[0], "unknown")
+            if name in h.state:
+                if mtype == RTM_DELLINK:
+                    oper = "down"
+                h.set_link(name, oper=oper or h._sysfs_oper(name))
+                if oper == "up":
+                    h.probe_async(name)
+        elif mtype in (RTM_NEWADDR, RTM_DELADDR):
+            family, _, _, _, index = IFADDRMSG.unpack_from(buf, body)
+            name = _ifname(index)
+            if family == socket.AF_INET and name in h.state:
+                has_ip = True if mtype == RTM_NEWADDR else h._has_ipv4(name)
+                h.set_link(name, has_ip=has_ip)
+                if has_ip:
+                    h.probe_async(name)
+        elif mtype in (RTM_NEWROUTE, RTM_DELROUTE):
+            for atype, val in _attrs(buf[:off + mlen], body + RTMSG_LEN):
+                if atype == RTA_OIF and len(val) >= 4:
+                    name = _ifname(struct.unpack("=I", val[:4])[0])
+                    if name in h.state:
+                        h.probe_async(name)
+        off += (mlen + 3) & ~3
+
+
+def main() -> None:
+    os.makedirs(os.path.dirname(OUT), exist_ok=True)
+    nl = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, socket.NETLINK_ROUTE)
+    nl.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+    nl.bind((0, RTMGRP_LINK | RTMGRP_IPV4_IFADDR | RTMGRP_IPV4_ROUTE))
+
+    h = Health()
+    log.info("Start. Modems: %s", ", ".join(i for i, _, _ in MODEMS))
+    h.probe_all()
+    h.publish()
+
+    next_probe = time.monotonic() + PROBE_INTERVAL_SEC
+    while True:
+        timeout = max(0.0, next_probe - time.monotonic())
+        r, _, _ = select.select([nl], [], [], timeout)
+        if r:
+            try:
+                handle_netlink(h, nl.recv(1 << 16))
+            except OSError as e:
+                # ENOBUFS: переполнили буфер сокета — состояние пересчитаем плановой проверкой
+                log.warning("netlink recv: %s", e)
+                for iface in h.state:
+                    h.set_link(iface, oper=h._sysfs_oper(iface), has_ip=h._has_ipv4(iface))
+        if time.monotonic() >= next_probe:
+            threading.Thread(target=h.probe_all, daemon=True).start()
+            next_probe = time.monotonic() + PROBE_INTERVAL_SEC
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        log.info("Interrupted by user. Bye.")
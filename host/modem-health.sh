@@ -8,9 +8,9 @@ MODEMS=(
 )
 DST="1.1.1.1"   # можно список и рандомайзить: 1.1.1.1 / 8.8.8.8
 
-TMP="/run/rist-modems.tmp.json"
-OUT="/run/rist-modems.json"
-mkdir -p /run
+TMP="/run/rist-modems/rist-modems.tmp.json"
+OUT="/run/rist-modems/rist-modems.json"
+mkdir -p /run/rist-modems
 echo "[" > "$TMP"
 first=1
 for entry in "${MODEMS[@]}"; do
@@ -15,7 +15,7 @@ Huawei HiLink watcher (универсальный для WEBUI 17.x и 10.x):
 Зависимости: requests
 """
 
-import time, json, logging, traceback
+import os, time, json, logging, traceback
 from typing import Dict, Any, Optional, List, Tuple
 from xml.etree import ElementTree as ET
 
@@ -37,7 +37,7 @@ POLL_INTERVAL_SEC = 10                  # Период опроса
 AUTO_ENABLE_DATA = True                 # Автовключение мобильных данных, если dataswitch=0
 ENABLE_COOLDOWN_SEC = 20                # Пауза между попытками включения
 REQUEST_TIMEOUT = 4.0                   # Таймаут HTTP-запросов
-JSON_OUT = "/run/rist-modems-ui.json"   # Куда писать сводный JSON
+JSON_OUT = "/run/rist-modems/rist-modems-ui.json"   # Куда писать сводный JSON (каталог монтируется в контейнер)
 HEARTBEAT_EVERY = 1                     # Каждые N циклов печатать краткую сводку (0 = выкл)
 LOG_LEVEL = "INFO"                      # DEBUG/INFO/WARNING/ERROR
 LOG_FILE = None                         # Например "/var/log/modem-ui-watch.log" или None для stdout
@@ -290,6 +290,7 @@ class HuaweiHiLink:
 
 def main() -> None:
     log.info("Start. Modems: %s", ", ".join(f"{m['name']}@{m['gw']}" for m in MODEMS))
+    os.makedirs(os.path.dirname(JSON_OUT), exist_ok=True)
     clients: Dict[str, HuaweiHiLink] = {}
     last_enable_ts: Dict[str, float] = {}
     iter_no = 0
@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Общий формат релейного слоя udp_proxy.py (модем) <-> relay_rx.py (сервер).
+
+Без опций udp_proxy шлёт датаграммы ristsender как есть. С FEC каждая датаграмма
+получает заголовок с порядковым номером, и после групп идут XOR-паритеты:
+  - строка: L подряд идущих пакетов;
+  - столбец (2D): D пакетов с шагом L внутри блока L×D — чинит пачку потерь до L подряд.
+Одиночная потеря в группе восстанавливается сразу на приёме, без NACK и RTT.
+
+С --path-id (зеркалирование) снаружи ещё один заголовок: id пути-источника, id пути,
+которым датаграмма реально шла, id пути копии и номер — по нему relay_rx отбрасывает
+вторую копию и отдаёт пакет в сессию пути-источника, каким бы путём он ни пришёл.
+
+Пробы ёмкости пути (entrypoint.py, rist.bw_probe) — T_PROBE: relay_rx.py / udp_echo.py
+отвечают на каждую короткой квитанцией с тем же id/seq/t_ns, udp_proxy пропускает их
+мимо FEC, зеркала и pacer'а и возвращает квитанции отправителю пробы, а не ristsender.
+Пробы задержки (udp_proxy --probe-ms) — тот же T_PROBE с kind 2: в ответе (kind 3) ещё и
+момент приёма у ответчика, по нему udp_proxy делит RTT на задержки туда и обратно.
+Keepalive NAT (udp_proxy --keepalive) — kind 4: в ответе (kind 5) адрес:порт, с которого
+ответчик нас видит; сменился порт после паузы — привязка NAT за паузу истекла.
+
+Первый байт: RIST (GRE 0x00..0x3f у main/advanced, RTP 0x80.. у simple) с нашими
+0xfa..0xfe не пересекается, так что сырые и обёрнутые пакеты можно смешивать на одном порту.
+"""
+
+import socket, struct, time
+from collections import OrderedDict
+
+T_PROBE, T_MIRR, T_DATA, T_ROW, T_COL = 0xFA, 0xFB, 0xFC, 0xFD, 0xFE
+PROBE_HDR = struct.Struct("!BBIIQ")       # type, kind, id, seq, t_ns отправителя
+LAT_ACK = struct.Struct("!BBIIQQ")        # ... + t_ns приёма у ответчика (kind 3)
+KA_ACK = struct.Struct("!BBIIQ4sH")       # ... + IPv4 и порт отправителя после NAT (kind 5)
+P_BW, P_BW_ACK, P_LAT, P_LAT_ACK, P_KA, P_KA_ACK = 0, 1, 2, 3, 4, 5
+MIRR_HDR = struct.Struct("!BBBBI")        # type, path id, via (каким путём шёл), partner (0 — без копии), seq
+DATA_HDR = struct.Struct("!BI")           # type, seq
+PAR_HDR = struct.Struct("!BIBBBBH")       # type, base, L, D, idx, n, len_xor
+
+
+def parse_fec(spec):
+    """'10x5' -> (10, 5); '10' -> (10, 0) — только строки; '' / '0' -> None."""
+    if not spec or str(spec) == "0":
+        return None
+    cols, _, rows = str(spec).lower().partition("x")
+    L, D = int(cols), int(rows or 0)
+    if not (2 <= L <= 255 and (D == 0 or 2 <= D <= 255)):
+        raise ValueError(f"bad FEC geometry {spec!r}: need LxD with 2 <= L, D <= 255")
+    return L, D
+
+
+def probe_ack(pkt, peer=None):
+    """Квитанция на пробу (без полезной нагрузки — обратный канал не грузим) или None; peer — (ip, port) пробы."""
+    if len(pkt) < PROBE_HDR.size or pkt[0] != T_PROBE:
+        return None
+    _, kind, pid, seq, t_ns = PROBE_HDR.unpack_from(pkt)
+    if kind == P_BW:
+        return PROBE_HDR.pack(T_PROBE, P_BW_ACK, pid, seq, t_ns)
+    if kind == P_LAT:
+        return LAT_ACK.pack(T_PROBE, P_LAT_ACK, pid, seq, t_ns, time.time_ns())
+    if kind == P_KA and peer:
+        try:
+            return KA_ACK.pack(T_PROBE, P_KA_ACK, pid, seq, t_ns, socket.inet_aton(peer[0]), peer[1])
+        except OSError:
+            return None  # не IPv4
+    return None
+
+
+def _xor(acc, data):
+    # little-endian: нули в хвосте короткого пакета не меняют число — выравнивать не нужно
+    return acc ^ int.from_bytes(data, "little")
+
+
+class FecEncoder:
+    """Оборачивает датаграммы и добавляет паритеты по мере заполнения строк/блока."""
+
+    def __init__(self, L, D=0):
+        self.L, self.D = L, D
+        self.seq = 0
+        self.data = self.parity = 0
+        self._new_block()
+
+    def _new_block(self):
+        self.base = self.seq
+        self.count = 0                      # пакетов в текущем блоке
+        self.row = [0, 0, 0]                # acc, len_xor, n
+        self.cols = [[0, 0, 0] for _ in range(self.L)] if self.D else []
+        self.last_at = None
+
+    def _par(self, typ, idx, g):
+        acc, lx, n = g
+        plen = (acc.bit_length() + 7) // 8
+        self.parity += 1
+        return PAR_HDR.pack(typ, self.base, self.L, self.D, idx, n, lx) + acc.to_bytes(plen, "little")
+
+    def wrap(self, payload, now=None):
+        """-> список датаграмм к отправке: сам пакет и, если группа закрылась, паритеты."""
+        out = [DATA_HDR.pack(T_DATA, self.seq) + payload]
+        self.seq = (self.seq + 1) & 0xFFFFFFFF
+        self.data += 1
+        self.last_at = time.monotonic() if now is None else now
+        r, c = divmod(self.count, self.L)
+        self.count += 1
+        for g in [self.row] + ([self.cols[c]] if self.D else []):
+            g[0] = _xor(g[0], payload)
+            g[1] ^= len(payload)
+            g[2] += 1
+        if c == self.L - 1:
+            out.append(self._par(T_ROW, r, self.row))
+            self.row = [0, 0, 0]
+        if not self.D and c == self.L - 1:
+            self._new_block()
+        elif self.D and self.count == self.L * self.D:
+            out += [self._par(T_COL, i, g) for i, g in enumerate(self.cols)]
+            self._new_block()
+        return out
+
+    def flush(self):
+        """Закрыть неполный блок (поток притих): паритеты по тому, что уже отправлено."""
+        if not self.count:
+            return []
+        out = []
+        if self.row[2]:
+            out.append(self._par(T_ROW, (self.count - 1) // self.L, self.row))
+        out += [self._par(T_COL, i, g) for i, g in enumerate(self.cols) if g[2]]
+        self._new_block()
+        return out
+
+    def idle_for(self, now):
+        return None if self.last_at is None else now - self.last_at
+
+
+class FecDecoder:
+    """
+    Снимает заголовки и восстанавливает одиночные потери в группах.
+    Пакеты отдаются сразу по приходу (восстановленные — вне порядка): порядок
+    и дубликаты дальше разбирает буфер RIST, но свои дубликаты (пришёл после
+    восстановления) мы отбрасываем сами.
+    """
+
+    def __init__(self, window=4096):
+        self.window = window
+        self.have = {}        # seq -> payload (в пределах окна)
+        self.parities = {}    # (type, base, idx) -> (members, len_xor, acc)
+        self.waiting = {}     # seq -> {ключ паритета, которому не хватает этого seq}
+        self.high = None
+        self.low = None
+        self.received = self.recovered = self.unrecoverable = self.dup = self.raw = self.resets = 0
+
+    def _reset(self):
+        self.have.clear(); self.parities.clear(); self.waiting.clear()
+        self.high = self.low = None
+        self.resets += 1
+
+    def _advance(self, seq):
+        if self.high is None:
+            self.high = self.low = seq
+            return True
+        d = (seq - self.high) & 0xFFFFFFFF
+        if d >= 0x80000000:                                    # назад
+            if ((self.high - seq) & 0xFFFFFFFF) > 4 * self.window:
+                self._reset()                                  # отправитель перезапущен
+                self.high = self.low = seq
+                return True
+            return ((seq - self.low) & 0xFFFFFFFF) < 0x80000000  # не старше окна
+        self.high = seq
+        new_low = (self.high - self.window) & 0xFFFFFFFF
+        if ((new_low - self.low) & 0xFFFFFFFF) < 0x80000000:
+            if ((new_low - self.low) & 0xFFFFFFFF) > 2 * self.window:
+                self.low = new_low                             # большой скачок: не перебираем
+            while self.low != new_low:
+                if self.have.pop(self.low, None) is None:
+                    self.unrecoverable += 1
+                for k in self.waiting.pop(self.low, ()):
+                    self.parities.pop(k, None)
+                self.low = (self.low + 1) & 0xFFFFFFFF
+        return True
+
+    def _members(self, typ, base, L, D, idx, n):
+        if typ == T_ROW:
+            return [(base + idx * L + i) & 0xFFFFFFFF for i in range(n)]
+        return [(base + r * L + idx) & 0xFFFFFFFF for r in range(n)]
+
+    def _try(self, key, out):
+        members, lx, acc = self.parities[key]
+        missing = [m for m in members if m not in self.have]
+        if len(missing) > 1:
+            return
+        del self.parities[key]
+        if not missing:
+            return
+        m = missing[0]
+        for s in members:
+            if s != m:
+                acc = _xor(acc, self.have[s])
+                lx ^= len(self.have[s])
+        payload = acc.to_bytes(lx, "little") if lx else b""
+        self.waiting.get(m, set()).discard(key)
+        self._store(m, payload, out)
+        self.recovered += 1
+
+    def _store(self, seq, payload, out):
+        self.have[seq] = payload
+        out.append(payload)
+        for k in list(self.waiting.pop(seq, ())):
+            if k in self.parities:
+                self._try(k, out)
+
+    def feed(self, pkt):
+        """-> список датаграмм для приёмника RIST (может быть пустым)."""
+        if not pkt or pkt[0] < T_DATA or pkt[0] > T_COL:
+            self.raw += 1
+            return [pkt]
+        out = []
+        if pkt[0] == T_DATA:
+            if len(pkt) < DATA_HDR.size:
+                return out
+            _, seq = DATA_HDR.unpack_from(pkt)
+            if not self._advance(seq):
+                return out
+            if seq in self.have:
+                self.dup += 1
+                return out
+            self.received += 1
+            self._store(seq, pkt[DATA_HDR.size:], out)
+            return out
+        if len(pkt) < PAR_HDR.size:
+            return out
+        typ, base, L, D, idx, n, lx = PAR_HDR.unpack_from(pkt)
+        members = self._members(typ, base, L, D, idx, n)
+        if not members or not self._advance(members[-1]):
+            return out
+        key = (typ, base, idx)
+        self.parities[key] = (members, lx, int.from_bytes(pkt[PAR_HDR.size:], "little"))
+        for m in members:
+            if m not in self.have:
+                self.waiting.setdefault(m, set()).add(key)
+        self._try(key, out)
+        return out
+
+    def stats(self):
+        return {
+            "received": self.received, "recovered": self.recovered,
+            "unrecoverable": self.unrecoverable, "dup": self.dup, "raw": self.raw, "resets": self.resets,
+        }
+
+
+class MirrorDedup:
+    """
+    Приём кадров T_MIRR: первая копия (path, seq) проходит, вторая отбрасывается.
+    По паре (путь-источник, путь копии) считаем, кто пришёл первым и на сколько,
+    и сколько пакетов довезла только одна из копий.
+    """
+
+    def __init__(self, window=8192):
+        self.window = window
+        self.seen = {}     # path -> OrderedDict seq -> [via первой, partner, t первой, пришла ли вторая]
+        self.pairs = {}    # (path, partner) -> счётчики
+
+    def _pair(self, path, partner):
+        return self.pairs.setdefault((path, partner), {
+            "mirrored": 0, "dups": 0, "primary_first": 0, "copy_first": 0,
+            "copy_only": 0, "primary_only": 0, "lead_ms_sum": 0.0,
+        })
+
+    def feed(self, pkt, now=None):
+        """-> (path, via, вложенный пакет или None для дубликата); None — не наш кадр."""
+        if len(pkt) < MIRR_HDR.size or pkt[0] != T_MIRR:
+            return None
+        _, path, via, partner, seq = MIRR_HDR.unpack_from(pkt)
+        now = time.monotonic() if now is None else now
+        win = self.seen.setdefault(path, OrderedDict())
+        e = win.get(seq)
+        if e is None:
+            win[seq] = [via, partner, now, False]
+            if partner:
+                self._pair(path, partner)["mirrored"] += 1
+            while len(win) > self.window:
+                self._expire(path, win.popitem(last=False)[1])
+            return path, via, pkt[MIRR_HDR.size:]
+        if not e[3]:
+            e[3] = True
+            if e[1]:
+                c = self._pair(path, e[1])
+                c["dups"] += 1
+                c["primary_first" if e[0] == path else "copy_first"] += 1
+                c["lead_ms_sum"] += 1000.0 * (now - e[2])
+        return path, via, None
+
+    def _expire(self, path, e):
+        via, partner, _, both = e
+        if partner and not both:
+            self._pair(path, partner)["primary_only" if via == path else "copy_only"] += 1
+
+    def stats(self):
+        out = {}
+        for (path, partner), c in self.pairs.items():
+            d = dict(c)
+            lead = d.pop("lead_ms_sum")
+            d["dup_rate"] = round(c["dups"] / c["mirrored"], 3) if c["mirrored"] else None
+            d["lead_ms_avg"] = round(lead / c["dups"], 2) if c["dups"] else None
+            out[f"{path}->{partner}"] = d
+        return out
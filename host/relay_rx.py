@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Приёмная сторона релейного слоя (на сервере, перед RIST-приёмником):
+udp_proxy.py (по пути на модем) -> relay_rx.py --listen -> --forward (Mist / ristreceiver).
+
+- на каждый адрес отправителя (путь) — свой сокет к приёмнику, так что пути
+  остаются разными пирами RIST, а ответы (NACK/RTCP) уходят обратно тем же путём;
+- снимает FEC (relay_proto.FecDecoder): одиночные потери в группе восстанавливаются
+  без ретрансмита; пакеты без заголовка пропускаются как есть;
+- на пробы ёмкости и задержки пути и keepalive NAT (T_PROBE) отвечает сам, к приёмнику они не попадают;
+- кадры зеркала (udp_proxy --path-id): сессия — по id пути, а не по адресу; из двух
+  копий проходит первая (relay_proto.MirrorDedup), ответы — на адрес основного пути;
+- счётчики received / recovered / unrecoverable по каждому пути и по парам зеркала
+  (доля дубликатов, кто пришёл первым и на сколько) — в лог и --stats-file.
+
+Зависимости: только stdlib и relay_proto.py рядом.
+"""
+
+import argparse, json, os, select, socket, sys, time
+from relay_proto import FecDecoder, MirrorDedup, probe_ack, T_PROBE
+
+
+def _addr(s, default_host="0.0.0.0"):
+    host, _, port = s.rpartition(":")
+    return (host or default_host, int(port))
+
+
+class Session:
+    def __init__(self, key, peer, forward):
+        self.key = key
+        self.peer = peer      # куда отвечать
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.connect(forward)
+        self.dec = FecDecoder()
+        self.last_rx = time.monotonic()
+
+    def close(self):
+        try: self.sock.close()
+        except OSError: pass
+
+
+def write_stats(path, data):
+    try:
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(path + ".tmp", path)
+    except OSError as e:
+        print(f"[WARN] stats {path}: {e}", file=sys.stderr)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--listen", default="0.0.0.0:8000", help="public ip:port the relays send to")
+    ap.add_argument("--forward", required=True, help="RIST receiver ip:port, e.g. 127.0.0.1:8001")
+    ap.add_argument("--idle-timeout", type=int, default=600)
+    ap.add_argument("--stats-interval", type=float, default=10.0)
+    ap.add_argument("--stats-file", help="JSON with per-path FEC stats")
+    args = ap.parse_args()
+    forward = _addr(args.forward, "127.0.0.1")
+
+    lsock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    lsock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    lsock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 22)
+    try:
+        lsock.bind(_addr(args.listen))
+    except OSError as e:
+        print(f"[ERR] bind listen {args.listen}: {e}", file=sys.stderr)
+        sys.exit(1)
+    print(f"[OK] listen {args.listen} -> {forward[0]}:{forward[1]}", flush=True)
+
+    sessions = {}    # адрес отправителя или "path N" -> Session
+    by_sock = {}     # сокет к приёмнику -> Session
+    dedup = MirrorDedup()
+    next_stats = time.monotonic() + args.stats_interval
+
+    while True:
+        rlist, _, _ = select.select([lsock] + list(by_sock), [], [], 1.0)
+        now = time.monotonic()
+        for s in rlist:
+            if s is lsock:
+                pkt, peer = lsock.recvfrom(65535)
+                if pkt[:1] == bytes([T_PROBE]):
+                    # проба ёмкости пути: отвечаем сами, в приёмник RIST не отдаём
+                    ack = probe_ack(pkt, peer)
+                    if ack:
+                        lsock.sendto(ack, peer)
+                    continue
+                m = dedup.feed(pkt, now)
+                key = f"path {m[0]}" if m else peer
+                ss = sessions.get(key)
+                if ss is None:
+                    ss = sessions[key] = Session(key, peer, forward)
+                    by_sock[ss.sock] = ss
+                    print(f"[NEW] {key if m else f'{peer[0]}:{peer[1]}'}", flush=True)
+                ss.last_rx = now
+                if m:
+                    path, via, pkt = m
+                    if via == path:
+                        ss.peer = peer  # ответы — основным путём, копии идут только к серверу
+                    if pkt is None:
+                        continue
+                for d in ss.dec.feed(pkt):
+                    try: ss.sock.send(d)
+                    except OSError: pass  # приёмник ещё не слушает
+            else:
+                ss = by_sock[s]
+                try:
+                    lsock.sendto(s.recv(65535), ss.peer)
+                except OSError:
+                    pass
+
+        for key, ss in list(sessions.items()):
+            if now - ss.last_rx > args.idle_timeout:
+                print(f"[IDLE] {ss.peer[0]}:{ss.peer[1]}", flush=True)
+                by_sock.pop(ss.sock, None)
+                sessions.pop(key).close()
+
+        if now >= next_stats:
+            next_stats = now + args.stats_interval
+            st = {"at": round(time.time(), 3),
+                  "paths": {k if isinstance(k, str) else f"{k[0]}:{k[1]}": ss.dec.stats() for k, ss in sessions.items()},
+                  "mirror": dedup.stats()}
+            for name, d in st["paths"].items():
+                print(f"[FEC] {name}: received {d['received']} recovered {d['recovered']} "
+                      f"unrecoverable {d['unrecoverable']} raw {d['raw']}", flush=True)
+            for pair, d in st["mirror"].items():
+                print(f"[MIRROR] {pair}: dup rate {d['dup_rate']}, first primary/copy {d['primary_first']}/{d['copy_first']}, "
+                      f"lead {d['lead_ms_avg']} ms, saved by copy {d['copy_only']}", flush=True)
+            if args.stats_file:
+                write_stats(args.stats_file, st)
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,100 @@
+#!/usr/bin/env bash
+# Общий код batch-режима для rist_policy.sh / appl_rist_paths.sh (подключается через source).
+#
+# Идея: описываем ЖЕЛАЕМОЕ состояние (ip rule / маршруты таблиц / цепочка mangle),
+# сравниваем с живым и применяем только разницу — одним `ip -batch` и одним
+# `iptables-restore --noflush`, без циклов `while ip rule show | grep`.
+#
+#   rb_begin
+#   rb_rules  '<regex наших правил>' "PREF SELECTOR lookup TABLE" ...
+#   rb_routes TABLE "как печатает ip route show table TABLE" ...
+#   rb_chain  TABLE CHAIN PARENT "-A CHAIN ... (в форме iptables -S)" ...
+#   rb_commit
+
+rb_begin(){
+  RB_T0=$(date +%s%N)
+  RB_DEL=$(mktemp); RB_ADD=$(mktemp); RB_IPT=$(mktemp)
+  trap 'rm -f "$RB_DEL" "$RB_ADD" "$RB_IPT"' EXIT
+}
+
+# схлопнуть пробелы (ip печатает хвостовые/двойные), без glob-раскрытия
+_rb_squeeze(){ local -a w; read -ra w <<<"$*"; echo "${w[*]}"; }
+
+# Правила RPDB. Ключ сравнения: "PREF SELECTOR lookup TABLE" (без "from all").
+# Живые правила, попадающие под regex и отсутствующие в желаемом списке, удаляются.
+rb_rules(){
+  local own="$1"; shift
+  local -A want=()
+  local r line pref rest key sel
+  for r in "$@"; do want["$(_rb_squeeze "$r")"]=1; done
+  while IFS= read -r line; do
+    pref="${line%%:*}"
+    rest="$(_rb_squeeze "${line#*:}")"
+    key="$pref ${rest#from all }"
+    [[ "$key" =~ $own ]] || continue
+    if [[ -n "${want[$key]:-}" ]]; then
+      unset "want[$key]"
+    else
+      echo "rule del $rest pref $pref" >>"$RB_DEL"
+    fi
+  done < <(ip rule show)
+  for r in "${!want[@]}"; do
+    read -r pref sel <<<"$r"
+    echo "rule add $sel pref $pref" >>"$RB_ADD"
+  done
+}
+
+# Маршруты в СВОЕЙ таблице: всё лишнее удаляется, недостающее — route replace.
+rb_routes(){
+  local t="$1"; shift
+  local -A want=()
+  local r line
+  for r in "$@"; do want["$(_rb_squeeze "$r")"]=1; done
+  while IFS= read -r line; do
+    line="$(_rb_squeeze "${line/ linkdown/}")"
+    [[ -z "$line" ]] && continue
+    if [[ -n "${want[$line]:-}" ]]; then
+      unset "want[$line]"
+    else
+      echo "route del $line table $t" >>"$RB_DEL"
+    fi
+  done < <(ip route show table "$t" 2>/dev/null)
+  for r in "${!want[@]}"; do echo "route replace $r table $t" >>"$RB_ADD"; done
+}
+
+# Пользовательская цепочка + ровно один переход на неё из PARENT.
+# Желаемые правила — в канонической форме `iptables -S`, иначе сравнение
+# будет всегда "различаться" (что безопасно: цепочка просто перезапишется атомарно).
+rb_chain(){
+  local tbl="$1" ch="$2" parent="$3"; shift 3
+  local want live jumps i
+  want="$(printf '%s\n' "$@")"
+  live="$(iptables -t "$tbl" -S "$ch" 2>/dev/null | grep '^-A ' || true)"
+  jumps=$(iptables -t "$tbl" -S "$parent" 2>/dev/null | grep -cx -- "-A $parent -j $ch" || true)
+  [[ "$want" == "$live" && "$jumps" -eq 1 ]] && return 0
+  {
+    echo "*$tbl"
+    echo ":$ch - [0:0]"          # с --noflush объявление цепочки очищает именно её
+    printf '%s\n' "$@"
+    [ "$jumps" -eq 0 ] && echo "-I $parent 1 -j $ch"
+    for ((i=1; i<jumps; i++)); do echo "-D $parent -j $ch"; done
+    echo "COMMIT"
+  } >>"$RB_IPT"
+}
+
+rb_commit(){
+  local ndel nadd ipt="unchanged" ms
+  ndel=$(wc -l <"$RB_DEL"); nadd=$(wc -l <"$RB_ADD")
+  if [ $((ndel + nadd)) -gt 0 ]; then
+    # сначала replace/add, затем удаления: ip -batch не атомарен, а так сменившийся default
+    # или pref правила не пропадает ни на миг — старое удаляется, когда новое уже есть.
+    # Удаляем по полной записи, поэтому замещённое replace'ом просто не найдётся (-force)
+    cat "$RB_ADD" "$RB_DEL" | ip -force -batch -
+  fi
+  if [ -s "$RB_IPT" ]; then
+    iptables-restore --noflush <"$RB_IPT"
+    ipt="changed"
+  fi
+  ms=$(( ($(date +%s%N) - RB_T0) / 1000000 ))
+  echo "[rist-batch] applied: del=$ndel add=$nadd iptables=$ipt in ${ms} ms"
+}
@@ -25,6 +25,9 @@ N4="modem4"; T4=103
 
 # Our mangle chain for owner->mark
 MCHAIN="RIST_OWNER"
+
+# Метка "общая часть уже поставлена с этой загрузки" (/run чистится при перезагрузке)
+BASE_STAMP="${RIST_POLICY_STAMP:-/run/rist-policy.base}"
 # ==================
 
 msg(){ echo "[rist-policy] $*"; }
@@ -70,14 +73,16 @@ EOF
 }
 
 set_sysctl(){
-  # keep output quiet
-  cat >/etc/sysctl.d/99-rist-bonding.conf <<EOF
-net.ipv4.conf.all.rp_filter = 2
+  local f=/etc/sysctl.d/99-rist-bonding.conf want
+  want="net.ipv4.conf.all.rp_filter = 2
 net.ipv4.conf.${IF1}.rp_filter = 2
 net.ipv4.conf.${IF2}.rp_filter = 2
 net.ipv4.conf.${IF3}.rp_filter = 2
-net.ipv4.conf.${IF4}.rp_filter = 2
-EOF
+net.ipv4.conf.${IF4}.rp_filter = 2"
+  # в batch-режиме не трогаем sysctl, если файл уже такой
+  if [ "$MODE" = "batch" ] && [ -f "$f" ] && [ "$(cat "$f")" = "$want" ]; then return 0; fi
+  # keep output quiet
+  printf '%s\n' "$want" >"$f"
   sysctl --system >/dev/null 2>&1 || true
 }
 
@@ -136,7 +141,7 @@ apply_uid_rules() {
   ip rule add uidrange ${U4}-${U4} lookup modem4 pref 5004
 }
 
-apply_owner_mark(){
+ensure_mchain(){
   # create chain and single jump from OUTPUT
   iptables -t mangle -N "$MCHAIN" >/dev/null 2>&1 || true
   iptables -t mangle -C OUTPUT -j "$MCHAIN" >/dev/null 2>&1 || iptables -t mangle -I OUTPUT 1 -j "$MCHAIN"
@@ -146,6 +151,10 @@ apply_owner_mark(){
   if [ "${#_J[@]}" -gt 1 ]; then
     for ((i=0;i<${#_J[@]}-1;i++)); do iptables -t mangle -D OUTPUT "${_J[$i]}" >/dev/null 2>&1 || true; done
   fi
+}
+
+apply_owner_mark(){
+  ensure_mchain
 
   iptables -t mangle -F "$MCHAIN"
   iptables -t mangle -A "$MCHAIN" -m owner --uid-owner "${USERS[0]}" -j MARK --set-mark 0x10 -m comment --comment "owner ${USERS[0]} -> modem1"
@@ -160,6 +169,115 @@ apply_owner_mark(){
   ip rule add fwmark 0x13 table "$N4" pref 9004
 }
 
+# Batch-режим: желаемое состояние правил/таблиц/цепочки → diff с живым → один батч.
+# Заменяет cleanup_old + routes_per_table + apply_uid_rules + apply_owner_mark.
+batch_apply(){
+  # shellcheck source=rist_batch.sh
+  . "$(dirname "$(readlink -f "$0")")/rist_batch.sh"
+  local U1 U2 U3 U4
+  U1=$(id -u "${USERS[0]}"); U2=$(id -u "${USERS[1]}"); U3=$(id -u "${USERS[2]}"); U4=$(id -u "${USERS[3]}")
+
+  rb_begin
+  # наши правила: uidrange/fwmark 0x10-0x13 и остатки старых схем (to 10.255.0.x / from 192.168.x.x)
+  rb_rules '^(500[1-4]|900[1-4]) |fwmark 0x1[0-3] |uidrange |to 10\.255\.0\.|^[0-9]+ from 192\.168\.' \
+    "5001 uidrange $U1-$U1 lookup $N1" \
+    "5002 uidrange $U2-$U2 lookup $N2" \
+    "5003 uidrange $U3-$U3 lookup $N3" \
+    "5004 uidrange $U4-$U4 lookup $N4" \
+    "9001 fwmark 0x10 lookup $N1" \
+    "9002 fwmark 0x11 lookup $N2" \
+    "9003 fwmark 0x12 lookup $N3" \
+    "9004 fwmark 0x13 lookup $N4"
+
+  rb_routes "$N1" "$NET1 dev $IF1 proto kernel scope link src $IP1" "default via $GW1 dev $IF1 src $IP1"
+  rb_routes "$N2" "$NET2 dev $IF2 proto kernel scope link src $IP2" "default via $GW2 dev $IF2 src $IP2"
+  rb_routes "$N3" "$NET3 dev $IF3 proto kernel scope link src $IP3" "default via $GW3 dev $IF3 src $IP3"
+  rb_routes "$N4" "$NET4 dev $IF4 proto kernel scope link src $IP4" "default via $GW4 dev $IF4 src $IP4"
+
+  rb_chain mangle "$MCHAIN" OUTPUT \
+    "-A $MCHAIN -m owner --uid-owner $U1 -m comment --comment \"owner ${USERS[0]} -> modem1\" -j MARK --set-xmark 0x10/0xffffffff" \
+    "-A $MCHAIN -m owner --uid-owner $U2 -m comment --comment \"owner ${USERS[1]} -> modem2\" -j MARK --set-xmark 0x11/0xffffffff" \
+    "-A $MCHAIN -m owner --uid-owner $U3 -m comment --comment \"owner ${USERS[2]} -> modem3\" -j MARK --set-xmark 0x12/0xffffffff" \
+    "-A $MCHAIN -m owner --uid-owner $U4 -m comment --comment \"owner ${USERS[3]} -> modem4\" -j MARK --set-xmark 0x13/0xffffffff"
+
+  rb_commit | while read -r l; do msg "$l"; done
+}
+
+# Общая часть, без которой правила одного модема ничего не дают: пользователи, VIP на lo,
+# rt_tables, rp_filter, цепочка с переходом из OUTPUT. После перезагрузки её нет, а полный
+# прогон сам не запускается — --only ставит её сам, один раз за загрузку (по метке в /run).
+ensure_base(){
+  [ -f "$BASE_STAMP" ] && return 0
+  msg "base setup (first run since boot)"
+  ensure_users
+  ensure_vips
+  write_rt_tables
+  MODE=full set_sysctl
+  ensure_mchain
+  mark_base
+}
+
+mark_base(){ mkdir -p "$(dirname "$BASE_STAMP")"; : >"$BASE_STAMP"; }
+
+# Обновление ОДНОГО модема (--only modemN): его таблица, его ip rule и его mark.
+# Адрес/шлюз берём живые (DHCP мог их поменять), при отсутствии — из CONFIG.
+refresh_one(){
+  local ifc="$1" n i v
+  for i in 1 2 3 4; do v="IF$i"; [ "${!v}" = "$ifc" ] && n=$i; done
+  [ -n "${n:-}" ] || { msg "unknown interface $ifc"; return 1; }
+  local tname="N$n" cip="IP$n" cgw="GW$n" cnet="NET$n"
+  local table="${!tname}" ip="${!cip}" gw="" net="${!cnet}" cidr
+  # шлюз из события NM — только если событие про этот же интерфейс
+  [ "${DEVICE_IP_IFACE:-$ifc}" = "$ifc" ] && gw="${IP4_GATEWAY:-}"
+  local mark; mark=$(printf '0x%x' $((0x10 + n - 1)))
+  local user="${USERS[$((n-1))]}" uid; uid=$(id -u "$user")
+
+  cidr=$(ip -4 -o addr show dev "$ifc" 2>/dev/null | awk '{print $4; exit}')
+  if [ -n "$cidr" ]; then
+    ip="${cidr%/*}"
+    local plen="${cidr#*/}" a b c d netn
+    IFS=. read -r a b c d <<<"$ip"
+    netn=$(( (a<<24 | b<<16 | c<<8 | d) & ((0xffffffff << (32 - plen)) & 0xffffffff) ))
+    net="$((netn>>24 & 255)).$((netn>>16 & 255)).$((netn>>8 & 255)).$((netn & 255))/$plen"
+  fi
+  [ -n "$gw" ] || gw=$(ip -4 route show default dev "$ifc" 2>/dev/null | awk '{print $3; exit}')
+  [ -n "$gw" ] || gw="${!cgw}"
+  # прежний адрес модема — из src его default, пока таблица ещё не обновлена
+  local old; old=$(ip -4 route show table "$table" default 2>/dev/null | awk '{for (i = 1; i < NF; i++) if ($i == "src") {print $(i+1); exit}}' || true)
+
+  . "$(dirname "$(readlink -f "$0")")/rist_batch.sh"
+  rb_begin
+  rb_rules "^(500$n|900$n) |fwmark $mark |uidrange $uid-$uid " \
+    "500$n uidrange $uid-$uid lookup $table" \
+    "900$n fwmark $mark lookup $table"
+  rb_routes "$table" "$net dev $ifc proto kernel scope link src $ip" "default via $gw dev $ifc src $ip"
+  # в общей цепочке — только правило этого uid (порядок правил с разными uid не важен; правила
+  # других модемов --only не трогает). Прежние правила uid с другим mark/комментарием (старая
+  # раскладка) удаляем в том же батче: иначе первое совпавшее так и метило бы по-старому.
+  local want="-A $MCHAIN -m owner --uid-owner $uid -m comment --comment \"owner $user -> $ifc\" -j MARK --set-xmark $mark/0xffffffff" have
+  iptables -t mangle -N "$MCHAIN" >/dev/null 2>&1 || true
+  have=$(iptables -t mangle -S "$MCHAIN" 2>/dev/null | grep -e "--uid-owner $uid " || true)
+  if [ "$have" != "$want" ]; then
+    {
+      echo "*mangle"
+      if [ -n "$have" ]; then printf '%s\n' "$have" | sed 's/^-A /-D /'; fi
+      echo "$want"
+      echo "COMMIT"
+    } >>"$RB_IPT"
+  fi
+  rb_commit | while read -r l; do msg "$ifc: $l"; done
+  # устаревшие записи conntrack/NAT этого модема — по кортежу, как flush_conntrack_udp
+  # (--mark сравнивает ctmark, а цепочка ставит только метку пакета: так не нашлось бы ничего)
+  if command -v conntrack >/dev/null 2>&1; then
+    local a
+    conntrack -D -p udp --orig-dst "${VIPS[$((n-1))]}" --dport "$SRV_PORT" >/dev/null 2>&1 || true
+    for a in $(printf '%s\n' "$old" "$ip" | sort -u); do
+      conntrack -D -p udp --orig-src "$a" --orig-dst "$SRV" --dport "$SRV_PORT" >/dev/null 2>&1 || true
+      conntrack -D -p udp --orig-dst "$SRV" --dport "$SRV_PORT" --reply-dst "$a" >/dev/null 2>&1 || true  # за MASQUERADE
+    done
+  fi
+}
+
 flush_conntrack_udp(){
   command -v conntrack >/dev/null 2>&1 || return 0
   for vip in "${VIPS[@]}"; do
@@ -169,6 +287,22 @@ flush_conntrack_udp(){
 }
 
 main(){
+  # --batch (или RIST_POLICY_MODE=batch): diff с живым состоянием и один атомарный батч
+  MODE="${RIST_POLICY_MODE:-full}"
+  [ "${1:-}" = "--batch" ] && MODE="batch"
+  local t0; t0=$(date +%s%N)
+
+  # --only modemN: инкрементально, только этот модем (вызывается из NM dispatcher)
+  if [ "${1:-}" = "--only" ]; then
+    need_root
+    ensure_bins
+    MODE="batch"
+    ensure_base
+    refresh_one "${2:?interface required}"
+    msg "done (only $2) in $(( ($(date +%s%N) - t0) / 1000000 )) ms"
+    return 0
+  fi
+
   need_root
   ensure_bins
   msg "users"
@@ -179,16 +313,22 @@ main(){
   write_rt_tables
   msg "sysctl rp_filter=2"
   set_sysctl
-  msg "cleanup old"
-  cleanup_old
-  msg "routes per table"
-  routes_per_table
-  apply_uid_rules
-  msg "owner->mark and fwmark->tables"
-  apply_owner_mark
+  if [ "$MODE" = "batch" ]; then
+    msg "batch apply (diff)"
+    batch_apply
+  else
+    msg "cleanup old"
+    cleanup_old
+    msg "routes per table"
+    routes_per_table
+    apply_uid_rules
+    msg "owner->mark and fwmark->tables"
+    apply_owner_mark
+  fi
   msg "flush conntrack udp"
   flush_conntrack_udp
-  msg "done"
+  mark_base
+  msg "done ($MODE) in $(( ($(date +%s%N) - t0) / 1000000 )) ms"
 
   echo
   echo "Checks:"
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Ответчик на пробы ёмкости пути (entrypoint.py, rist.bw_probe) и пробы задержки
+(udp_proxy.py --probe-ms, с --probe-target, если на порту сервера RIST-приёмник) и keepalive
+NAT (udp_proxy.py --keepalive auto) —
+вместо relay_rx.py, когда на сервере его нет, или локальная заглушка для проверки без модемов:
+  на сервере:   udp_echo.py --listen 0.0.0.0:8000
+  заглушка:     udp_echo.py --listen 127.0.0.1:9000 --rate-kbps 3000 --loss-pct 0.5
+                (senders[i].probe_target: "127.0.0.1:9000")
+
+--rate-kbps / --loss-pct эмулируют узкий аплинк: сверх скорости (с буфером --buffer-ms)
+и случайно с заданной вероятностью пробы теряются. --echo-all — прочие датаграммы
+возвращаются как есть (простой UDP echo).
+"""
+
+import argparse, random, socket, sys, time
+from relay_proto import probe_ack
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--listen", default="0.0.0.0:8000")
+    ap.add_argument("--rate-kbps", type=float, default=0, help="emulated uplink rate, 0 = unlimited")
+    ap.add_argument("--buffer-ms", type=float, default=50)
+    ap.add_argument("--loss-pct", type=float, default=0)
+    ap.add_argument("--echo-all", action="store_true")
+    args = ap.parse_args()
+    host, _, port = args.listen.rpartition(":")
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 22)
+    try:
+        sock.bind((host or "0.0.0.0", int(port)))
+    except OSError as e:
+        print(f"[ERR] bind {args.listen}: {e}", file=sys.stderr)
+        sys.exit(1)
+    print(f"[OK] echo on {args.listen}"
+          + (f"; emulated {args.rate_kbps:g} kbps / {args.buffer_ms:g} ms buffer" if args.rate_kbps else "")
+          + (f"; loss {args.loss_pct:g}%" if args.loss_pct else ""), flush=True)
+
+    rate = args.rate_kbps * 1000 / 8.0
+    depth = rate * args.buffer_ms / 1000.0
+    level, t_last = 0.0, time.monotonic()  # «занятость» эмулируемого буфера в байтах
+
+    while True:
+        pkt, peer = sock.recvfrom(65535)
+        if rate:
+            now = time.monotonic()
+            level = max(0.0, level - (now - t_last) * rate)
+            t_last = now
+            if level + len(pkt) > depth:
+                continue
+            level += len(pkt)
+        if args.loss_pct and random.random() * 100 < args.loss_pct:
+            continue
+        ack = probe_ack(pkt, peer)
+        if ack:
+            sock.sendto(ack, peer)
+        elif args.echo_all:
+            sock.sendto(pkt, peer)
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        pass
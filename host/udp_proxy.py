@@ -1,5 +1,363 @@
 #!/usr/bin/env python3
-import argparse, socket, select, sys, time
+import argparse, json, os, random, socket, select, sys, time
+from collections import deque
+from relay_proto import (FecEncoder, parse_fec, KA_ACK, LAT_ACK, MIRR_HDR, PROBE_HDR, P_KA, P_KA_ACK, P_LAT,
+                         P_LAT_ACK, T_MIRR, T_PROBE)
+
+MTU = 1500
+
+def apply_sched(args):
+    """--cpus/--nice/--sched: ретрансляция не должна ждать ядра, занятые x264. Возвращает фактическое."""
+    if args.cpus:
+        cpus = set()
+        for part in args.cpus.split(","):
+            a, _, b = part.partition("-")
+            cpus.update(range(int(a), int(b or a) + 1))
+        try: os.sched_setaffinity(0, cpus)
+        except OSError as e: print(f"[WARN] affinity {args.cpus}: {e}", file=sys.stderr)
+    if args.nice is not None:
+        try: os.setpriority(os.PRIO_PROCESS, 0, args.nice)
+        except OSError as e: print(f"[WARN] nice {args.nice}: {e}", file=sys.stderr)
+    if args.sched:
+        pol = {"fifo": os.SCHED_FIFO, "rr": os.SCHED_RR}[args.sched]
+        try: os.sched_setscheduler(0, pol, os.sched_param(args.rt_priority))
+        except OSError as e: print(f"[WARN] sched {args.sched}/{args.rt_priority}: {e}", file=sys.stderr)
+    pol = os.sched_getscheduler(0)
+    return (f"cpus={','.join(map(str, sorted(os.sched_getaffinity(0))))} nice={os.getpriority(os.PRIO_PROCESS, 0)} "
+            f"policy={ {os.SCHED_FIFO: 'fifo', os.SCHED_RR: 'rr'}.get(pol, 'other') }"
+            + (f"/{os.sched_getparam(0).sched_priority}" if pol in (os.SCHED_FIFO, os.SCHED_RR) else ""))
+
+class Pacer:
+    """
+    Token bucket на отправку в модем: ristsender шлёт пачками (ретрансмиты, ключевые кадры),
+    а глубокий буфер аплинка модема копит их и раздувает RTT всем следующим пакетам пути.
+    Держим очередь у себя и отдаём не быстрее rate с допуском burst; пакет, которому
+    пришлось бы ждать дольше max_delay, отбрасываем сразу (ARQ RIST перешлёт его по другому пути).
+    """
+    def __init__(self, rate_kbps, burst_bytes, max_delay_ms):
+        self.rate = rate_kbps * 1000 / 8.0          # байт/с
+        self.burst = max(int(burst_bytes), 2 * MTU)  # меньше двух MTU — пакеты не пройдут без ожидания
+        self.max_delay = max_delay_ms / 1000.0
+        self.tokens = float(self.burst)
+        self.t = time.monotonic()
+        self.q = deque()  # (время постановки, данные)
+        self.qbytes = 0
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.sent = self.sent_bytes = self.drops = self.delayed = 0
+        self.delay_sum = self.delay_max = 0.0
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.t) * self.rate)
+        self.t = now
+
+    def push(self, data, now) -> bool:
+        self._refill(now)
+        wait = (self.qbytes + len(data) - self.tokens) / self.rate
+        if wait > self.max_delay:
+            self.drops += 1
+            return False
+        self.q.append((now, data))
+        self.qbytes += len(data)
+        return True
+
+    def pop_ready(self, now):
+        """Пакеты, на которые уже есть токены (большой пакет при полном ведре тоже проходит)."""
+        self._refill(now)
+        out = []
+        while self.q and (self.tokens >= len(self.q[0][1]) or self.tokens >= self.burst):
+            t0, data = self.q.popleft()
+            self.qbytes -= len(data)
+            self.tokens -= len(data)
+            d = now - t0
+            self.sent += 1
+            self.sent_bytes += len(data)
+            self.delay_sum += d
+            self.delay_max = max(self.delay_max, d)
+            if d > 0.0005:
+                self.delayed += 1
+            out.append(data)
+        return out
+
+    def next_due(self, now):
+        """Через сколько секунд у головы очереди будут токены (None — очередь пуста)."""
+        if not self.q:
+            return None
+        return max(0.0, (len(self.q[0][1]) - self.tokens) / self.rate) if self.tokens < self.burst else 0.0
+
+    def queue_ms(self) -> float:
+        return 1000.0 * max(0.0, self.qbytes - self.tokens) / self.rate
+
+class Mirror:
+    """
+    Зеркалирование на второй путь (ради латентности, ценой 2× трафика).
+    С --path-id всё, что уходит к серверу, идёт в кадре T_MIRR (relay_rx узнаёт путь по id,
+    а не по адресу, поэтому включение зеркала не меняет сессию RIST). Когда зеркало включено
+    (--mirror-ctl: off | on | on <id>), копия каждой датаграммы отдаётся соседнему udp_proxy
+    на его --mirror-port, и тот шлёт её своим модемом. Второй путь — из --mirror-peers:
+    up_internet по modem-health и дольше всех без смены статуса; "on <id>" — принудительно.
+    """
+    def __init__(self, args):
+        self.path_id = args.path_id
+        self.iface = args.iface
+        self.peers = []  # (id, iface, port)
+        for item in filter(None, (args.mirror_peers or "").split(",")):
+            pid, iface, port = item.split(":")
+            if int(pid) != self.path_id:
+                self.peers.append((int(pid), iface, int(port)))
+        self.ctl, self.health_file = args.mirror_ctl, args.health_file
+        self.want, self.forced = "off", None
+        self.via = None       # (id, iface, port) выбранного второго пути
+        self.health = {}
+        self._mtimes = {}
+        self.seq = 0
+        self.copies = self.relayed = 0
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def _changed(self, path):
+        try:
+            m = os.stat(path).st_mtime_ns
+        except OSError:
+            m = None
+        if self._mtimes.get(path, 0) == m:
+            return False
+        self._mtimes[path] = m
+        return True
+
+    def refresh(self):
+        if self._changed(self.ctl):
+            try:
+                with open(self.ctl, encoding="utf-8") as f:
+                    words = f.read().split()
+            except OSError:
+                words = []
+            self.want = words[0].lower() if words and words[0].lower() in ("on", "off") else "off"
+            self.forced = int(words[1]) if self.want == "on" and len(words) > 1 else None
+        if self._changed(self.health_file):
+            try:
+                with open(self.health_file, encoding="utf-8") as f:
+                    self.health = {m.get("iface"): m for m in json.load(f)}
+            except (OSError, ValueError):
+                self.health = {}
+        via = None
+        if self.want == "on":
+            if self.forced is not None:
+                via = next((p for p in self.peers if p[0] == self.forced), None)
+            else:
+                # без файла здоровья годится любой сосед; иначе — только up_internet, самый стабильный
+                ok = [p for p in self.peers if not self.health or (self.health.get(p[1]) or {}).get("status") == "up_internet"]
+                ok.sort(key=lambda p: (self.health.get(p[1]) or {}).get("changed_at", 0))
+                via = ok[0] if ok else None
+        if via != self.via:
+            print(f"[MIRROR] {'-> path ' + str(via[0]) + ' (' + via[1] + ')' if via else 'off'}"
+                  f"{'' if via or self.want == 'off' else ' (no healthy peer)'}", flush=True)
+            self.via = via
+
+    def wrap(self, datagrams):
+        """-> (кадры своим путём, кадры для копии через self.via)."""
+        partner = self.via[0] if self.via else 0
+        own, copies = [], []
+        for d in datagrams:
+            own.append(MIRR_HDR.pack(T_MIRR, self.path_id, self.path_id, partner, self.seq) + d)
+            if partner:
+                copies.append(MIRR_HDR.pack(T_MIRR, self.path_id, partner, partner, self.seq) + d)
+            self.seq = (self.seq + 1) & 0xFFFFFFFF
+        return own, copies
+
+    def send_copies(self, copies):
+        for c in copies:
+            try:
+                self.sock.sendto(c, ("127.0.0.1", self.via[2]))
+                self.copies += 1
+            except OSError:
+                pass  # соседний relay не запущен — копия просто не уйдёт
+
+class LatencyProbe:
+    """
+    Пробы задержки по самому пути данных: с того же сокета и исходного порта, что и RIST
+    (у оператора та же UDP-«пятёрка», а не ICMP модема), раз в interval. Ответчик (relay_rx.py /
+    udp_echo.py) возвращает момент приёма по своим часам: RTT точный, а задержки туда и обратно —
+    с точностью до разницы часов, поэтому отдаём их над минимумом окна (очередь на пути) и тренд.
+    """
+    def __init__(self, interval_ms, window_s=60.0, timeout_s=2.0):
+        self.id = random.getrandbits(32)
+        self.interval = interval_ms / 1000.0
+        self.window, self.timeout = window_s, timeout_s
+        self.seq = 0
+        self.next_at = 0.0
+        self.pending = {}       # seq -> monotonic отправки
+        self.hist = deque()     # (mono, up_raw_ms, down_raw_ms) за окно — для базовых минимумов
+        self.samples = []       # с прошлого отчёта: (mono, rtt_ms, up_raw_ms, down_raw_ms)
+        self.sent = self.lost = 0
+
+    def make(self, mono):
+        self.next_at = mono + self.interval
+        self.seq = (self.seq + 1) & 0xFFFFFFFF
+        self.pending[self.seq] = mono
+        self.sent += 1
+        for s in [s for s, t in self.pending.items() if mono - t > self.timeout]:
+            del self.pending[s]
+            self.lost += 1
+        return PROBE_HDR.pack(T_PROBE, P_LAT, self.id, self.seq, time.time_ns())
+
+    def on_ack(self, pkt, mono) -> bool:
+        """True — квитанция наша (разобрана), False — чужая (пробы ёмкости entrypoint)."""
+        if len(pkt) < LAT_ACK.size or pkt[1] != P_LAT_ACK:
+            return False
+        _, _, pid, seq, t_tx, t_srv = LAT_ACK.unpack_from(pkt)
+        if pid != self.id:
+            return False
+        t0 = self.pending.pop(seq, None)
+        if t0 is None:
+            return True  # опоздала (уже в lost) или дубликат
+        up, down = (t_srv - t_tx) / 1e6, (time.time_ns() - t_srv) / 1e6
+        self.samples.append((mono, 1000.0 * (mono - t0), up, down))
+        self.hist.append((mono, up, down))
+        while self.hist and mono - self.hist[0][0] > self.window:
+            self.hist.popleft()
+        return True
+
+    @staticmethod
+    def _slope(pts):
+        """МНК: мс задержки на секунду — растёт ли очередь на пути."""
+        if len(pts) < 3:
+            return None
+        n = len(pts)
+        mx, my = sum(p[0] for p in pts) / n, sum(p[1] for p in pts) / n
+        sxx = sum((p[0] - mx) ** 2 for p in pts)
+        return round(sum((p[0] - mx) * (p[1] - my) for p in pts) / sxx, 3) if sxx else None
+
+    def report(self, mono) -> dict:
+        smp, self.samples = self.samples, []
+        out = {"interval_ms": round(self.interval * 1000), "sent": self.sent, "received": len(smp), "lost": self.lost}
+        self.sent = self.lost = 0
+        if not smp:
+            return out
+        base_up, base_down = min(h[1] for h in self.hist), min(h[2] for h in self.hist)
+        rtts = [s[1] for s in smp]
+        out.update({
+            "rtt_ms": {"last": round(rtts[-1], 2), "min": round(min(rtts), 2),
+                       "avg": round(sum(rtts) / len(rtts), 2), "max": round(max(rtts), 2)},
+            "owd_up_ms": round(smp[-1][2] - base_up, 2),           # над минимумом окна
+            "owd_down_ms": round(smp[-1][3] - base_down, 2),
+            "up_trend_ms_s": self._slope([(s[0], s[2]) for s in smp]),
+            "down_trend_ms_s": self._slope([(s[0], s[3]) for s in smp]),
+            # сами замеры: [с от начала отчёта, rtt, туда, обратно] (односторонние — над минимумом окна)
+            "samples": [[round(s[0] - smp[0][0], 3), round(s[1], 2), round(s[2] - base_up, 2),
+                         round(s[3] - base_down, 2)] for s in smp],
+        })
+        return out
+
+class NatKeepalive:
+    """
+    Держит NAT-привязку фиксированного --source-port, пока путь простаивает (вес 0 или выключен —
+    ristsender молчит): если к серверу ничего не уходило interval секунд, уходит крошечный T_PROBE
+    (kind 4), и путь по возвращении сразу несёт трафик — без новой привязки и рукопожатия RIST.
+    Ответчик (relay_rx.py / udp_echo.py) возвращает адрес:порт, с которого нас видит: сменился порт
+    после паузы g, за которую уходили только keepalive, — привязка живёт меньше g. В режиме auto
+    пауза удваивается, пока привязка её переживает, потом двоичный поиск между дольшей пережитой
+    (good) и кратчайшей непережитой (bad); в работе — good * safety. Нет ответов — фиксированный START.
+    """
+    START = 15.0  # UDP-таймауты CGNAT обычно 30..120 с — начинаем с запасом
+
+    def __init__(self, spec, lo_s=5.0, hi_s=300.0, safety=0.7, timeout_s=5.0):
+        self.fixed = None if spec == "auto" else float(spec)
+        self.lo, self.hi, self.safety, self.timeout = lo_s, hi_s, safety, timeout_s
+        self.id = random.getrandbits(32)
+        self.seq = 0
+        self.good, self.bad = 0.0, None  # пауза (с), которую привязка пережила / не пережила
+        self.mapping = None              # (ip, port) снаружи NAT по последнему ответу
+        self.last_tx = -1.0              # monotonic последнего keepalive
+        self.pending = {}                # seq -> (monotonic отправки, пауза или None, если до неё был трафик)
+        self.answered = False
+        self.sent = self.bytes_up = self.bytes_down = self.lost = self.changes = self.reconnects = 0
+
+    def learning(self) -> bool:
+        if self.fixed is not None:
+            return False
+        if self.bad is None:
+            return self.good < self.hi
+        return self.bad - self.good > max(2.0, 0.1 * self.good)
+
+    def interval(self) -> float:
+        if self.fixed is not None:
+            return self.fixed
+        if not self.learning():
+            return max(self.lo, self.good * self.safety)
+        if self.bad is None:
+            return min(self.hi, max(self.START, self.good * 2))
+        return max(self.lo, (self.good + self.bad) / 2)
+
+    def make(self, mono, last_up):
+        """Keepalive; last_up — monotonic последней отправки к серверу (любой)."""
+        self.seq = (self.seq + 1) & 0xFFFFFFFF
+        # пауза учится, только если до неё уходил лишь наш же keepalive: трафик мог сменить привязку сам
+        self.pending[self.seq] = (mono, mono - last_up if last_up == self.last_tx else None)
+        self.last_tx = mono
+        for s in [s for s, t in self.pending.items() if mono - t[0] > self.timeout]:
+            del self.pending[s]
+            self.lost += 1
+            if not self.answered and self.lost >= 3 and self.fixed is None:
+                self.fixed = self.START
+                print(f"[KA] no responder on the server side: fixed interval {self.START:g} s", flush=True)
+        pkt = PROBE_HDR.pack(T_PROBE, P_KA, self.id, self.seq, time.time_ns())
+        self.sent += 1
+        self.bytes_up += len(pkt) + 28  # + IPv4/UDP
+        return pkt
+
+    def on_ack(self, pkt, mono) -> bool:
+        """True — квитанция наша, False — чужая."""
+        if len(pkt) < KA_ACK.size or pkt[1] != P_KA_ACK:
+            return False
+        _, _, pid, seq, _, ip, port = KA_ACK.unpack_from(pkt)
+        if pid != self.id:
+            return False
+        self.bytes_down += len(pkt) + 28
+        sent = self.pending.pop(seq, None)
+        if sent is None:
+            return True
+        self.answered = True
+        prev, self.mapping = self.mapping, (socket.inet_ntoa(ip), port)
+        pause = sent[1]
+        if prev is None or pause is None:
+            return True
+        if prev == self.mapping:
+            self.good = max(self.good, pause)
+            if self.bad is not None and self.bad <= self.good:
+                self.bad = None  # таймаут NAT вырос — ищем заново вверх
+            return True
+        if prev[0] != self.mapping[0]:
+            self.reconnects += 1  # другой внешний адрес — переподключение модема, а не таймаут
+            print(f"[KA] external address {prev[0]} -> {self.mapping[0]}", flush=True)
+            return True
+        self.changes += 1
+        self.bad = pause if self.bad is None else min(self.bad, pause)
+        if self.good >= self.bad:
+            self.good = self.bad / 2  # таймаут NAT сократился — выученное больше не верно
+        print(f"[KA] NAT mapping :{prev[1]} -> :{self.mapping[1]} after {pause:.1f} s idle; "
+              f"next interval {self.interval():.1f} s", flush=True)
+        return True
+
+    def report(self, interval_s) -> dict:
+        out = {"mode": "fixed" if self.fixed is not None else "auto", "interval_s": round(self.interval(), 1),
+               "learning": self.learning(), "survived_s": round(self.good, 1),
+               "expired_s": round(self.bad, 1) if self.bad is not None else None,
+               "mapping": f"{self.mapping[0]}:{self.mapping[1]}" if self.mapping else None,
+               "sent": self.sent, "lost": self.lost, "bytes_up": self.bytes_up, "bytes_down": self.bytes_down,
+               "overhead_bps": round((self.bytes_up + self.bytes_down) * 8 / interval_s, 1),
+               "mapping_changes": self.changes, "reconnects": self.reconnects}
+        self.sent = self.lost = self.bytes_up = self.bytes_down = 0
+        return out
+
+def write_stats(path, data):
+    """tmp + rename: читатель (UI, скрипты) не увидит полузаписанный JSON."""
+    try:
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(path + ".tmp", path)
+    except OSError as e:
+        print(f"[WARN] stats {path}: {e}", file=sys.stderr)
 
 def main():
     ap = argparse.ArgumentParser()
@@ -8,8 +366,59 @@ def main():
     ap.add_argument("--server", required=True, help="Server IP, e.g. 83.222.26.3")
     ap.add_argument("--server-port", type=int, default=8000)
     ap.add_argument("--source-port", type=int, required=True, help="FIXED local source port for upstream")
-    ap.add_argument("--idle-timeout", type=int, default=600)
+    ap.add_argument("--idle-timeout", type=int, default=600, help="unused, kept for compatibility (see --keepalive)")
+    ap.add_argument("--cpus", help="CPU affinity, e.g. 3 or 2-3")
+    ap.add_argument("--nice", type=int, help="nice value, e.g. -5")
+    ap.add_argument("--sched", choices=["fifo", "rr"], help="real-time scheduling class (needs CAP_SYS_NICE)")
+    ap.add_argument("--rt-priority", type=int, default=10)
+    ap.add_argument("--bandwidth-kbps", type=int, default=0,
+                    help="path bandwidth (as ristsender bandwidth=); enables pacing, 0 = off")
+    ap.add_argument("--pace-factor", type=float, default=1.25, help="pacing rate = bandwidth * factor (room for retransmits)")
+    ap.add_argument("--pace-burst-ms", type=float, default=10.0, help="bucket depth in ms of pacing rate")
+    ap.add_argument("--pace-queue-ms", type=float, default=150.0, help="drop packets that would queue longer")
+    ap.add_argument("--fec", help="XOR FEC LxD (row length x rows, e.g. 10x5; 10 = rows only); "
+                                  "server must run relay_rx.py. Overhead 1/L + 1/D")
+    ap.add_argument("--fec-flush-ms", type=float, default=20.0, help="close a partial FEC block after this idle time")
+    ap.add_argument("--path-id", type=int, default=0, help="1..255: frame traffic for mirroring (server must run relay_rx.py)")
+    ap.add_argument("--iface", help="this path's modem, e.g. modem1 (for health-based peer choice)")
+    ap.add_argument("--mirror-port", type=int, help="127.0.0.1 port accepting copies from other relays")
+    ap.add_argument("--mirror-peers", help="candidate second paths id:iface:mirror_port,..., e.g. 2:modem2:9102,3:modem3:9103")
+    ap.add_argument("--mirror-ctl", default="/run/rist-mirror", help="runtime switch file: off | on | on <id>")
+    ap.add_argument("--health-file", default="/run/rist-modems/rist-modems.json")
+    ap.add_argument("--probe-ms", type=float, default=0,
+                    help="in-band latency probe period on the data socket, e.g. 200; responder: relay_rx.py / udp_echo.py")
+    ap.add_argument("--probe-target", help="responder ip:port if not the server itself (same source port is used)")
+    ap.add_argument("--probe-window-s", type=float, default=60.0, help="window for one-way delay baselines")
+    ap.add_argument("--keepalive", default="0",
+                    help="NAT keepalive while the path is idle: seconds, or auto = learn the NAT timeout "
+                         "(server must run relay_rx.py / udp_echo.py); 0 = off")
+    ap.add_argument("--keepalive-max-s", type=float, default=300.0, help="upper bound for the learned idle gap")
+    ap.add_argument("--stats-interval", type=float, default=10.0)
+    ap.add_argument("--stats-file", help="JSON with pacing/FEC stats, e.g. /run/rist-proxy-m0.json")
     args = ap.parse_args()
+    sched = apply_sched(args)
+
+    fec = None
+    if parse_fec(args.fec):
+        L, D = parse_fec(args.fec)
+        fec = FecEncoder(L, D)
+        sched += f"; fec {L}x{D} overhead {100.0 / L + (100.0 / D if D else 0):.0f}%"
+    mirror = Mirror(args) if args.path_id else None
+    if mirror:
+        sched += f"; path id {args.path_id}, mirror peers {[p[0] for p in mirror.peers]}"
+
+    pacer = None
+    if args.bandwidth_kbps > 0:
+        rate = args.bandwidth_kbps * args.pace_factor
+        pacer = Pacer(rate, rate * 1000 / 8.0 * args.pace_burst_ms / 1000.0, args.pace_queue_ms)
+        sched += f"; pacing {rate:.0f} kbps burst {pacer.burst} B max queue {args.pace_queue_ms:g} ms"
+    prober = LatencyProbe(args.probe_ms, args.probe_window_s) if args.probe_ms > 0 else None
+    if prober:
+        sched += f"; latency probes every {args.probe_ms:g} ms to {args.probe_target or 'server'}"
+    ka = None
+    if args.keepalive not in ("0", "off", ""):
+        ka = NatKeepalive(args.keepalive, hi_s=args.keepalive_max_s)
+        sched += f"; keepalive {args.keepalive}" + (f" (start {ka.interval():g} s)" if ka.fixed is None else " s")
 
     # сокет приема от ristsender (VIP:8000)
     in_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
@@ -31,31 +440,166 @@ def main():
         print(f"[ERR] upstream bind/connect (srcport={args.source_port}): {e}", file=sys.stderr)
         sys.exit(1)
 
-    last_io = time.time()
-    print(f"[OK] listen {args.vip}:{args.listen_port}  ->  {args.server}:{args.server_port}  (fixed srcport {args.source_port})", flush=True)
+    # пробы — с того же исходного порта; к другому ответчику — отдельный сокет на тот же порт
+    probe_sock = up_sock
+    if prober and args.probe_target:
+        host, _, port = args.probe_target.rpartition(":")
+        probe_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        probe_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        try:
+            probe_sock.bind(("0.0.0.0", args.source_port))
+            probe_sock.connect((host, int(port)))
+        except OSError as e:
+            print(f"[ERR] probe socket to {args.probe_target} (srcport={args.source_port}): {e}", file=sys.stderr)
+            sys.exit(1)
+
+    mirror_sock = None
+    if args.mirror_port:
+        mirror_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            mirror_sock.bind(("127.0.0.1", args.mirror_port))
+        except OSError as e:
+            print(f"[ERR] bind mirror port {args.mirror_port}: {e}", file=sys.stderr)
+            sys.exit(1)
+
+    print(f"[OK] listen {args.vip}:{args.listen_port}  ->  {args.server}:{args.server_port}  (fixed srcport {args.source_port}); {sched}", flush=True)
 
     # буфер последнего отправителя локально (VIP←→ristsender)
     last_local_peer = None
+    probe_peer = None  # отправитель проб ёмкости (entrypoint) — квитанции ему, не ristsender
+    PROBE_B = bytes([T_PROBE])
+    next_stats = time.monotonic() + args.stats_interval
+    next_refresh = 0.0
+    relayed = 0
+    last_up = time.monotonic()  # последняя отправка к серверу: простой пути — для keepalive
+
+    def send_up(datagrams, mono, own=True):
+        """В сторону сервера: через pacer (если включён) или сразу; свои — с копией, если зеркалим."""
+        nonlocal last_up
+        if mirror and own:
+            datagrams, copies = mirror.wrap(datagrams)
+            mirror.send_copies(copies)
+        if not pacer:
+            for d in datagrams:
+                up_sock.send(d)
+            last_up = mono
+            return
+        for d in datagrams:
+            pacer.push(d, mono)
+        for d in pacer.pop_ready(mono):
+            up_sock.send(d)
+            last_up = mono
 
     while True:
-        rlist, _, _ = select.select([in_sock, up_sock], [], [], 1.0)
+        timeout = 1.0
+        mono = time.monotonic()
+        if pacer:
+            due = pacer.next_due(mono)
+            if due is not None:
+                timeout = min(timeout, due)
+        if fec and fec.count:
+            timeout = min(timeout, max(0.0, args.fec_flush_ms / 1000.0 - fec.idle_for(mono)))
+        if prober:
+            timeout = min(timeout, max(0.0, prober.next_at - mono))
+        if ka:
+            timeout = min(timeout, max(0.0, last_up + ka.interval() - mono))
+        socks = [in_sock, up_sock] + ([mirror_sock] if mirror_sock else []) + ([probe_sock] if probe_sock is not up_sock else [])
+        rlist, _, _ = select.select(socks, [], [], timeout)
         now = time.time()
-        if not rlist and now - last_io > args.idle_timeout:
-            # держим сессию живой: можно отправлять keepalive, если нужно
-            last_io = now
-            continue
+        mono = time.monotonic()
+        if mirror and mono >= next_refresh:
+            next_refresh = mono + 1.0
+            mirror.refresh()
+        if pacer:
+            for data in pacer.pop_ready(mono):
+                up_sock.send(data)
+                last_up = mono
+        if fec and fec.count and fec.idle_for(mono) >= args.fec_flush_ms / 1000.0:
+            send_up(fec.flush(), mono)
+        if prober and mono >= prober.next_at:
+            try:
+                probe_sock.send(prober.make(mono))  # мимо pacer: меряем путь, а не свою очередь
+                if probe_sock is up_sock:
+                    last_up = mono
+            except OSError:
+                pass  # модем без адреса — проба засчитается потерянной
+        if ka and mono - last_up >= ka.interval():
+            # путь простаивает: держим NAT-привязку --source-port, мимо pacer
+            try:
+                up_sock.send(ka.make(mono, last_up))
+            except OSError:
+                pass  # модем без адреса — keepalive засчитается потерянным
+            last_up = mono
+        if (pacer or fec or mirror or mirror_sock or prober or ka) and mono >= next_stats:
+            next_stats = mono + args.stats_interval
+            st = {"vip": args.vip, "at": round(now, 3), "interval_s": args.stats_interval}
+            if pacer:
+                st.update({
+                    "rate_kbps": round(pacer.rate * 8 / 1000), "burst_bytes": pacer.burst,
+                    "sent": pacer.sent, "sent_kbps": round(pacer.sent_bytes * 8 / 1000 / args.stats_interval),
+                    "delayed": pacer.delayed, "drops": pacer.drops,
+                    "qdelay_avg_ms": round(1000 * pacer.delay_sum / pacer.sent, 2) if pacer.sent else 0.0,
+                    "qdelay_max_ms": round(1000 * pacer.delay_max, 2),
+                    "queue_ms": round(pacer.queue_ms(), 2),
+                })
+                print(f"[PACE] {st['sent_kbps']} kbps, delayed {st['delayed']}/{st['sent']}, "
+                      f"qdelay avg {st['qdelay_avg_ms']} ms max {st['qdelay_max_ms']} ms, drops {st['drops']}", flush=True)
+                pacer.reset_stats()
+            if fec:
+                st["fec"] = {"L": fec.L, "D": fec.D, "data": fec.data, "parity": fec.parity}
+                print(f"[FEC] data {fec.data} parity {fec.parity}", flush=True)
+                fec.data = fec.parity = 0
+            if mirror:
+                st["mirror"] = {"want": mirror.want, "via": mirror.via[0] if mirror.via else None, "copies": mirror.copies}
+                print(f"[MIRROR] via {st['mirror']['via']}, copies sent {mirror.copies}", flush=True)
+                mirror.copies = 0
+            if mirror_sock:
+                st["mirror_relayed"] = relayed
+                relayed = 0
+            if prober:
+                lat = st["latency"] = prober.report(mono)
+                if "rtt_ms" in lat:
+                    print(f"[LAT] rtt avg {lat['rtt_ms']['avg']} min {lat['rtt_ms']['min']} max {lat['rtt_ms']['max']} ms, "
+                          f"one-way up +{lat['owd_up_ms']} ms (trend {lat['up_trend_ms_s']} ms/s) "
+                          f"down +{lat['owd_down_ms']} ms, lost {lat['lost']}/{lat['sent']}", flush=True)
+                else:
+                    print(f"[LAT] no replies ({lat['sent']} probes sent)", flush=True)
+            if ka:
+                k = st["keepalive"] = ka.report(args.stats_interval)
+                print(f"[KA] interval {k['interval_s']} s ({k['mode']}{', learning' if k['learning'] else ''}; "
+                      f"survived {k['survived_s']} s, expired {k['expired_s'] or '-'} s), sent {k['sent']}, "
+                      f"overhead {k['overhead_bps']} bps, mapping {k['mapping']}", flush=True)
+            if args.stats_file:
+                write_stats(args.stats_file, st)
 
         for s in rlist:
-            if s is in_sock:
+            if s is mirror_sock:
+                # копия чужого пути: уже в кадре, только отправить своим модемом
+                send_up([mirror_sock.recv(65535)], mono, own=False)
+                relayed += 1
+            elif s is in_sock:
                 data, peer = in_sock.recvfrom(65535)
+                if data[:1] == PROBE_B:
+                    # проба меряет сам путь: мимо FEC/зеркала/pacer
+                    probe_peer = peer
+                    up_sock.send(data)
+                    last_up = mono
+                    continue
                 last_local_peer = peer  # куда возвращать ответы
-                up_sock.send(data)
-                last_io = now
+                send_up(fec.wrap(data, mono) if fec else [data], mono)
             else:
-                data = up_sock.recv(65535)
-                if last_local_peer:
+                try:
+                    data = s.recv(65535)
+                except OSError:
+                    continue  # ICMP port unreachable: сервер или ответчик проб не слушает
+                if data[:1] == PROBE_B and ((prober and prober.on_ack(data, mono)) or (ka and ka.on_ack(data, mono))):
+                    continue
+                if s is probe_sock and s is not up_sock:
+                    continue
+                if data[:1] == PROBE_B and probe_peer:
+                    in_sock.sendto(data, probe_peer)
+                elif last_local_peer:
                     in_sock.sendto(data, last_local_peer)
-                    last_io = now
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,5 @@
+import os, sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# entrypoint.py — из корня, relay_proto / udp_proxy — из host/ (как их запускают на хосте)
+sys.path[:0] = [ROOT, os.path.join(ROOT, "host")]
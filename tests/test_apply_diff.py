@@ -0,0 +1,32 @@
+import copy
+
+import entrypoint as ep
+
+
+def _specs(cfg):
+    st = ep.Stream("main")
+    st.cfg = cfg
+    return ep.desired_specs(st)
+
+
+def _changed(a, b):
+    return sorted(k for k in a if a[k] != b[k])
+
+
+def test_only_changed_process_differs(tmp_path, monkeypatch):
+    monkeypatch.setattr(ep, "PROBE_CACHE_PATH", str(tmp_path / "probe.json"))
+    cfg = {"video": {"bitrate_kbps": 4000, "maxrate_kbps": 4000, "bufsize_kbps": 8000, "gop": 60},
+           "rist": {"senders": [{"cname": "m0"}, {"cname": "m1"}]}}
+    base = _specs(cfg)
+
+    live = copy.deepcopy(cfg)
+    live.update(ui={"title": "x"}, supervisor={"stall_sec": 9}, quarantine={"enable": True})
+    assert _changed(base, _specs(live)) == []  # секции, читаемые на лету, без перезапуска
+
+    w = copy.deepcopy(cfg)
+    w["rist"]["senders"][1]["weight"] = 9
+    assert _changed(base, _specs(w)) == ["rist"]
+
+    v = copy.deepcopy(cfg)
+    v["video"]["bitrate_kbps"] = 6000
+    assert "ffmpeg" in _changed(base, _specs(v)) and "rist" not in _changed(base, _specs(v))
@@ -0,0 +1,61 @@
+import os, socket, subprocess, sys
+
+import pytest
+
+import entrypoint as ep
+
+ECHO = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "host", "udp_echo.py")
+
+
+def _free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture
+def echo():
+    procs = []
+
+    def start(*args):
+        port = _free_port()
+        p = subprocess.Popen([sys.executable, ECHO, "--listen", f"127.0.0.1:{port}", *args],
+                             stdout=subprocess.PIPE, text=True)
+        procs.append(p)
+        assert p.stdout.readline().startswith("[OK]")
+        return f"127.0.0.1:{port}"
+    yield start
+    for p in procs:
+        p.kill()
+        p.wait()
+
+
+def _params(target, **kw):
+    return {**{k: v for k, v in ep._bw_cfg({}).items() if k in
+               ("min_kbps", "max_kbps", "steps", "pkt_size", "loss_pct", "rtt_inflation_ms")},
+            "steps": 4, "step_sec": 0.25, "min_kbps": 500, "max_kbps": 8000, "target": target, **kw}
+
+
+def test_probe_finds_emulated_uplink(echo):
+    res = ep.bw_probe_run(_params(echo("--rate-kbps", "2000", "--buffer-ms", "100")))
+    assert res["ok"] and res["limited_by"] == "path"
+    assert 1000 <= res["capacity_kbps"] <= 2600
+
+
+def test_probe_capped_by_max_kbps(echo):
+    res = ep.bw_probe_run(_params(echo(), steps=2, max_kbps=1000))
+    assert res["ok"] and res["limited_by"] == "max_kbps"
+
+
+def test_probe_without_responder():
+    res = ep.bw_probe_run(_params(f"127.0.0.1:{_free_port()}", steps=1))
+    assert not res["ok"] and res["error"].startswith("no reply")
+
+
+def test_path_bandwidth_precedence(monkeypatch):
+    monkeypatch.setattr(ep, "_bw_cache", {"m0": {"kbps": 3000, "target": "10.255.0.1:8000"}})
+    cfg = {"rist": {"bandwidth_kbps": 9000, "bw_probe": {"enable": True}}}
+    assert ep.path_bandwidth(cfg, 0, {"cname": "m0", "bandwidth_kbps": 5000}) == 5000
+    assert ep.path_bandwidth(cfg, 0, {"cname": "m0"}) == 3000
+    assert ep.path_bandwidth(cfg, 0, {"cname": "m0", "virt_ip": "10.255.9.9"}) == 9000  # замер другого пути
+    assert ep.path_bandwidth({"rist": {"bandwidth_kbps": 9000}}, 0, {"cname": "m0"}) == 9000
@@ -0,0 +1,58 @@
+import glob, gzip, os, time
+
+import pytest
+
+import entrypoint as ep
+
+
+@pytest.fixture
+def name(monkeypatch):
+    # ChildLog пишет в /data/logs/<name>.log — своё имя и уборка за собой
+    n = f"pytest-{os.getpid()}-{time.monotonic_ns()}"
+    monkeypatch.setattr(ep, "child_logs", {})
+    yield n
+    for p in glob.glob(f"/data/logs/{n}.log*"):
+        os.remove(p)
+
+
+def _lc(**kw):
+    return {**ep._log_cfg({}), **kw}
+
+
+def _wait_archived(lf):
+    for _ in range(200):
+        if not lf._rot_q:
+            return
+        time.sleep(0.01)
+    raise AssertionError("archive worker stuck")
+
+
+def test_rotation_archives_in_background(name):
+    lf = ep.ChildLog(name, _lc(child_max_mb=0.001, child_backups=2, buffer_kb=0, max_lines_per_sec=0))
+    for i in range(100):
+        lf.write(f"line {i:04d} {'x' * 40}\n".encode())
+        _wait_archived(lf)
+    lf.users = 1
+    lf.close()
+    assert lf.stats["rotations"] >= 3
+    assert sorted(os.path.basename(p) for p in glob.glob(f"/data/logs/{name}.log*")) == \
+        [f"{name}.log", f"{name}.log.1.gz", f"{name}.log.2.gz"]
+    with gzip.open(f"/data/logs/{name}.log.1.gz") as f:
+        assert f.read().startswith(b"line ")
+
+
+def test_rate_limit_and_repeats(name):
+    lf = ep.ChildLog(name, _lc(max_lines_per_sec=1, burst_lines=2))
+    assert [lf.write(b"a\n"), lf.write(b"a\n"), lf.write(b"b\n"), lf.write(b"c\n")] == [True, False, True, False]
+    assert lf.stats["repeated"] == 1 and lf.stats["rate_limited"] == 1
+
+
+def test_namesakes_share_one_log(name):
+    a = ep.open_child_log(name, _lc())
+    b = ep.open_child_log(name, _lc())  # новый ristsender при живом старом
+    assert a is b and a.users == 2
+    a.close()
+    assert a._f is not None  # второй ещё пишет
+    b.close()
+    assert a._f is None
+    assert ep.open_child_log(name, _lc()) is not a
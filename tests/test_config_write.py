@@ -0,0 +1,21 @@
+import yaml
+
+import entrypoint as ep
+
+
+def test_write_cfg_replaces_whole_file(tmp_path, monkeypatch):
+    path = tmp_path / "config.yml"
+    monkeypatch.setattr(ep, "CONFIG_PATH", str(path))
+    ep.write_cfg({"rist": {"senders": [{"cname": "m0", "weight": 7}]}})
+    assert yaml.safe_load(path.read_text())["rist"]["senders"][0]["weight"] == 7
+    ep.write_cfg("video:\n  preset: fast\n")
+    assert yaml.safe_load(path.read_text()) == {"video": {"preset": "fast"}}
+    assert [p.name for p in tmp_path.iterdir()] == ["config.yml"]  # без остатков .tmp
+
+
+def test_status_serves_applied_config(tmp_path, monkeypatch):
+    # /status не читает config.yml: файла нет, пути — из применённого конфига
+    monkeypatch.setattr(ep, "CONFIG_PATH", str(tmp_path / "missing.yml"))
+    monkeypatch.setattr(ep, "current_cfg", {"rist": {"senders": [{"cname": "m0", "weight": 3}]}})
+    paths = ep.app.test_client().get("/status").get_json()["paths"]
+    assert [(p["cname"], p["weight"], p["stream"]) for p in paths] == [("m0", 3, "main")]
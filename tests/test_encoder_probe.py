@@ -0,0 +1,45 @@
+import json, os, stat
+
+import entrypoint as ep
+
+
+def _cfg(preset="auto", **video):
+    return {"video": {"preset": preset, **video}}
+
+
+def test_resolve_preset_explicit_and_fallback(tmp_path, monkeypatch):
+    monkeypatch.setattr(ep, "PROBE_CACHE_PATH", str(tmp_path / "probe.json"))
+    assert ep.resolve_preset(_cfg("faster")) == "faster"
+    assert ep.resolve_preset(_cfg()) == "veryfast"  # без замера
+
+
+def test_resolve_preset_uses_cache_for_same_settings(tmp_path, monkeypatch):
+    path = tmp_path / "probe.json"
+    monkeypatch.setattr(ep, "PROBE_CACHE_PATH", str(path))
+    key, _ = ep._probe_settings(_cfg())
+    path.write_text(json.dumps({key: {"chosen": "fast"}}))
+    assert ep.resolve_preset(_cfg()) == "fast"
+    # другие настройки видео — другой ключ, снова veryfast до пробы
+    assert ep.resolve_preset(_cfg(bitrate_kbps=6000)) == "veryfast"
+
+
+def test_ensure_encoder_probe_queues_once_per_key(tmp_path, monkeypatch):
+    monkeypatch.setattr(ep, "PROBE_CACHE_PATH", str(tmp_path / "probe.json"))
+    monkeypatch.setattr(ep, "_probe_tried", set())
+    queued = []
+    monkeypatch.setattr(ep, "submit_job", lambda kind, fn: queued.append(kind))
+    ep.ensure_encoder_probe(_cfg())
+    ep.ensure_encoder_probe(_cfg())
+    ep.ensure_encoder_probe(_cfg("veryfast"))
+    assert queued == ["probe_encoder"]
+
+
+def test_probe_one_survives_noisy_stderr(tmp_path, monkeypatch):
+    # ffmpeg, пишущий в stderr больше буфера пайпа: раньше wait4 до чтения stderr зависал
+    fake = tmp_path / "ffmpeg"
+    fake.write_text('#!/bin/sh\nhead -c 1000000 /dev/zero | tr "\\000" x >&2\nexit 1\n')
+    fake.chmod(fake.stat().st_mode | stat.S_IEXEC)
+    monkeypatch.setenv("PATH", f"{tmp_path}{os.pathsep}{os.environ['PATH']}")
+    _, st = ep._probe_settings(_cfg())
+    r = ep._probe_one(st, "veryfast")
+    assert r["ok"] is False and r["error"].endswith("x")
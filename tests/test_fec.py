@@ -0,0 +1,74 @@
+import random
+
+import pytest
+
+from relay_proto import FecDecoder, FecEncoder, parse_fec
+
+
+def _payloads(n, seed=1):
+    rnd = random.Random(seed)
+    # разной длины, с нулями в хвосте — длина восстанавливается по len_xor
+    return [bytes(rnd.randrange(256) for _ in range(rnd.randrange(1, 300))) + b"\0" * (i % 3) for i in range(n)]
+
+
+def _send(enc, payloads):
+    wire = [d for p in payloads for d in enc.wrap(p, now=0.0)]
+    return wire + enc.flush()
+
+
+def _data_index(wire):
+    return [i for i, d in enumerate(wire) if d[0] == 0xFC]
+
+
+def test_parse_fec():
+    assert parse_fec("10x5") == (10, 5) and parse_fec("10") == (10, 0)
+    assert parse_fec("") is None and parse_fec(0) is None
+    with pytest.raises(ValueError):
+        parse_fec("1x5")
+
+
+def test_row_fec_recovers_one_loss_per_row():
+    src = _payloads(500)
+    wire = _send(FecEncoder(10), src)
+    data = _data_index(wire)
+    rnd = random.Random(2)
+    lost = {data[r * 10 + rnd.randrange(10)] for r in rnd.sample(range(50), 20)}
+    dec = FecDecoder()
+    got = [p for i, d in enumerate(wire) if i not in lost for p in dec.feed(d)]
+    assert sorted(got) == sorted(src)
+    assert dec.stats()["recovered"] == 20 and dec.stats()["dup"] == 0
+
+
+def test_2d_fec_recovers_burst_of_a_whole_row():
+    src = _payloads(100)
+    wire = _send(FecEncoder(10, 5), src)
+    data = _data_index(wire)
+    lost = set(data[20:30])  # 10 подряд — строка не спасёт, столбцы спасают
+    dec = FecDecoder()
+    got = [p for i, d in enumerate(wire) if i not in lost for p in dec.feed(d)]
+    assert sorted(got) == sorted(src) and dec.recovered == 10
+
+
+def test_flush_protects_partial_block():
+    src = _payloads(7)
+    wire = _send(FecEncoder(10, 5), src)
+    dec = FecDecoder()
+    got = [p for d in wire[1:] for p in dec.feed(d)]
+    assert sorted(got) == sorted(src)
+
+
+def test_raw_passthrough_and_duplicates():
+    enc, dec = FecEncoder(4), FecDecoder()
+    assert dec.feed(b"\x80rtp") == [b"\x80rtp"]
+    d = enc.wrap(b"abc")[0]
+    assert dec.feed(d) == [b"abc"] and dec.feed(d) == []
+    assert dec.stats()["raw"] == 1 and dec.stats()["dup"] == 1
+
+
+def test_sender_restart_resets_window():
+    dec = FecDecoder(window=16)
+    enc = FecEncoder(4)
+    for _ in range(100):
+        for d in enc.wrap(b"x"):
+            dec.feed(d)
+    assert dec.feed(FecEncoder(4).wrap(b"new")[0]) == [b"new"] and dec.resets == 1
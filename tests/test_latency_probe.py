@@ -0,0 +1,38 @@
+from relay_proto import LAT_ACK, PROBE_HDR, P_LAT_ACK, T_PROBE, probe_ack
+from udp_proxy import LatencyProbe
+
+
+def _ack(probe_pkt, up_ms):
+    # ответчик «принял» пробу через up_ms по часам отправителя
+    _, _, pid, seq, t_tx = PROBE_HDR.unpack_from(probe_pkt)
+    return LAT_ACK.pack(T_PROBE, P_LAT_ACK, pid, seq, t_tx, t_tx + int(up_ms * 1e6))
+
+
+def test_rtt_and_rising_uplink_queue():
+    lp = LatencyProbe(1000)
+    for i in range(5):
+        pkt = lp.make(float(i))
+        assert lp.on_ack(_ack(pkt, 20 + 10 * i), i + 0.05)
+    r = lp.report(5.0)
+    assert (r["sent"], r["received"], r["lost"]) == (5, 5, 0)
+    assert r["rtt_ms"]["avg"] == 50.0
+    assert r["owd_up_ms"] == 40.0 and r["up_trend_ms_s"] == 10.0  # очередь на аплинке растёт
+    assert [s[2] for s in r["samples"]] == [0.0, 10.0, 20.0, 30.0, 40.0]
+    assert lp.report(6.0)["received"] == 0  # выборка — с прошлого отчёта
+
+
+def test_lost_and_late_acks():
+    lp = LatencyProbe(500, timeout_s=2.0)
+    first = lp.make(0.0)
+    lp.make(3.0)  # первая ждёт дольше timeout — потеряна
+    assert lp.on_ack(_ack(first, 10), 3.1) and lp.samples == []  # опоздавшая: наша, но не в выборку
+    assert lp.report(4.0)["lost"] == 1
+
+
+def test_foreign_acks_are_not_taken():
+    lp = LatencyProbe(1000)
+    pkt = lp.make(0.0)
+    other = LatencyProbe(1000).make(0.0)
+    assert not lp.on_ack(_ack(other, 5), 0.1)
+    assert not lp.on_ack(probe_ack(PROBE_HDR.pack(T_PROBE, 0, 1, 1, 0)), 0.1)  # квитанция пробы ёмкости
+    assert lp.on_ack(probe_ack(pkt), 0.1) and len(lp.samples) == 1
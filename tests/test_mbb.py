@@ -0,0 +1,36 @@
+import entrypoint as ep
+
+
+def _cfg(**s1):
+    return {"rist": {
+        "swap_mode": "make_before_break",
+        "mbb": {"ports": [10100, 10101]},
+        "senders": [
+            {"cname": "m0", "virt_ip": "10.255.0.1", "mbb_virt_ip": "10.255.1.1", "port": 8000},
+            {"cname": "m1", "virt_ip": "10.255.0.2", "port": 8000, **s1},
+        ],
+    }}
+
+
+def _outs(argv):
+    return [argv[i + 1].split("?")[0] for i, a in enumerate(argv) if a == "-o"]
+
+
+def test_alt_port_sends_to_spare_vips():
+    cfg = _cfg(mbb_virt_ip="10.255.1.2", mbb_port=8100)
+    assert _outs(ep.build_rist_cmd_single(cfg, 10100)[0]) == ["rist://10.255.0.1:8000", "rist://10.255.0.2:8000"]
+    assert _outs(ep.build_rist_cmd_single(cfg, 10101)[0]) == ["rist://10.255.1.1:8000", "rist://10.255.1.2:8100"]
+
+
+def test_alt_only_in_make_before_break():
+    cfg = _cfg(mbb_virt_ip="10.255.1.2")
+    assert ep._mbb_alt(cfg, 10101) and not ep._mbb_alt(cfg, 10100)
+    cfg["rist"]["swap_mode"] = "restart"
+    assert not ep._mbb_alt(cfg, 10101)
+
+
+def test_mbb_missing_lists_paths_without_spare_vip():
+    assert ep._mbb_missing(_cfg()) == ["m1"]
+    assert ep._mbb_missing(_cfg(mbb_virt_ip="10.255.0.2")) == ["m1"]  # тот же VIP — не запасной
+    assert ep._mbb_missing(_cfg(mbb_virt_ip="10.255.1.2")) == []
+    assert ep._mbb_missing(_cfg(enabled=False)) == []
@@ -0,0 +1,35 @@
+from relay_proto import MIRR_HDR, T_MIRR, MirrorDedup
+
+
+def _frame(path, via, partner, seq, payload=b"ts"):
+    return MIRR_HDR.pack(T_MIRR, path, via, partner, seq) + payload
+
+
+def test_first_copy_passes_second_is_dropped():
+    md = MirrorDedup()
+    assert md.feed(_frame(1, 2, 2, 7), now=10.0) == (1, 2, b"ts")   # копия через путь 2 обогнала
+    assert md.feed(_frame(1, 1, 2, 7), now=10.03) == (1, 1, None)
+    assert md.feed(_frame(1, 1, 2, 7), now=10.05) == (1, 1, None)  # третий раз — не считаем заново
+    st = md.stats()["1->2"]
+    assert st["mirrored"] == 1 and st["dups"] == 1 and st["copy_first"] == 1
+    assert st["lead_ms_avg"] == 30.0 and st["dup_rate"] == 1.0
+
+
+def test_paths_have_separate_seq_spaces():
+    md = MirrorDedup()
+    assert md.feed(_frame(1, 1, 0, 5), now=0)[2] == b"ts"
+    assert md.feed(_frame(2, 2, 0, 5), now=0)[2] == b"ts"
+    assert md.stats() == {}  # без копии — пар нет
+
+
+def test_expired_single_copies_are_counted():
+    md = MirrorDedup(window=4)
+    for seq in range(10):
+        md.feed(_frame(1, 1, 2, seq), now=seq)   # копия по пути 2 не дошла
+    st = md.stats()["1->2"]
+    assert st["primary_only"] == 6 and st["copy_only"] == 0 and st["dup_rate"] == 0.0
+
+
+def test_foreign_frames_are_ignored():
+    md = MirrorDedup()
+    assert md.feed(b"\x80rtp") is None and md.feed(_frame(1, 1, 0, 1)[:4]) is None
@@ -0,0 +1,71 @@
+import importlib.util, json, os, struct
+
+import pytest
+
+_spec = importlib.util.spec_from_file_location(
+    "modem_health", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "host", "modem-health.py"))
+mh = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(mh)
+
+
+def _attr(atype, payload):
+    a = struct.pack("=HH", 4 + len(payload), atype) + payload
+    return a + b"\0" * (-len(a) % 4)
+
+
+def _link(iface, oper, mtype=mh.RTM_NEWLINK):
+    body = mh.IFINFOMSG.pack(0, 0, 0, 0, 0) + _attr(mh.IFLA_IFNAME, iface.encode() + b"\0") \
+        + _attr(mh.IFLA_OPERSTATE, bytes((oper,)))
+    return mh.NLMSG_HDR.pack(mh.NLMSG_HDR.size + len(body), mtype, 0, 0, 0) + body
+
+
+@pytest.fixture
+def h(tmp_path, monkeypatch):
+    monkeypatch.setattr(mh, "OUT", str(tmp_path / "rist-modems.json"))
+    monkeypatch.setattr(mh.Health, "_sysfs_oper", staticmethod(lambda iface: "down"))
+    monkeypatch.setattr(mh.Health, "_has_ipv4", staticmethod(lambda iface: True))
+    monkeypatch.setattr(mh.Health, "_ping", staticmethod(lambda src, dst: True))
+    h = mh.Health()
+    h.probed = []
+    monkeypatch.setattr(h, "probe_async", h.probed.append)
+    yield h
+    h.pool.shutdown()
+
+
+def _feed():
+    with open(mh.OUT) as f:
+        return {r["iface"]: r for r in json.load(f)}
+
+
+def test_link_up_triggers_probe_and_goes_up(h):
+    mh.handle_netlink(h, _link("modem1", 6))
+    assert h.probed == ["modem1"] and h.state["modem1"]["oper"] == "up"
+    h.probe("modem1")
+    assert _feed()["modem1"]["status"] == "up_internet"
+
+
+def test_link_down_is_immediate_without_ping(h):
+    mh.handle_netlink(h, _link("modem2", 6))
+    h.probe("modem2")
+    changed = _feed()["modem2"]["changed_at"]
+    mh.handle_netlink(h, _link("modem2", 2) + _link("modem9", 6))  # чужой интерфейс — мимо
+    st = _feed()["modem2"]
+    assert st["status"] == "down" and st["gw_ok"] == "no" and st["changed_at"] >= changed
+    assert h.probed == ["modem2"] and "modem9" not in h.state
+
+
+def test_dellink_and_batched_messages(h):
+    mh.handle_netlink(h, _link("modem1", 6) + _link("modem3", 6))
+    assert h.probed == ["modem1", "modem3"]
+    mh.handle_netlink(h, _link("modem3", 6, mtype=mh.RTM_DELLINK))
+    assert h.state["modem3"]["oper"] == "down"
+
+
+def test_feed_written_only_on_change(h):
+    h.publish()
+    m0 = os.stat(mh.OUT).st_mtime_ns
+    os.utime(mh.OUT, ns=(0, 0))
+    h.publish()
+    assert os.stat(mh.OUT).st_mtime_ns == 0 != m0
+    h.set_link("modem4", oper="up")
+    assert os.stat(mh.OUT).st_mtime_ns != 0
@@ -0,0 +1,59 @@
+from relay_proto import probe_ack
+from udp_proxy import NatKeepalive
+
+
+class Nat:
+    """Привязка живёт timeout с простоя; истекла — следующий пакет получает новый внешний порт."""
+    def __init__(self, timeout):
+        self.timeout, self.port, self.last = timeout, 40000, None
+
+    def pass_(self, mono):
+        if self.last is not None and mono - self.last > self.timeout:
+            self.port += 1
+        self.last = mono
+        return ("198.51.100.7", self.port)
+
+
+def _idle_run(ka, nat, rounds, mono=0.0):
+    for _ in range(rounds):
+        pkt = ka.make(mono, ka.last_tx)  # к серверу уходил только keepalive
+        assert ka.on_ack(probe_ack(pkt, nat.pass_(mono)), mono + 0.05)
+        mono += ka.interval()
+    return mono
+
+
+def test_auto_learns_nat_timeout_and_stays_below_it():
+    ka, nat = NatKeepalive("auto"), Nat(50.0)
+    _idle_run(ka, nat, 40)
+    assert not ka.learning() and ka.good <= 50.0 < ka.bad and ka.bad - ka.good <= 5.0
+    changes = ka.changes
+    _idle_run(ka, nat, 20, mono=nat.last + ka.interval())
+    assert ka.changes == changes and ka.interval() == ka.good * ka.safety  # в работе привязка не рвётся
+    assert ka.report(60.0)["learning"] is False
+
+
+def test_pause_after_traffic_is_not_learned():
+    ka, nat = NatKeepalive("auto"), Nat(50.0)
+    ka.on_ack(probe_ack(ka.make(0.0, -1.0), nat.pass_(0.0)), 0.05)
+    ka.on_ack(probe_ack(ka.make(100.0, 99.0), nat.pass_(100.0)), 100.05)  # ristsender слал до паузы
+    assert ka.good == 0.0 and ka.bad is None and ka.changes == 0
+
+
+def test_new_external_address_is_reconnect_not_timeout():
+    ka = NatKeepalive("auto")
+    ka.on_ack(probe_ack(ka.make(0.0, -1.0), ("198.51.100.7", 40000)), 0.05)
+    ka.on_ack(probe_ack(ka.make(15.0, ka.last_tx), ("203.0.113.9", 40000)), 15.05)
+    assert ka.reconnects == 1 and ka.bad is None
+
+
+def test_no_responder_falls_back_to_fixed_interval():
+    ka = NatKeepalive("auto", timeout_s=5.0)
+    for i in range(5):
+        ka.make(i * 15.0, ka.last_tx)
+    assert ka.fixed == NatKeepalive.START and ka.report(60.0)["mode"] == "fixed"
+
+
+def test_fixed_spec_and_foreign_acks():
+    ka = NatKeepalive("25")
+    assert ka.interval() == 25.0 and not ka.learning()
+    assert not ka.on_ack(probe_ack(NatKeepalive("auto").make(0.0, 0.0), ("198.51.100.7", 1)), 0.1)
@@ -0,0 +1,54 @@
+import os, subprocess
+
+import pytest
+
+HOST = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "host")
+DISPATCHER = os.path.join(HOST, "etc", "NetworkManager", "dispatcher.d", "90-rist-policy.sh")
+
+
+def _exe(path, body):
+    path.write_text("#!/bin/sh\n" + body)
+    path.chmod(0o755)
+
+
+@pytest.fixture
+def dispatch(tmp_path):
+    # копия диспетчера с очередью, lock и rist_policy.sh во временном каталоге
+    src = open(DISPATCHER).read().replace("/run/", f"{tmp_path}/").replace("/usr/local/bin/", f"{tmp_path}/")
+    script = tmp_path / "dispatcher.sh"
+    script.write_text(src)
+    _exe(tmp_path / "ip", 'echo "    inet 192.168.8.199/24 scope global"\n')  # IPv4 уже есть
+    _exe(tmp_path / "logger", "")
+    _exe(tmp_path / "rist_policy.sh", f'echo "$2 gw=${{IP4_GATEWAY-unset}} dev=${{DEVICE_IP_IFACE-unset}}" >>{tmp_path}/calls\n')
+
+    def run(iface, queued=(), **env):
+        (tmp_path / "rist-policy.queue").mkdir(exist_ok=True)
+        for q in queued:
+            (tmp_path / "rist-policy.queue" / q).touch()
+        subprocess.run(["bash", str(script), iface, "up"], check=True, timeout=30,
+                       env={**os.environ, "PATH": f"{tmp_path}:{os.environ['PATH']}", **env})
+        return (tmp_path / "calls").read_text().splitlines()
+    return run
+
+
+def test_own_gateway_only_for_own_interface(dispatch):
+    calls = dispatch("modem2", queued=["modem1"], IP4_GATEWAY="192.168.14.1", DEVICE_IP_IFACE="modem2")
+    assert calls == ["modem1 gw=unset dev=unset", "modem2 gw=192.168.14.1 dev=modem2"]
+
+
+def test_repeated_events_collapse(dispatch):
+    assert dispatch("modem3", queued=["modem3"]) == ["modem3 gw=unset dev=unset"]
+
+
+def test_refresh_one_ignores_foreign_gateway():
+    # тот же выбор шлюза, что в refresh_one: IP4_GATEWAY — только если событие про этот интерфейс
+    src = open(os.path.join(HOST, "rist_policy.sh")).read()
+    line = next(l.strip() for l in src.splitlines() if 'gw="${IP4_GATEWAY:-}"' in l)
+    probe = f'ifc=modem1; gw=""; {line}; echo "$gw"'
+
+    def run(**env):
+        return subprocess.run(["bash", "-c", probe], env={"PATH": os.environ["PATH"], **env},
+                              capture_output=True, text=True).stdout.strip()
+    assert run(IP4_GATEWAY="192.168.8.1", DEVICE_IP_IFACE="modem1") == "192.168.8.1"
+    assert run(IP4_GATEWAY="192.168.14.1", DEVICE_IP_IFACE="modem2") == ""
+    assert run(IP4_GATEWAY="192.168.8.1") == "192.168.8.1"
@@ -0,0 +1,33 @@
+import udp_proxy
+from udp_proxy import Pacer
+
+PKT = b"x" * 1316
+
+
+def test_burst_passes_then_paced():
+    p = Pacer(800, 4000, 50)  # 100 000 байт/с
+    t = p.t
+    assert all(p.push(PKT, t) for _ in range(3))
+    assert len(p.pop_ready(t)) == 3  # в допуске burst — сразу
+    assert p.push(PKT, t) and p.pop_ready(t) == []
+    due = p.next_due(t)
+    assert 0 < due <= 1316 / 100000.0
+    assert p.pop_ready(t + due + 1e-9) == [PKT]
+
+
+def test_rate_and_max_delay_hold_under_overload():
+    p = Pacer(800, 4000, 50)
+    t0 = p.t
+    sent = 0
+    step = len(PKT) / 100000.0 / 2  # вдвое быстрее rate
+    for i in range(600):
+        now = t0 + i * step
+        p.push(PKT, now)
+        sent += sum(map(len, p.pop_ready(now)))
+        assert p.queue_ms() <= 50.0 + 1e-6
+    assert abs(sent - 100000 * (now - t0)) <= 4000 + len(PKT)
+    assert 250 < p.drops < 350 and p.delay_max <= 0.05 + step  # задержка — с точностью до шага опроса
+
+
+def test_small_burst_is_raised_to_two_mtu():
+    assert Pacer(800, 100, 50).burst == 2 * udp_proxy.MTU
@@ -0,0 +1,72 @@
+import json
+from collections import OrderedDict, deque
+
+import pytest
+
+import entrypoint as ep
+
+
+@pytest.fixture
+def env(tmp_path, monkeypatch):
+    for name, v in (("streams", OrderedDict()), ("quarantine", {}), ("_qstate", {}),
+                    ("_quar_events", deque()), ("_quar_skipped", set()), ("_feeds", {})):
+        monkeypatch.setattr(ep, name, v)
+    jobs = []
+    monkeypatch.setattr(ep, "submit_job", lambda kind, fn: jobs.append(kind))
+    health = tmp_path / "health.json"
+    qc = ep._quar_cfg({"quarantine": {"health_file": str(health), "ui_file": str(tmp_path / "ui.json"),
+                                      "restore_stable_sec": 10.0}})
+
+    def stream(swap_mode="make_before_break", spare=True):
+        st = ep.Stream("main")
+        st.cfg = {"rist": {"swap_mode": swap_mode, "senders": [
+            {"cname": f"m{i}", "interface": f"wwan{i}", "virt_ip": f"10.255.0.{i+1}",
+             **({"mbb_virt_ip": f"10.255.1.{i+1}"} if spare else {})} for i in range(2)]}}
+        ep.streams["main"] = st
+        return st
+
+    def feed(**status):
+        health.write_text(json.dumps([{"iface": i, "status": s, "changed_at": 100.0} for i, s in status.items()]))
+        ep._feeds.clear()
+
+    return qc, stream, feed, jobs
+
+
+def test_dead_modem_quarantines_its_path(env):
+    qc, stream, feed, jobs = env
+    stream()
+    feed(wwan0="up_internet", wwan1="down")
+    ep._quarantine_tick(qc, 101.0)
+    assert list(ep.quarantine) == ["m1"] and ep.quarantine["m1"]["lost_at"] == 100.0
+    assert jobs == ["quarantine"]
+
+
+def test_last_active_path_is_kept(env):
+    qc, stream, feed, jobs = env
+    stream()
+    feed(wwan0="down", wwan1="down")
+    ep._quarantine_tick(qc, 101.0)
+    assert len(ep.quarantine) == 1  # min_active: 1
+
+
+def test_restore_after_stable_hold(env):
+    qc, stream, feed, jobs = env
+    stream()
+    feed(wwan0="up_internet", wwan1="down")
+    ep._quarantine_tick(qc, 101.0)
+    feed(wwan0="up_internet", wwan1="up_internet")
+    ep._quarantine_tick(qc, 102.0)
+    ep._quarantine_tick(qc, 105.0)
+    assert "m1" in ep.quarantine  # штраф 1 → держим 10 с
+    ep._quarantine_tick(qc, 112.5)
+    assert ep.quarantine == {} and [k for k, *_ in ep._quar_events] == ["quarantine", "restore"]
+
+
+def test_restart_mode_is_not_quarantined(env):
+    qc, stream, feed, jobs = env
+    feed(wwan0="up_internet", wwan1="down")
+    for _ in (stream("restart"), stream(spare=False)):
+        ep._quarantine_tick(qc, 101.0)
+        assert ep.quarantine == {} and jobs == []
+    ep._quarantine_tick({**qc, "allow_restart": True}, 101.0)
+    assert list(ep.quarantine) == ["m1"]
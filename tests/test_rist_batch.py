@@ -0,0 +1,53 @@
+import os, subprocess
+
+import pytest
+
+BATCH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "host", "rist_batch.sh")
+
+FAKE_IP = """#!/bin/sh
+# ip rule show / ip route show table T — из файлов, ip -batch — в журнал
+case "$*" in
+  "rule show") cat "$FAKE/rules" ;;
+  "route show table "*) cat "$FAKE/routes.$4" 2>/dev/null ;;
+  "-force -batch -") cat >>"$FAKE/batch" ;;
+esac
+"""
+
+
+@pytest.fixture
+def rb(tmp_path):
+    for name, body in (("ip", FAKE_IP), ("iptables", "#!/bin/sh\n"), ("iptables-restore", "#!/bin/sh\ncat >>\"$FAKE/ipt\"\n")):
+        p = tmp_path / name
+        p.write_text(body)
+        p.chmod(0o755)
+
+    def run(rules, routes, script):
+        (tmp_path / "rules").write_text(rules)
+        (tmp_path / "routes.101").write_text(routes)
+        env = {**os.environ, "FAKE": str(tmp_path), "PATH": f"{tmp_path}:{os.environ['PATH']}"}
+        out = subprocess.run(["bash", "-c", f"set -e; source {BATCH}; rb_begin; {script}; rb_commit"],
+                             env=env, capture_output=True, text=True, check=True).stdout
+        batch = tmp_path / "batch"
+        return out, batch.read_text().splitlines() if batch.exists() else None
+    return run
+
+
+RULES = "0:\tfrom all lookup local\n1001:\tfrom 10.0.0.1 lookup 101 \n32766:\tfrom all lookup main\n"
+ROUTES = "default via 192.168.8.1 dev modem1 \n192.168.8.0/24 dev modem1 scope link\n"
+WANT = ("rb_rules '^10[0-9][0-9] ' '1001 from 10.0.0.1 lookup 101'; "
+        "rb_routes 101 'default via 192.168.8.1 dev modem1' '192.168.8.0/24 dev modem1 scope link'")
+
+
+def test_no_changes_skip_ip_batch(rb):
+    out, batch = rb(RULES, ROUTES, WANT)
+    assert batch is None and "del=0 add=0 iptables=unchanged" in out
+
+
+def test_adds_and_replaces_go_before_deletes(rb):
+    out, batch = rb(RULES.replace("1001:\tfrom 10.0.0.1", "1001:\tfrom 10.0.0.9"),
+                    ROUTES.replace("192.168.8.1 dev", "192.168.8.254 dev"), WANT)
+    assert "del=2 add=2" in out
+    assert sorted(batch[:2]) == ["route replace default via 192.168.8.1 dev modem1 table 101",
+                                 "rule add from 10.0.0.1 lookup 101 pref 1001"]
+    assert sorted(batch[2:]) == ["route del default via 192.168.8.254 dev modem1 table 101",
+                                 "rule del from 10.0.0.9 lookup 101 pref 1001"]
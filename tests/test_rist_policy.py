@@ -0,0 +1,113 @@
+import os, shutil, subprocess
+
+import pytest
+
+HOST = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "host")
+
+# Заглушки системных утилит: состояние — файлами в $FAKE
+FAKES = {
+    "id": """case "$1" in -u) [ -z "${2:-}" ] && { echo 0; exit 0; }
+  n=$(grep -nx -- "$2" "$FAKE/users" | cut -d: -f1); [ -n "$n" ] && echo $((1000 + n)) || exit 1 ;; esac""",
+    "useradd": 'for a; do :; done; echo "$a" >>"$FAKE/users"',
+    "sysctl": "",
+    "conntrack": 'echo "$*" >>"$FAKE/conntrack"',
+    "ip": """case "$*" in
+  "addr show dev lo") cat "$FAKE/lo" 2>/dev/null ;;
+  "addr add "*) echo "    inet $3 scope host lo" >>"$FAKE/lo" ;;
+  "-4 -o addr show dev "*) echo "3: $5    inet 192.168.8.50/24 brd 192.168.8.255 scope global $5" ;;
+  "-4 route show table "*) cat "$FAKE/route.$5" 2>/dev/null || true ;;
+  "rule show") cat "$FAKE/rules" 2>/dev/null ;;
+  "route show table "*) cat "$FAKE/route.$4" 2>/dev/null || true ;;
+  "-force -batch -") cat >>"$FAKE/batch" ;;
+esac""",
+    "iptables": """case "$*" in
+  "-t mangle -N "*) grep -qx -- "$4" "$FAKE/chains" 2>/dev/null && exit 1; echo "$4" >>"$FAKE/chains" ;;
+  "-t mangle -C OUTPUT -j "*) grep -qx -- "-A OUTPUT -j $6" "$FAKE/output" 2>/dev/null ;;
+  "-t mangle -I OUTPUT 1 -j "*) echo "-A OUTPUT -j $7" >>"$FAKE/output" ;;
+  "-t mangle -S RIST_OWNER") cat "$FAKE/chain" 2>/dev/null ;;
+  *) exit 1 ;;
+esac""",
+    "iptables-restore": """while IFS= read -r l; do
+  echo "$l" >>"$FAKE/ipt"
+  case "$l" in
+    "-A RIST_OWNER "*) echo "$l" >>"$FAKE/chain" ;;
+    "-D RIST_OWNER "*) grep -vxF -- "-A ${l#-D }" "$FAKE/chain" >"$FAKE/chain.new"; mv "$FAKE/chain.new" "$FAKE/chain" ;;
+  esac
+done""",
+}
+
+RULE = '-A RIST_OWNER -m owner --uid-owner {uid} -m comment --comment "owner {user} -> {ifc}" -j MARK --set-xmark {mark}/0xffffffff'
+
+
+@pytest.fixture
+def policy(tmp_path):
+    fake, root = tmp_path / "state", tmp_path / "root"
+    fake.mkdir()
+    (root / "etc" / "sysctl.d").mkdir(parents=True)
+    (tmp_path / "bin").mkdir()
+    for name, body in FAKES.items():
+        p = tmp_path / "bin" / name
+        p.write_text("#!/bin/sh\n" + body + "\n")
+        p.chmod(0o755)
+    # копия скрипта: /etc — во временном каталоге, rist_batch.sh — рядом
+    (tmp_path / "bin" / "rist_policy.sh").write_text(open(os.path.join(HOST, "rist_policy.sh")).read()
+                                                     .replace("/etc/", f"{root}/etc/"))
+    shutil.copy(os.path.join(HOST, "rist_batch.sh"), tmp_path / "bin")
+    (fake / "users").touch()
+
+    def run(*args):
+        env = {**os.environ, "FAKE": str(fake), "PATH": f"{tmp_path / 'bin'}:{os.environ['PATH']}",
+               "RIST_POLICY_STAMP": str(tmp_path / "run" / "rist-policy.base")}
+        r = subprocess.run(["bash", str(tmp_path / "bin" / "rist_policy.sh"), *args], env=env,
+                           capture_output=True, text=True, timeout=30)
+        assert r.returncode == 0, r.stdout + r.stderr
+
+    def read(name):
+        p = fake / name
+        return p.read_text().splitlines() if p.exists() else []
+    return run, read, fake, tmp_path
+
+
+def test_only_on_fresh_host_installs_base_once(policy):
+    run, read, fake, tmp = policy
+    run("--only", "modem1")
+    assert read("users") == ["rist1", "rist2", "rist3", "rist4"]
+    assert [l.split()[1] for l in read("lo")] == ["10.255.0.1/32", "10.255.0.2/32", "10.255.0.3/32", "10.255.0.4/32"]
+    assert read("output") == ["-A OUTPUT -j RIST_OWNER"]
+    assert read("chain") == [RULE.format(uid=1001, user="rist1", ifc="modem1", mark="0x10")]
+    assert (tmp / "root" / "etc" / "sysctl.d" / "99-rist-bonding.conf").exists()
+    assert (tmp / "run" / "rist-policy.base").exists()
+
+    (fake / "lo").unlink()
+    run("--only", "modem2")
+    assert read("lo") == []  # общая часть — один раз за загрузку
+    assert read("output") == ["-A OUTPUT -j RIST_OWNER"]
+    assert len(read("chain")) == 2
+
+
+def test_only_replaces_stale_rule_of_its_uid(policy):
+    run, read, fake, tmp = policy
+    run("--only", "modem1")
+    other = RULE.format(uid=1002, user="rist2", ifc="modem2", mark="0x11")
+    (fake / "chain").write_text('-A RIST_OWNER -m owner --uid-owner 1001 -j MARK --set-xmark 0x99/0xffffffff\n'
+                                + other + "\n")
+    (fake / "ipt").unlink()
+    run("--only", "modem1")
+    assert read("chain") == [other, RULE.format(uid=1001, user="rist1", ifc="modem1", mark="0x10")]
+    assert [l.split()[0] for l in read("ipt")] == ["*mangle", "-D", "-A", "COMMIT"]  # один батч
+
+    (fake / "ipt").unlink()
+    run("--only", "modem1")
+    assert read("ipt") == []  # правило уже такое — iptables-restore не зовём
+
+
+def test_only_flushes_conntrack_by_tuple(policy):
+    run, read, fake, tmp = policy
+    (fake / "route.modem1").write_text("default via 192.168.8.1 dev modem1 src 192.168.8.199\n")
+    run("--only", "modem1")
+    ct = read("conntrack")
+    assert not any("--mark" in c for c in ct)
+    assert "-D -p udp --orig-dst 10.255.0.1 --dport 8000" in ct
+    for a in ("192.168.8.199", "192.168.8.50"):  # прежний адрес модема (DHCP сменил) и нынешний
+        assert f"-D -p udp --orig-src {a} --orig-dst 83.222.26.3 --dport 8000" in ct
+        assert f"-D -p udp --orig-dst 83.222.26.3 --dport 8000 --reply-dst {a}" in ct
@@ -0,0 +1,26 @@
+import json
+
+import entrypoint as ep
+
+
+def _line(**stats):
+    return json.dumps({"sender-stats": {"peer": {"cname": "m1", "stats": stats}}})
+
+
+def test_parse_rist_stats():
+    cname, st = ep.parse_rist_stats(_line(sent=1000, retransmitted=25, quality=97.5, bandwidth=4200000, rtt=31))
+    assert cname == "m1"
+    assert st["rate_kbps"] == 4200.0
+    assert st["retransmit_pct"] == 2.5
+    assert st["loss_pct"] == 2.5
+    assert st["rtt_ms"] == 31.0
+
+
+def test_parse_rist_stats_with_log_prefix_and_idle_peer():
+    cname, st = ep.parse_rist_stats("[INFO] " + _line(sent=0, retransmitted=0))
+    assert cname == "m1" and st["retransmit_pct"] == 0.0 and st["loss_pct"] == 0.0
+
+
+def test_parse_rist_stats_ignores_other_lines():
+    assert ep.parse_rist_stats("[INFO] Peer connected") is None
+    assert ep.parse_rist_stats('"sender-stats" {broken') is None
@@ -0,0 +1,30 @@
+import subprocess
+
+import pytest
+
+import entrypoint as ep
+
+
+def test_parse_and_format_cpu_lists():
+    assert ep._parse_cpus("2-3,6") == {2, 3, 6} and ep._parse_cpus([1, "4"]) == {1, 4}
+    assert ep._parse_cpus(5) == {5} and ep._parse_cpus(None) == set()
+    assert ep._fmt_cpus({0, 1, 2, 5, 7, 8}) == "0-2,5,7-8"
+
+
+def test_nothing_to_apply_is_no_preexec():
+    assert ep.sched_preexec({}) is None
+    assert ep.chain_preexec(None, None) is None
+
+
+@pytest.mark.skipif(not ep._IOPRIO_NR, reason="ioprio syscall numbers unknown for this arch")
+def test_child_gets_requested_scheduling():
+    cpu = min(ep._ALL_CPUS)
+    fn = ep.sched_preexec({"cpus": [cpu], "nice": 5, "policy": "batch", "ioprio_class": "idle"})
+    p = subprocess.Popen(["sleep", "5"], preexec_fn=fn)
+    try:
+        st = ep.sched_state(p.pid)
+    finally:
+        p.kill()
+        p.wait()
+    assert st["cpus"] == str(cpu) and st["nice"] == 5
+    assert st["policy"] == "batch" and st["ioprio"].startswith("idle/")
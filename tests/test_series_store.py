@@ -0,0 +1,26 @@
+from entrypoint import SeriesStore
+
+
+def test_query_picks_finest_covering_tier():
+    h = SeriesStore(((1, 10), (10, 10)))
+    for t in range(100, 120):
+        h.add("cpu", t, t)
+    step, pts = h.query("cpu", 5, now=119)
+    assert step == 1 and [p[0] for p in pts] == list(range(114, 120))
+    step, pts = h.query("cpu", 60, now=119)
+    assert step == 10
+    assert pts == [[100, 104.5, 109.0], [110, 114.5, 119.0]]  # среднее и максимум бакета
+
+
+def test_ring_overwrites_stale_buckets():
+    h = SeriesStore(((1, 4),))
+    h.add("x", 1.0, 10)
+    h.add("x", 2.0, 14)  # тот же слот, бакет новее
+    assert h.query("x", 4, now=14)[1] == [[14, 2.0, 2.0]]
+    assert h.query("x", 4, now=30)[1] == []  # всё старше окна
+
+
+def test_none_and_unknown_keys():
+    h = SeriesStore()
+    h.add("x", None, 1)
+    assert h.keys() == [] and h.query("x", 60, now=1) == (1, [])
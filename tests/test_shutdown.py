@@ -0,0 +1,43 @@
+import socket, subprocess, sys, time
+
+import entrypoint as ep
+
+
+def _spawn(script):
+    # как popen_logged: у ребёнка своя группа процессов
+    return subprocess.Popen(["sh", "-c", script], start_new_session=True)
+
+
+def test_group_with_orphaned_child_is_emptied():
+    p = _spawn("sleep 30 & exit 0")
+    p.wait()
+    assert ep._live_groups({p.pid}) == {p.pid}  # лидер умер, sleep остался в группе
+    assert ep.kill_procs([p], timeout=2.0) == []
+    assert ep._live_groups({p.pid}) == set()
+
+
+def test_stubborn_processes_share_one_deadline():
+    ps = [_spawn('trap "" TERM; sleep 30') for _ in range(3)]
+    time.sleep(0.1)
+    t0 = time.monotonic()
+    assert ep.kill_procs(ps + [None], timeout=0.5) == []
+    assert time.monotonic() - t0 < 1.4  # не 3 × timeout
+    assert all(p.wait(1) == -9 for p in ps)
+
+
+def test_busy_ports_ignores_own_sockets():
+    own = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    own.bind(("127.0.0.1", 0))
+    mine = own.getsockname()[1]
+    other = subprocess.Popen([sys.executable, "-c",
+                              "import socket,sys,time; s=socket.socket(2,2); s.bind(('127.0.0.1',0));"
+                              "print(s.getsockname()[1], flush=True); time.sleep(30)"],
+                             stdout=subprocess.PIPE, text=True)
+    try:
+        theirs = int(other.stdout.readline())
+        assert ep._busy_ports({mine, theirs}) == {theirs}
+    finally:
+        other.kill()
+        other.wait()
+        own.close()
+    assert ep._wait_ports_free({theirs}, 2.0) == set()
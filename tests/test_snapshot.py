@@ -0,0 +1,39 @@
+from collections import OrderedDict
+
+import entrypoint as ep
+
+RTMP = {"ffmpeg": {"tee": {"publish_rtmp_copy": True, "publish_rtmp_url": "rtmp://127.0.0.1:1935/live/obs"}}}
+
+
+def _snap(**pc):
+    return {**RTMP, "preview": {"mode": "snapshot", **pc}}
+
+
+def test_snapshot_replaces_rtmp_copy():
+    assert ep._rtmp_target(RTMP) == ("127.0.0.1", 1935)
+    assert ep._rtmp_target(_snap()) is None
+    assert ep.build_snapshot_cmd(RTMP, "/tmp/x.jpg") is None
+
+
+def test_snapshot_cmd_reads_third_tee_port():
+    cmd = ep.build_snapshot_cmd(_snap(fps=0.5, width=320), "/tmp/x.jpg")
+    assert "udp://127.0.0.1:10002?overrun_nonfatal=1&fifo_size=50000" in cmd
+    assert cmd[cmd.index("-skip_frame") + 1] == "nokey" and "fps=0.5,scale=320:-2" in cmd
+    assert cmd[-1] == "/tmp/x.jpg"
+    assert ep._snapshot_port(_snap(port=12345)) == 12345
+    assert ep._snapshot_sched(_snap())["nice"] == 10
+
+
+def test_preview_jpg_conditional_get(tmp_path, monkeypatch):
+    monkeypatch.setattr(ep, "PREVIEW_DIR", str(tmp_path))
+    st = ep.Stream("main")
+    st.cfg = _snap(fps=0.25)
+    monkeypatch.setattr(ep, "streams", OrderedDict(main=st))
+    c = ep.app.test_client()
+    assert c.get("/preview.jpg").status_code == 404  # снимка ещё нет
+    (tmp_path / "main.jpg").write_bytes(b"\xff\xd8jpeg")
+    r = c.get("/preview.jpg")
+    assert r.status_code == 200 and r.data == b"\xff\xd8jpeg" and r.cache_control.max_age == 4
+    assert c.get("/preview.jpg", headers={"If-None-Match": r.headers["ETag"]}).status_code == 304
+    st.cfg = RTMP
+    assert c.get("/preview.jpg").status_code == 404
@@ -0,0 +1,64 @@
+import threading, time
+from types import SimpleNamespace
+
+import pytest
+
+import entrypoint as ep
+
+
+def _later(delay, fn):
+    threading.Timer(delay, fn).start()
+
+
+@pytest.fixture
+def stream(monkeypatch):
+    st = ep.Stream("main")
+    st.cfg = {"mediamtx": {"enable": False}, "startup": {"ready_timeout_sec": 3.0},
+              "rist": {"senders": [{"cname": "m0"}, {"cname": "m1"}]}}
+    st.shim = SimpleNamespace(last_tx=None)
+    calls = []
+
+    def start_ffmpeg(s):
+        calls.append(("ffmpeg", time.monotonic()))
+        _later(0.2, lambda: setattr(s.shim, "last_tx", time.monotonic()))  # первый TS на входе
+
+    def start_rist(s):
+        calls.append(("rist", time.monotonic()))
+        p = SimpleNamespace(name="rist", started_at=time.monotonic(), first_sent=None, handshakes=0,
+                            peers_up=set(), poll=lambda: None)
+        s.procs["rist"] = [p]
+        _later(0.1, lambda: setattr(p, "handshakes", 2))
+        # статистика покажет sent > 0, если на вход пришёл TS
+        _later(0.4, lambda: s.shim.last_tx and setattr(p, "first_sent", time.monotonic()))
+    monkeypatch.setattr(ep, "_start_ffmpeg", start_ffmpeg)
+    monkeypatch.setattr(ep, "_start_rist", start_rist)
+    monkeypatch.setattr(ep, "_start_snapshot", lambda s: None)
+    monkeypatch.setattr(ep, "_start_mediamtx", lambda cfg: None)
+    monkeypatch.setattr(ep, "startup_stats", {})
+    return st, calls
+
+
+def test_ffmpeg_and_rist_start_in_parallel(stream):
+    st, calls = stream
+    ep._run_startup(st.cfg, [st])
+    (_, t_ff), (_, t_rist) = sorted(calls)
+    assert abs(t_ff - t_rist) < 0.1  # ristsender не ждёт первого TS от FFmpeg
+    steps = ep.startup_stats["steps"]
+    assert all(s["ready"] for s in steps.values())
+    assert steps["first_packet"]["start_s"] >= max(steps["ffmpeg"]["ready_s"], steps["rist"]["ready_s"])
+
+
+def test_ttfp_is_first_delivery_not_process_start(stream):
+    st, _ = stream
+    ep._run_startup(st.cfg, [st])
+    # пир на связи с 0.1 с, TS на входе с 0.2 с — доставка засчитывается по первому из признаков
+    assert 0.15 <= st.startup["ttfp_s"] < 0.4
+    assert ep.startup_stats["ttfp_s"] == st.startup["ttfp_s"]
+
+
+def test_no_delivery_means_no_ttfp(stream, monkeypatch):
+    st, _ = stream
+    st.cfg["startup"]["ready_timeout_sec"] = 0.5
+    monkeypatch.setattr(ep, "_start_ffmpeg", lambda s: None)  # FFmpeg так и не дал TS
+    ep._run_startup(st.cfg, [st])
+    assert st.startup["ttfp_s"] is None
@@ -0,0 +1,37 @@
+import entrypoint as ep
+
+
+def _cfg(*streams):
+    return {"rist": {"senders": [{"cname": "m0"}, {"cname": "m1"}]}, "streams": list(streams)}
+
+
+def _ports(base):
+    return {"ffmpeg": {"tee": {"udp_ports": [base, base + 1]}}}
+
+
+def test_streams_overlay_top_level():
+    out, problems = ep.stream_cfgs(_cfg({"id": "a", **_ports(11000)},
+                                        {"id": "b", **_ports(12000), "rist": {"senders": [{"cname": "b0"}]}}))
+    assert problems == [] and list(out) == ["a", "b"]
+    assert [s["cname"] for s in out["b"]["cfg"]["rist"]["senders"]] == ["b0"]
+    assert out["a"]["cfg"]["ffmpeg"]["tee"]["udp_ports"] == [11000, 11001]
+
+
+def test_no_streams_section_is_main():
+    out, problems = ep.stream_cfgs({"rist": {"senders": [{"cname": "m0"}, {"cname": "m0"}]}})
+    assert list(out) == ["main"] and problems == []  # повтор внутри потока — не конфликт
+
+
+def test_clashing_streams_are_skipped():
+    out, problems = ep.stream_cfgs(_cfg({"id": "a", **_ports(11000)},
+                                        {"id": "a", **_ports(13000)},
+                                        {"id": "b", **_ports(11001)},
+                                        {"id": "c", **_ports(12000)}))
+    assert list(out) == ["a"]
+    assert [p.split(":")[0] for p in problems] == ["a", "b", "c"]
+    assert "already used by stream a" in problems[1] and "cnames ['m0', 'm1']" in problems[2]
+
+
+def test_cpu_budget_caps_encoder_threads():
+    out, _ = ep.stream_cfgs(_cfg({"id": "a", "cpu_budget": 1.5, **_ports(11000)}))
+    assert out["a"]["cpu_budget"] == 1.5 and out["a"]["cfg"]["video"]["threads"] == 2
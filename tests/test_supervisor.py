@@ -0,0 +1,70 @@
+from collections import deque
+
+import pytest
+
+import entrypoint as ep
+
+
+class Proc:
+    def __init__(self, started_at, last_output=None):
+        self.started_at, self.last_output = started_at, last_output
+        self.rc = self.exited_at = None
+
+    def poll(self):
+        return self.rc
+
+
+@pytest.fixture
+def sup(monkeypatch):
+    monkeypatch.setattr(ep, "_sup", {})
+    monkeypatch.setattr(ep, "incidents", deque(maxlen=100))
+    killed, started = [], []
+    monkeypatch.setattr(ep, "kill_proc", killed.append)
+    monkeypatch.setattr(ep, "_start_unit", lambda kind, st: started.append(kind))
+    return ep.Stream("main"), ep._sup_cfg({}), killed, started
+
+
+def test_stalled_sender_is_killed_and_restarted_with_backoff(sup):
+    st, sc, killed, started = sup
+    p = Proc(0.0, last_output=1.0)
+    st.procs["rist"] = [p]
+    ep._supervise_one("rist", st, "rist", sc, 5.0)
+    assert killed == [] and ep._sup["rist"]["incident"] is None  # 4 с тишины — ещё в пределах
+    ep._supervise_one("rist", st, "rist", sc, 6.5)
+    assert killed == [p] and ep.incidents[-1]["kind"] == "stall" and ep.incidents[-1]["detect_s"] == 5.5
+    ep._supervise_one("rist", st, "rist", sc, 6.9)
+    assert started == []  # backoff_min_sec 0.5
+    ep._supervise_one("rist", st, "rist", sc, 7.0)
+    assert started == ["rist"] and ep._sup["rist"]["attempts"] == 1
+
+
+def test_crash_then_recovery_closes_incident(sup):
+    st, sc, killed, started = sup
+    p = Proc(0.0, last_output=0.5)
+    p.rc, p.exited_at = 1, 2.0
+    st.procs["rist"] = [p]
+    ep._supervise_one("rist", st, "rist", sc, 2.1)
+    inc = ep.incidents[-1]
+    assert inc["kind"] == "crash" and inc["rc"] == 1 and killed == []
+    ep._supervise_one("rist", st, "rist", sc, 2.7)
+    assert started == ["rist"] and inc["restarts"] == 1
+    st.procs["rist"] = [Proc(2.7, last_output=3.0)]
+    ep._supervise_one("rist", st, "rist", sc, 3.1)
+    assert inc["recover_s"] == 1.0 and ep._sup["rist"]["incident"] is None
+
+
+def test_backoff_doubles_and_caps(sup):
+    st, sc, _, _ = sup
+    ep._sup["rist"] = {"attempts": 10, "incident": None, "next_at": None}
+    p = Proc(0.0)
+    p.rc = 1
+    st.procs["rist"] = [p]
+    ep._supervise_one("rist", st, "rist", sc, 100.0)
+    assert ep._sup["rist"]["next_at"] == 100.0 + sc["backoff_max_sec"]
+
+
+def test_no_sender_running(sup):
+    st, sc, killed, started = sup
+    assert ep._managed("rist", st) is None
+    ep._supervise_one("rist", st, "rist", sc, 1.0)
+    assert killed == started == []
@@ -0,0 +1,61 @@
+from collections import deque
+
+import pytest
+
+import entrypoint as ep
+
+
+@pytest.fixture
+def trace(monkeypatch):
+    monkeypatch.setattr(ep, "_trace", {"on": True, "forced": False, "buf": deque(maxlen=100)})
+    return ep._trace
+
+
+def test_disabled_span_is_shared_noop(trace):
+    trace["on"] = False
+    with ep.span("x", a=1) as sp:
+        sp.set(b=2)
+    ep.trace_event("ready")
+    assert sp is ep._NO_SPAN and not trace["buf"]
+
+
+def test_span_records_args_errors_and_ctx(trace):
+    ep._trace_ctx.v = "job 7"
+    try:
+        with ep.span("kill_proc", pid=42) as sp:
+            sp.set(killed=True)
+        with pytest.raises(KeyError), ep.span("boom"):
+            raise KeyError
+    finally:
+        ep._trace_ctx.v = None
+    (n1, _, d1, _, c1, a1), (n2, _, _, _, _, a2) = trace["buf"]
+    assert (n1, c1, a1) == ("kill_proc", "job 7", {"pid": 42, "killed": True}) and d1 >= 0
+    assert (n2, a2) == ("boom", {"error": "KeyError"})
+
+
+def test_traced_wraps_only_when_on(trace):
+    @ep.traced("work")
+    def work(x):
+        return x * 2
+    assert work(2) == 4 and [s[0] for s in trace["buf"]] == ["work"]
+    trace["on"] = False
+    assert work(3) == 6 and len(trace["buf"]) == 1
+
+
+def test_configure_resizes_buffer_and_keeps_spans(trace):
+    ep.trace_event("a")
+    ep.trace_configure({"debug": {"trace": True, "trace_buffer": 500}})
+    assert trace["buf"].maxlen == 500 and [s[0] for s in trace["buf"]] == ["a"]
+    ep.trace_configure({})
+    assert trace["on"] is False
+
+
+def test_timeline_endpoint(trace):
+    c = ep.app.test_client()
+    c.post("/debug/timeline", data={"clear": "1"})  # сам POST — тоже спан "http"
+    ep.trace_event("ready.peer", cname="m0")
+    tl = c.get("/debug/timeline").get_json()
+    assert [s["name"] for s in tl["spans"]] == ["http", "ready.peer"]
+    assert tl["summary"]["http"]["count"] == 1 and "ready.peer" not in tl["summary"]
+    ev = c.get("/debug/timeline?format=chrome").get_json()["traceEvents"]
+    assert {e["ph"] for e in ev} == {"X", "i", "M"}
@@ -0,0 +1,102 @@
+import socket, time
+
+import pytest
+
+import entrypoint as ep
+from entrypoint import RF_KEY, RF_PCR, TsRing
+
+
+@pytest.fixture
+def base(tmp_path):
+    return str(tmp_path / "ring")
+
+
+def _bytes(n, start=0):
+    return bytes((start + i) % 251 for i in range(n))
+
+
+def test_append_wraps_and_old_entries_drop(base):
+    r = TsRing(base, 1000, 8)
+    stream = _bytes(1200)
+    r.append(stream[:600])
+    r.add(0, 1, 0, RF_KEY)
+    r.add(300, 2, 0, RF_KEY)
+    r.append(stream[600:])
+    assert r.head() == (1200, 2)
+    assert [e[0] for e in r.entries()] == [300]  # байты с 0 по 200 затёрты
+    assert r.oldest()[0] == 300
+    assert b"".join(r.read(300, 1200, chunk=128)) == stream[300:]
+    r.close()
+
+
+def test_index_ring_keeps_last_cap_entries(base):
+    r = TsRing(base, 1000, 4)
+    r.append(_bytes(100))
+    for i in range(6):
+        r.add(i * 10, i, 0, 0)
+    assert [e[1] for e in r.entries()] == [2, 3, 4, 5]
+    r.close()
+
+
+def test_clip_starts_at_keyframe(base):
+    r = TsRing(base, 10000, 16)
+    r.append(_bytes(4000))
+    for off, t, fl in ((0, 100, RF_KEY), (1000, 200, RF_KEY), (1500, 250, RF_PCR),
+                       (2000, 300, RF_KEY), (3000, 400, RF_PCR)):
+        r.add(off, t, 0, fl)
+    assert r.clip(260, 280) == (1000, 2000, 200)   # от ключевого кадра до первой записи после t_to
+    assert r.clip(50, 90) is None                   # ключевых кадров раньше t_to нет
+    assert r.clip(10, 150) == (0, 1000, 100)
+    assert r.clip(350, 500) == (2000, 4000, 300)    # до конца записанного
+    r.close()
+
+
+def test_reopen_resumes_or_resets(base):
+    r = TsRing(base, 1000, 8)
+    r.append(_bytes(500))
+    r.add(100, 7, 0, RF_KEY)
+    r.flush()
+    r.close()
+    ro = TsRing(base)
+    assert not ro.writable and ro.head() == (500, 1) and ro.entries() == [(100, 7, 0, RF_KEY)]
+    ro.close()
+    r = TsRing(base, 1000, 8)
+    assert r.resumed and r.written == 500
+    r.close()
+    r = TsRing(base, 2000, 8)
+    assert not r.resumed and r.head() == (0, 0)
+    r.close()
+
+
+def test_foreign_file_is_rejected(base):
+    with open(base + ".idx", "wb") as f:
+        f.write(b"x" * 64)
+    open(base + ".ts", "wb").close()
+    with pytest.raises(ValueError):
+        TsRing(base)
+
+
+def _pkt(b1, b2, b3, body=b""):
+    return bytes((0x47, b1, b2, b3)) + body + b"\xff" * (184 - len(body))
+
+
+def test_recorder_indexes_keyframe_at_its_pat(base):
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    rec = ep.TsRecorder(port, base, 188 * 100, 16, 1.0)
+    pcr = (1000 << 15).to_bytes(6, "big")
+    pat = _pkt(0x40, 0x00, 0x10)
+    key = _pkt(0x41, 0x00, 0x30, bytes((7, 0x50)) + pcr + b"\0\0\1\xe0")  # RAI + PCR, начало PES видео
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as tx:
+        tx.sendto(_pkt(0x01, 0x00, 0x10) + pat + key, ("127.0.0.1", port))
+        for _ in range(200):
+            if rec.datagrams:
+                break
+            time.sleep(0.01)
+    rec.close()
+    r = TsRing(base)
+    es = r.entries()
+    assert [(e[0], e[3]) for e in es] == [(0, ep.RF_GAP), (188, RF_KEY | RF_PCR)]
+    assert es[1][2] == 1000 * 300
+    r.close()